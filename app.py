@@ -3,7 +3,7 @@ import os
 import pandas as pd
 from flask import (
     Flask, render_template, request, redirect, url_for, flash,
-    jsonify, session, send_file
+    jsonify, session, send_file, g, make_response
 )
 # *** Import Session ***
 from flask_session import Session
@@ -16,19 +16,42 @@ from datetime import datetime, timedelta, date, timezone # For session expiratio
 import re
 import numpy as np
 import json
-from collections import Counter # For counting dtypes
+from collections import Counter, OrderedDict, deque # For counting dtypes / LRU cache
 import math
 import plotly.express as px
 import plotly.io as pio
 import plotly.figure_factory as ff
 import webbrowser
 import threading
+import weakref
 import requests
 from packaging import version
 import signal
 import subprocess
 import logging
 import time
+import shutil
+import pickle
+import base64
+import hashlib
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.feather as feather
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.json as pa_json
+import csv
+import codecs
+import tempfile
+import gzip
+import bz2
+import lzma
+import zipfile
+import multiprocessing
+import concurrent.futures
+from xml.etree import ElementTree
+import warnings
+from werkzeug.sansio.multipart import MultipartDecoder, NeedData, Field, File, Data, Epilogue
 
 
 def resource_path(relative_path):
@@ -72,6 +95,25 @@ except ImportError:
     STATSMODELS_DIAG_AVAILABLE = False
 # ***************************
 
+try:
+    import psutil # Optional: resident memory figures for history instrumentation
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+try:
+    # Internal pandas API: the exact cell formatting DataFrame.to_html uses, for the fast preview renderer
+    from pandas.io.formats.format import format_array as pandas_format_array
+    PANDAS_FORMAT_ARRAY_AVAILABLE = True
+except ImportError:
+    PANDAS_FORMAT_ARRAY_AVAILABLE = False
+
+try:
+    import python_calamine # Optional: Rust XLSX reader, much faster than openpyxl for large sheets
+    CALAMINE_AVAILABLE = True
+except ImportError:
+    CALAMINE_AVAILABLE = False
+
 try:
     from sklearn.preprocessing import StandardScaler
     from sklearn.decomposition import PCA
@@ -136,7 +178,11 @@ def shutdown_server():
 # --- Configuration ---
 UPLOAD_FOLDER = 'uploads'
 SAVED_SESSIONS_FOLDER = 'saved_sessions'
-ALLOWED_EXTENSIONS = {'csv', 'tsv', 'xlsx'}
+DATASET_STORE_FOLDER = 'dataset_store' # Server-side dataset versions, one sub-folder per session
+INGEST_CACHE_FOLDER = 'ingest_cache' # Parsed uploads keyed by content hash
+ALLOWED_EXTENSIONS = {'csv', 'tsv', 'xlsx', 'parquet', 'feather', 'arrow', 'jsonl', 'ndjson', 'zip'}
+COMPRESSION_EXTENSIONS = {'gz', 'bz2', 'xz', 'zst'} # e.g. data.csv.gz; decompressed while streaming
+COMPRESSIBLE_EXTENSIONS = {'csv', 'tsv', 'jsonl', 'ndjson'} # Formats accepted compressed and inside zip archives
 
 template_folder = resource_path('templates')
 static_folder = resource_path('static')
@@ -144,6 +190,26 @@ app = Flask(__name__, template_folder=template_folder, static_folder=static_fold
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['SAVED_SESSIONS_FOLDER'] = SAVED_SESSIONS_FOLDER
+app.config['DATASET_STORE_FOLDER'] = DATASET_STORE_FOLDER
+app.config['INGEST_CACHE_FOLDER'] = INGEST_CACHE_FOLDER
+app.config['DATAFRAME_CACHE_MAX_BYTES'] = 1024 * 1024 * 1024 # Budget for live DataFrames kept in memory (1 GB)
+app.config['HISTORY_MAX_STEPS'] = 200 # Undo/redo depth per dataset
+app.config['HISTORY_CHECKPOINT_INTERVAL'] = 10 # Write a full version every N logged steps
+app.config['HISTORY_HOT_STEPS'] = 3 # Undo/redo steps kept uncompressed; older ones spill to cold storage
+app.config['GRID_PAGE_SIZE'] = 200 # Rows per page served to the data grid
+app.config['GRID_MAX_PAGE_SIZE'] = 2000 # Largest page a client may request
+app.config['PREVIEW_CACHE_MAX_BYTES'] = 64 * 1024 * 1024 # Budget for rendered grid pages and table HTML
+app.config['INGEST_CHUNK_BYTES'] = 4 * 1024 * 1024 # Upload bytes read and parsed per step; bounds ingest memory
+app.config['INGEST_SQL_CHUNK_ROWS'] = 50000 # Rows fetched per step by database queries
+app.config['INGEST_JOB_TTL_SECONDS'] = 3600 # Unclaimed finished load jobs (and their data) are dropped after this
+app.config['INGEST_CACHE_MAX_BYTES'] = 2 * 1024 * 1024 * 1024 # Disk budget for parsed uploads kept for re-uploads (2 GB)
+app.config['INGEST_CACHE_PROBE_BYTES'] = 1024 * 1024 # Leading bytes hashed to spot likely re-uploads early
+app.config['LARGE_DATASET_BYTES'] = 512 * 1024 * 1024 # Versions with more column data than this are processed out of core
+app.config['LARGE_DATASET_CHUNK_ROWS'] = 250000 # Rows per chunk when a large version is processed out of core
+app.config['LARGE_DATASET_SPILL_BYTES'] = 64 * 1024 * 1024 # Target size of one spill bucket for duplicate detection
+app.config['INGEST_OPTIMIZE_DTYPES'] = True # Store loaded columns in the smallest dtype that holds them exactly
+app.config['INGEST_CONVERT_TEXT_DTYPES'] = True # Also load repetitive text as category and ISO date text as datetime64
+app.config['XLSX_SHEET_WORKERS'] = min(4, os.cpu_count() or 1) # Worker processes reading picked workbook sheets in parallel
 # IMPORTANT: Change this to a strong, persistent secret key in production!
 # Keep it outside version control.
 
@@ -197,7 +263,7 @@ if not os.path.exists(app.config['SESSION_FILE_DIR']):
 
 
 # Create directories if they don't exist
-for folder in [UPLOAD_FOLDER, SAVED_SESSIONS_FOLDER]:
+for folder in [UPLOAD_FOLDER, SAVED_SESSIONS_FOLDER, DATASET_STORE_FOLDER, INGEST_CACHE_FOLDER]:
     if not os.path.exists(folder):
         os.makedirs(folder)
 
@@ -456,92 +522,2913 @@ def inject_user():
 
 # --- Helper Functions ---
 
+def split_upload_extension(filename):
+    """(format extension, compression extension or None) of a file name, e.g. ('csv', 'gz') for data.csv.gz."""
+    parts = filename.lower().rsplit('.', 2)
+    if len(parts) == 3 and parts[2] in COMPRESSION_EXTENSIONS:
+        return parts[1], parts[2]
+    return (parts[-1] if len(parts) > 1 else ''), None
+
 def allowed_file(filename):
-    """Checks if the file extension is allowed."""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    file_ext, compression = split_upload_extension(filename)
+    if compression:
+        return file_ext in COMPRESSIBLE_EXTENSIONS
+    return file_ext in ALLOWED_EXTENSIONS
+
+def format_memory_size(num_bytes):
+    """Formats a byte count the way column statistics show memory usage (B, KB or MB)."""
+    if num_bytes < 1024:
+        return f"{num_bytes} B"
+    elif num_bytes < 1024**2:
+        return f"{num_bytes/1024:.2f} KB"
+    return f"{num_bytes/(1024**2):.2f} MB"
+
+# --- Dataset Store ---
+# The working DataFrame is no longer serialized into the Flask session. Each
+# loaded dataset gets a folder under DATASET_STORE_FOLDER/<store id>/ laid out
+# as a copy-on-write column store:
+#   columns/<id>.arrow        immutable single-column Arrow IPC files
+#   rows/<id>.arrow           row positions, shared after rows are removed
+#   <version>.manifest.json   ordered references to column/rows files
+#   oplog.jsonl               append-only log of replayable cleaning steps
+#   state.json                current version and undo/redo stacks
+#   cold/columns, cold/rows   zstd-compressed files only older history uses
+# A version is just a manifest, so unchanged columns are shared by every
+# version that uses them and switching versions only maps O(columns) files.
+# Versions produced by replayable steps (/clean_operation, /auto_clean,
+# /optimize_categories) are only logged; every HISTORY_CHECKPOINT_INTERVAL steps
+# a manifest is written as a checkpoint and other versions are rebuilt by
+# replaying the log from the nearest checkpoint.
+# Column files are uncompressed and read memory-mapped, so numeric columns
+# reach pandas without copying and threads viewing the same version share the
+# OS page cache. The session itself only keeps identity, small settings and a
+# reference to the store: {'store_id': ...}.
+
+DATASET_VERSION_EXT = '.manifest.json'
+
+def get_dataset_store_dir(store_id):
+    """Returns the folder holding all dataset versions for a store id."""
+    return os.path.join(app.config['DATASET_STORE_FOLDER'], secure_filename(str(store_id)))
+
+def get_dataset_version_path(store_id, version):
+    return os.path.join(get_dataset_store_dir(store_id), f"{int(version)}{DATASET_VERSION_EXT}")
+
+def get_dataset_column_path(store_id, column_id, cold=False):
+    return _get_store_file_path(store_id, 'columns', column_id, cold)
+
+def get_dataset_rows_path(store_id, rows_id, cold=False):
+    return _get_store_file_path(store_id, 'rows', rows_id, cold)
+
+def _get_store_file_path(store_id, kind, file_id, cold=False):
+    parts = ['cold', kind] if cold else [kind]
+    return os.path.join(get_dataset_store_dir(store_id), *parts, f"{file_id}.arrow")
+
+def get_dataset_log_path(store_id):
+    return os.path.join(get_dataset_store_dir(store_id), 'oplog.jsonl')
+
+def get_dataset_state_path(store_id):
+    return os.path.join(get_dataset_store_dir(store_id), 'state.json')
+
+def new_dataset_store_id():
+    """
+    Each loaded dataset gets its own folder, so file names are never reused
+    while an older memory-mapped version may still be open.
+    """
+    return f"{getattr(session, 'sid', None) or 'anon'}-{uuid.uuid4().hex[:8]}"
+
+def get_dataset_handle():
+    """Returns the small handle referencing the current dataset, or None."""
+    return session.get('dataset_handle')
+
+def _empty_dataset_state():
+    return {'version': None, 'latest': 0, 'undo': [], 'redo': []}
+
+def load_dataset_state():
+    """Reads the version pointer and undo/redo stacks for the current dataset."""
+    handle = get_dataset_handle()
+    if not handle:
+        return _empty_dataset_state()
+    try:
+        with open(get_dataset_state_path(handle['store_id']), 'r') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return _empty_dataset_state()
+    for key, default in _empty_dataset_state().items():
+        state.setdefault(key, default)
+    return state
+
+def save_dataset_state(state):
+    """Atomically writes the version pointer and undo/redo stacks to the store."""
+    handle = get_dataset_handle()
+    if not handle:
+        return
+    store_dir = get_dataset_store_dir(handle['store_id'])
+    os.makedirs(store_dir, exist_ok=True)
+    _write_json_atomic(get_dataset_state_path(handle['store_id']), state)
+
+def get_current_dataset_version():
+    return load_dataset_state()['version']
+
+def _write_json_atomic(path, data):
+    tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def _write_arrow_atomic(path, table):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        # Uncompressed so the file can be memory-mapped and used in place
+        feather.write_feather(table, tmp_path, compression='uncompressed')
+        os.replace(tmp_path, path) # Atomic swap so readers never see a partial file
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+# Manifests record the real column names and exact pandas dtypes, so
+# non-string and duplicate column names survive. Object columns Arrow cannot
+# represent (mixed Python types, e.g. numbers and strings after a fill) are
+# stored as pickled values and restored element by element.
+
+def _encode_column_name(name):
+    if isinstance(name, np.generic):
+        name = name.item()
+    if name is None or isinstance(name, (str, int, float, bool)):
+        return {'value': name}
+    return {'pickle': base64.b64encode(pickle.dumps(name)).decode('ascii')}
+
+def _decode_column_name(spec):
+    if 'pickle' in spec:
+        return pickle.loads(base64.b64decode(spec['pickle']))
+    return spec['value']
+
+def _arrow_can_store(series):
+    try:
+        pa.Array.from_pandas(series)
+        return True
+    except (pa.ArrowTypeError, pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        return False
+
+def arrow_table_to_pandas(table):
+    """
+    Converts an Arrow table to pandas without consolidating columns into
+    2D blocks, which lets numeric columns share the Arrow buffers.
+    """
+    return table.to_pandas(split_blocks=True)
+
+def write_dataset_column(store_id, series):
+    """Writes one immutable column file and returns a reference to it."""
+    series = series.reset_index(drop=True)
+    storage = 'arrow'
+    if pd.api.types.is_object_dtype(series.dtype) and not _arrow_can_store(series):
+        storage = 'pickle'
+        series = series.map(lambda v: None if v is None else pickle.dumps(v))
+    column_id = uuid.uuid4().hex
+    table = pa.Table.from_pandas(series.to_frame('values'), preserve_index=False)
+    _write_arrow_atomic(get_dataset_column_path(store_id, column_id), table)
+    return {'column': column_id, 'dtype': str(series.dtype) if storage == 'arrow' else 'object',
+            'storage': storage, 'rows': None}
+
+def write_dataset_rows(store_id, positions):
+    rows_id = uuid.uuid4().hex
+    table = pa.table({'positions': pa.array(positions, type=pa.int64())})
+    _write_arrow_atomic(get_dataset_rows_path(store_id, rows_id), table)
+    return rows_id
+
+def read_dataset_rows(store_id, rows_id):
+    return read_store_table(store_id, 'rows', rows_id).column('positions').to_numpy()
+
+def restore_column_values(table, ref):
+    """Turns a (slice of a) column file back into a Series of the column's recorded dtype."""
+    series = arrow_table_to_pandas(table).iloc[:, 0]
+    column_type = table.schema.field(0).type
+    if ref['storage'] == 'pickle':
+        series = series.map(lambda v: None if v is None else pickle.loads(v)).astype(object)
+    elif str(series.dtype) != ref['dtype']:
+        try:
+            series = series.astype(ref['dtype'])
+        except (TypeError, ValueError) as e:
+            app.logger.warning(f"Could not restore dtype {ref['dtype']} for column {ref['column']}: {e}")
+    if series.dtype == object and table.column(0).null_count and \
+       (pa.types.is_string(column_type) or pa.types.is_large_string(column_type)):
+        # Missing text comes back as None; read_csv, and category columns, give NaN
+        series = series.where(series.notna(), np.nan)
+    return series
+
+def read_dataset_column(store_id, ref, rows_cache=None):
+    """Memory-maps one column reference and returns it as a Series (RangeIndex)."""
+    if 'range' in ref: # RangeIndex stored as its parameters
+        series = pd.Series(pd.RangeIndex(*ref['range']))
+    else:
+        table = read_store_table(store_id, 'columns', ref['column'])
+        series = restore_column_values(table, ref)
+    if ref.get('rows'):
+        rows_cache = rows_cache if rows_cache is not None else {}
+        if ref['rows'] not in rows_cache:
+            rows_cache[ref['rows']] = read_dataset_rows(store_id, ref['rows'])
+        series = series.take(rows_cache[ref['rows']]).reset_index(drop=True)
+    return series
+
+def _column_fingerprint(series):
+    """
+    Identifies the memory a column lives in. Under copy-on-write, a column an
+    operation did not touch still points at its parent's buffers, so matching
+    fingerprints prove a column is unchanged without comparing its values.
+    """
+    values = series._values
+    arrays = [values] if isinstance(values, np.ndarray) else [
+        getattr(values, attr) for attr in ('_ndarray', '_data', '_mask', '_codes')
+        if isinstance(getattr(values, attr, None), np.ndarray)
+    ]
+    if not arrays:
+        return None
+    return (str(series.dtype),) + tuple(
+        (arr.__array_interface__['data'][0], arr.shape, arr.strides) for arr in arrays
+    )
+
+def _diff_against_parent(df, parent_df):
+    """
+    Returns (row_positions, column_sources) describing df relative to parent_df,
+    or None when rows cannot be mapped onto the parent. row_positions is None
+    when rows are unchanged; column_sources[i] is the parent position column i
+    is shared with, or None if it has to be written.
+    """
+    if df.index.equals(parent_df.index):
+        row_positions = None
+    elif parent_df.index.is_unique and df.index.is_unique:
+        row_positions = parent_df.index.get_indexer(df.index)
+        if (row_positions < 0).any():
+            return None
+    else:
+        return None
+
+    parent_positions = {}
+    for j, name in enumerate(parent_df.columns):
+        parent_positions.setdefault(name, []).append(j)
+
+    column_sources = []
+    for i, name in enumerate(df.columns):
+        candidates = []
+        if len(parent_positions.get(name, [])) == 1:
+            candidates.append(parent_positions[name][0])
+        if i < parent_df.shape[1] and i not in candidates:
+            candidates.append(i) # Same position, e.g. a renamed column
+        new_col = df.iloc[:, i]
+        source = None
+        for j in candidates:
+            old_col = parent_df.iloc[:, j]
+            if old_col.dtype != new_col.dtype:
+                continue
+            if row_positions is None:
+                fingerprint = _column_fingerprint(new_col)
+                if fingerprint is not None and fingerprint == _column_fingerprint(old_col):
+                    source = j
+                    break
+            else:
+                old_col = old_col.take(row_positions)
+            if old_col.set_axis(df.index).equals(new_col):
+                source = j
+                break
+        column_sources.append(source)
+    return row_positions, column_sources
+
+def _index_to_ref(store_id, index):
+    if isinstance(index, pd.RangeIndex):
+        ref = {'range': [index.start, index.stop, index.step], 'rows': None}
+    else:
+        ref = write_dataset_column(store_id, index.to_series())
+    ref['name'] = _encode_column_name(index.name)
+    return ref
+
+def _index_from_ref(store_id, ref, rows_cache):
+    if 'range' in ref and not ref.get('rows'):
+        return pd.RangeIndex(*ref['range'], name=_decode_column_name(ref['name']))
+    values = read_dataset_column(store_id, ref, rows_cache)
+    return pd.Index(values, name=_decode_column_name(ref['name']), tupleize_cols=False)
+
+def write_dataset_version(store_id, version, df, parent=None, parent_df=None):
+    """
+    Writes the manifest for one dataset version. Columns unchanged since
+    `parent` are shared with it; only changed or new columns are written.
+    """
+    parent_manifest = read_dataset_manifest(store_id, parent) if parent is not None else None
+    diff = None
+    if parent_manifest is not None:
+        if parent_df is None:
+            parent_df = load_dataset_version(store_id, parent)
+        diff = _diff_against_parent(df, parent_df)
+    row_positions, column_sources = diff if diff else (None, [None] * df.shape[1])
+
+    derived_rows = {} # Parent rows id -> rows id composed with row_positions
+    def _derive(parent_ref):
+        ref = dict(parent_ref)
+        if row_positions is not None:
+            parent_rows = parent_ref.get('rows')
+            if parent_rows not in derived_rows:
+                positions = row_positions
+                if parent_rows:
+                    positions = read_dataset_rows(store_id, parent_rows)[row_positions]
+                derived_rows[parent_rows] = write_dataset_rows(store_id, positions)
+            ref['rows'] = derived_rows[parent_rows]
+        return ref
+
+    columns = []
+    for i, parent_position in enumerate(column_sources):
+        if parent_position is None:
+            ref = write_dataset_column(store_id, df.iloc[:, i])
+        else:
+            ref = _derive(parent_manifest['columns'][parent_position])
+        ref['name'] = _encode_column_name(df.columns[i])
+        columns.append(ref)
+
+    if diff and not isinstance(df.index, pd.RangeIndex):
+        index_ref = _derive(parent_manifest['index']) # Rows were mapped through the parent index
+        index_ref['name'] = _encode_column_name(df.index.name)
+    else:
+        index_ref = _index_to_ref(store_id, df.index)
+
+    manifest = {
+        'columns': columns,
+        'index': index_ref,
+        'columns_dtype': str(df.columns.dtype),
+        'shape': list(df.shape)
+    }
+    os.makedirs(get_dataset_store_dir(store_id), exist_ok=True)
+    _write_json_atomic(get_dataset_version_path(store_id, version), manifest)
+    return manifest
+
+def read_dataset_manifest(store_id, version):
+    """Returns the manifest of a version, or None if it does not exist."""
+    try:
+        with open(get_dataset_version_path(store_id, version), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def read_dataset_version(store_id, version):
+    """Assembles one dataset version from its memory-mapped column files."""
+    manifest = read_dataset_manifest(store_id, version)
+    if manifest is None:
+        raise FileNotFoundError(f"Dataset version {version} not found.")
+    rows_cache = {}
+    index = _index_from_ref(store_id, manifest['index'], rows_cache)
+    columns = [read_dataset_column(store_id, ref, rows_cache) for ref in manifest['columns']]
+    if columns:
+        df = pd.concat(columns, axis=1, ignore_index=True).set_axis(index)
+    else:
+        df = pd.DataFrame(index=index)
+    df.columns = manifest_columns_index(manifest)
+    return df
+
+def manifest_columns_index(manifest):
+    """The column labels a manifest records, with their original index dtype where possible."""
+    names = [_decode_column_name(ref['name']) for ref in manifest['columns']]
+    try:
+        return pd.Index(names, dtype=manifest.get('columns_dtype', 'object'), tupleize_cols=False)
+    except (TypeError, ValueError):
+        return pd.Index(names, dtype=object, tupleize_cols=False)
+
+def load_dataset_version(store_id, version):
+    """
+    Returns a dataset version, served from the in-memory cache when possible.
+    Versions without a manifest are rebuilt by replaying their logged step.
+    """
+    df = dataframe_cache.get((store_id, version))
+    if df is None:
+        if os.path.exists(get_dataset_version_path(store_id, version)):
+            df = read_dataset_version(store_id, version)
+        else:
+            entry = read_history_log(store_id).get(version)
+            if entry is None:
+                raise FileNotFoundError(f"Dataset version {version} not found.")
+            df = replay_history_step(load_dataset_version(store_id, entry['parent']), entry['step'])
+        dataframe_cache.put((store_id, version), df)
+    return df
+
+def append_history_log(store_id, entry):
+    os.makedirs(get_dataset_store_dir(store_id), exist_ok=True)
+    with open(get_dataset_log_path(store_id), 'a') as f:
+        f.write(json.dumps(entry) + '\n')
+
+def read_history_log(store_id):
+    """Returns the logged steps of a store keyed by the version they produced."""
+    entries = {}
+    try:
+        with open(get_dataset_log_path(store_id), 'r') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    entries[entry['version']] = entry
+    except OSError:
+        pass
+    return entries
+
+def replay_history_step(df, step):
+    """Re-runs one logged step on df and returns the resulting DataFrame."""
+    kind = step['kind']
+    if kind == 'clean_operation':
+        df, _ = apply_clean_operation(df, step['operation'], step['params'])
+    elif kind == 'auto_clean':
+        df, _ = apply_auto_clean(df, step['config'])
+    elif kind == 'optimize_categories':
+        df, _ = apply_optimize_categories(df)
+    else:
+        raise ValueError(f"Unknown history step: {kind}")
+    return df
+
+def find_history_checkpoint(store_id, version, log=None):
+    """Returns (nearest version with a manifest, number of steps to replay from it)."""
+    log = read_history_log(store_id) if log is None else log
+    steps = 0
+    while not os.path.exists(get_dataset_version_path(store_id, version)):
+        entry = log.get(version)
+        if entry is None:
+            raise FileNotFoundError(f"Dataset version {version} not found.")
+        version = entry['parent']
+        steps += 1
+    return version, steps
+
+def _history_closure(store_id, versions, log):
+    """Returns versions plus every ancestor logged versions replay from."""
+    closure = set()
+    for version in versions:
+        # Logged versions need every ancestor back to their checkpoint
+        while version is not None and version not in closure:
+            closure.add(version)
+            entry = log.get(version)
+            if entry is None or os.path.exists(get_dataset_version_path(store_id, version)):
+                break
+            version = entry['parent']
+    return closure
+
+def _manifest_files(store_id, versions):
+    """Returns the (kind, file id) pairs the manifests of `versions` reference."""
+    files = set()
+    for version in versions:
+        manifest = read_dataset_manifest(store_id, version) or {}
+        for ref in manifest.get('columns', []) + [manifest.get('index') or {}]:
+            files.add(('columns', ref.get('column')))
+            files.add(('rows', ref.get('rows')))
+    return files
+
+def prune_dataset_versions(state):
+    """
+    Deletes manifests and column files no longer reachable from the state and
+    spills files only older history needs to compressed cold storage.
+    """
+    handle = get_dataset_handle()
+    if not handle:
+        return
+    store_id = handle['store_id']
+    store_dir = get_dataset_store_dir(store_id)
+    if not os.path.isdir(store_dir):
+        return
+    log = read_history_log(store_id)
+    keep = _history_closure(store_id, [state['version']] + state['undo'] + state['redo'], log)
+    hot_steps = app.config['HISTORY_HOT_STEPS']
+    hot = _history_closure(
+        store_id, [state['version']] + state['undo'][-hot_steps:] + state['redo'][:hot_steps], log
+    )
+
+    for version in log:
+        if version not in keep:
+            dataframe_cache.discard((store_id, version))
+    for name in os.listdir(store_dir):
+        stem = name[:-len(DATASET_VERSION_EXT)] if name.endswith(DATASET_VERSION_EXT) else ''
+        if stem.isdigit() and int(stem) not in keep:
+            dataframe_cache.discard((store_id, int(stem)))
+            _remove_store_file(os.path.join(store_dir, name))
+    for version in keep - hot:
+        dataframe_cache.discard((store_id, version)) # Cold history is reloaded lazily
+
+    live_files = _manifest_files(store_id, keep)
+    hot_files = _manifest_files(store_id, hot)
+    for kind in ('columns', 'rows'):
+        for cold in (False, True):
+            kind_dir = os.path.dirname(_get_store_file_path(store_id, kind, 'x', cold))
+            if not os.path.isdir(kind_dir):
+                continue
+            for name in os.listdir(kind_dir):
+                file_id, ext = os.path.splitext(name)
+                if ext != '.arrow':
+                    continue
+                if (kind, file_id) not in live_files:
+                    _remove_store_file(os.path.join(kind_dir, name))
+                elif not cold and (kind, file_id) not in hot_files:
+                    spill_store_file(store_id, kind, file_id)
+
+def _cold_compression():
+    return 'zstd' if pa.Codec.is_available('zstd') else 'lz4'
+
+def spill_store_file(store_id, kind, file_id):
+    """Moves a column/rows file only older history uses to compressed cold storage."""
+    hot_path = _get_store_file_path(store_id, kind, file_id)
+    cold_path = _get_store_file_path(store_id, kind, file_id, cold=True)
+    try:
+        table = feather.read_table(hot_path, memory_map=False)
+        os.makedirs(os.path.dirname(cold_path), exist_ok=True)
+        tmp_path = f"{cold_path}.{uuid.uuid4().hex[:8]}.tmp"
+        feather.write_feather(table, tmp_path, compression=_cold_compression())
+        os.replace(tmp_path, cold_path)
+    except OSError as e:
+        app.logger.warning(f"Could not spill {hot_path} to cold storage: {e}")
+        return
+    _remove_store_file(hot_path)
+
+def restore_cold_store_file(store_id, kind, file_id):
+    """Returns the uncompressed path of a store file, restoring it from cold storage if needed."""
+    hot_path = _get_store_file_path(store_id, kind, file_id)
+    if os.path.exists(hot_path):
+        return hot_path
+    cold_path = _get_store_file_path(store_id, kind, file_id, cold=True)
+    try:
+        table = feather.read_table(cold_path, memory_map=False)
+    except FileNotFoundError:
+        if os.path.exists(hot_path): # Restored by a concurrent request
+            return hot_path
+        raise
+    _write_arrow_atomic(hot_path, table)
+    _remove_store_file(cold_path)
+    return hot_path
+
+def read_store_table(store_id, kind, file_id):
+    """Memory-maps a store file, wherever it currently lives."""
+    try:
+        return feather.read_table(restore_cold_store_file(store_id, kind, file_id), memory_map=True)
+    except FileNotFoundError:
+        # A concurrent prune spilled it between the check and the read; spills
+        # finish the cold copy before removing the hot file, so restore that
+        return feather.read_table(restore_cold_store_file(store_id, kind, file_id), memory_map=True)
+
+# Timings of recent undo/redo/jump requests, reported by /dataset_cache_stats
+history_timings = deque(maxlen=50)
+
+def record_history_timing(action, version, started):
+    """Logs how long a history move took and the process's resident memory."""
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    rss_mb = psutil.Process().memory_info().rss / (1024 * 1024) if PSUTIL_AVAILABLE else None
+    history_timings.append({'action': action, 'version': version, 'ms': round(elapsed_ms, 1),
+                            'rss_mb': round(rss_mb, 1) if rss_mb is not None else None})
+    app.logger.info(f"History {action} to version {version} took {elapsed_ms:.1f} ms"
+                    + (f" (RSS {rss_mb:.0f} MB)" if rss_mb is not None else ""))
+
+def _remove_store_file(path):
+    try:
+        os.remove(path)
+    except OSError as e: # e.g. still memory-mapped on Windows; retried on the next prune
+        app.logger.warning(f"Could not remove stale dataset file {path}: {e}")
+
+def delete_dataset_store(store_id):
+    dataframe_cache.discard_store(store_id)
+    preview_cache.discard_store(store_id)
+    store_dir = get_dataset_store_dir(store_id)
+    if os.path.isdir(store_dir):
+        shutil.rmtree(store_dir, ignore_errors=True)
+
+# --- Dataset Concurrency ---
+# Requests that change the dataset run one at a time per session, so two tabs
+# (or a double click) cannot both branch off the same version and race on the
+# state file. Reads need no lock: versions are immutable once written.
+_dataset_locks = weakref.WeakValueDictionary()
+_dataset_locks_guard = threading.Lock()
+
+def get_dataset_lock():
+    """Returns the lock shared by all requests of the current session."""
+    handle = get_dataset_handle() or {}
+    key = getattr(session, 'sid', None) or handle.get('store_id') or 'anonymous'
+    with _dataset_locks_guard:
+        lock = _dataset_locks.get(key)
+        if lock is None:
+            lock = threading.RLock()
+            _dataset_locks[key] = lock
+        return lock
+
+def _get_expected_version():
+    payload = request.get_json(silent=True) if request.is_json else None
+    expected = (payload or {}).get('expected_version') if isinstance(payload, dict) else None
+    if expected is None:
+        # Multipart bodies are left unread so uploads can be streamed
+        values = request.args if request.mimetype == 'multipart/form-data' else request.values
+        expected = values.get('expected_version')
+    try:
+        return int(expected) if expected not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+def dataset_mutation(f):
+    """
+    Serializes data-changing requests per session and rejects stale ones.
+    Clients may send 'expected_version'; if another request moved the dataset
+    since, a 409 with the current version is returned instead of applying
+    the change to data the user has not seen.
+    Place *after* @login_required.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        with get_dataset_lock():
+            expected = _get_expected_version()
+            if expected is not None:
+                current = get_current_dataset_version()
+                if current is not None and expected != current:
+                    app.logger.info(f"Rejected stale request to {request.path}: expected version {expected}, current {current}")
+                    return jsonify({'error': 'The data was changed by another request. Reloading the latest version.',
+                                    'dataset_version': current}), 409
+            return f(*args, **kwargs)
+    return decorated_function
+
+# --- In-Memory DataFrame Cache ---
+# Live DataFrames are kept in an LRU cache keyed by (store id, version) so that
+# repeated clicks on the same version skip reading the store entirely.
+# Copy-on-write mode makes the shallow copies handed out by the cache safe:
+# a route mutating its DataFrame never touches the cached one.
+pd.set_option('mode.copy_on_write', True)
+
+class DataFrameCache:
+    """Thread-safe LRU cache of DataFrames with a total byte budget."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # key -> (df, nbytes)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._share(entry[0])
+
+    def put(self, key, value):
+        nbytes = self._measure(value)
+        with self._lock:
+            self._remove(key)
+            if nbytes > self.max_bytes:
+                return # Too large to cache; always served from the store
+            self._entries[key] = (self._share(value), nbytes)
+            self._total_bytes += nbytes
+            while self._total_bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_bytes
+
+    def discard(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def discard_store(self, store_id):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == store_id]:
+                self._remove(key)
+
+    def _measure(self, df):
+        return int(df.memory_usage(index=True, deep=True).sum())
+
+    def _share(self, df):
+        return df.copy(deep=False)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= entry[1]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+dataframe_cache = DataFrameCache(app.config['DATAFRAME_CACHE_MAX_BYTES'])
+
+class PreviewCache(DataFrameCache):
+    """
+    LRU cache of rendered previews (grid pages, table HTML) keyed by
+    (store id, version, view, kind, ...). Versions are immutable, so entries
+    never go stale; they only age out. Cached values must not be mutated.
+    """
+
+    def _measure(self, value):
+        if isinstance(value, dict): # Grid page: dominated by its cell strings
+            return sum(len(cell) + 8 for row in value.get('rows', []) for cell in row) + 512
+        if isinstance(value, tuple): # (table_html, total_rows, total_columns)
+            return len(value[0])
+        if isinstance(value, np.ndarray): # View row positions
+            return value.nbytes
+        return len(value)
+
+    def _share(self, value):
+        return value
+
+preview_cache = PreviewCache(app.config['PREVIEW_CACHE_MAX_BYTES'])
+
+def get_preview_cache_key(kind, *parts):
+    """Key for a rendered preview of the current version and search view, or None without data."""
+    handle = get_dataset_handle()
+    if not handle:
+        return None
+    spec = get_view_spec()
+    view_key = json.dumps(spec, sort_keys=True) if spec else ''
+    return (handle['store_id'], get_current_dataset_version(), view_key, kind) + parts
+
+def preview_etag(key):
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+def with_etag(response, etag):
+    """Tags a response and turns it into a 304 when the client already has it."""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache' # Always revalidate; the ETag makes that cheap
+    return response.make_conditional(request)
 
 def get_dataframe_from_session():
-    """Safely retrieve the current DataFrame from session."""
-    df_json = session.get('current_df_json')
-    if df_json:
+    """Safely retrieve the current DataFrame from the dataset store."""
+    handle = get_dataset_handle()
+    if handle:
+        version = get_current_dataset_version()
+        if version is None:
+            return None
         try:
-            # Read JSON string back into DataFrame
-            # orient='split' is often efficient for round-tripping
-            return pd.read_json(io.StringIO(df_json), orient='split')
+            df = load_dataset_version(handle['store_id'], version)
+            # Keep the loaded frame alive for this request so a later store can
+            # match untouched columns against it by buffer address.
+            g.setdefault('dataset_frames', {})[(handle['store_id'], version)] = df.copy(deep=False)
+            if not os.path.exists(get_dataset_version_path(handle['store_id'], version)):
+                # Also keep the checkpoint a logged version was replayed from
+                checkpoint, _ = find_history_checkpoint(handle['store_id'], version)
+                g.dataset_frames[(handle['store_id'], checkpoint)] = load_dataset_version(handle['store_id'], checkpoint)
+            return df
         except Exception as e:
+            # Leave the store alone: a failed read (e.g. a file busy elsewhere) must not delete the user's data
+            app.logger.error(f"Error loading dataset version {version} of store {handle['store_id']}: {e}", exc_info=True)
             flash(f"Error loading data from session: {e}", "error")
-            clear_session_data() # Clear corrupted data
             return None
     return None
 
-def store_dataframe_in_session(df):
-    """Store DataFrame in session as JSON string."""
+def store_dataframe_in_session(df, step=None):
+    """
+    Store DataFrame as a new version in the dataset store. `step` describes a
+    replayable operation that produced df from the current version; such
+    versions are only logged until a checkpoint is due.
+    """
     if df is None:
-        session.pop('current_df_json', None)
+        clear_session_data()
         return
+    if not get_dataset_handle():
+        session['dataset_handle'] = {'store_id': new_dataset_store_id()}
+    handle = get_dataset_handle()
+    store_id = handle['store_id']
+    state = load_dataset_state()
+    parent = state['version']
+    new_version = state['latest'] + 1
     try:
-        # Convert DataFrame to JSON string using 'split' orientation
-        # Handle potential date issues during serialization
-        df_json = df.to_json(orient='split', date_format='iso', default_handler=str)
-        session['current_df_json'] = df_json
+        checkpoint, steps = (None, 0)
+        if parent is not None:
+            checkpoint, steps = find_history_checkpoint(store_id, parent)
+        if step is not None:
+            append_history_log(store_id, {'version': new_version, 'parent': parent, 'step': step, 'shape': list(df.shape)})
+        if step is None or parent is None or steps + 1 >= app.config['HISTORY_CHECKPOINT_INTERVAL']:
+            # Share unchanged columns with the nearest checkpoint
+            parent_df = g.get('dataset_frames', {}).get((store_id, checkpoint))
+            write_dataset_version(store_id, new_version, df, parent=checkpoint, parent_df=parent_df)
+        dataframe_cache.put((handle['store_id'], new_version), df)
+        state['version'] = new_version
+        state['latest'] = new_version
+        save_dataset_state(state)
+        prune_dataset_versions(state)
     except Exception as e:
         flash(f"Error storing data in session: {e}. Data might be too large or contain unserializable types.", "error")
-        # Decide how to handle: maybe clear session or keep old data?
-        # session.pop('current_df_json', None) # Option: clear if storing fails
-
-def add_to_undo(current_df_json):
-    """Add current state to undo history (limited size)."""
-    if not current_df_json: return
-    undo_history = session.get('undo_history', [])
-    undo_history.append(current_df_json)
-    # Limit history size to prevent huge sessions
-    max_history = 10
-    session['undo_history'] = undo_history[-max_history:]
-    session['redo_history'] = [] # Clear redo on new action
+        # Keep the previous version current; the failed write left nothing behind.
+
+def add_to_undo(current_version):
+    """Add current version to undo history (limited size). Returns the redo entries it cleared."""
+    if current_version is None: return []
+    state = load_dataset_state()
+    state['undo'].append(current_version)
+    # Limit history size to keep the store folder bounded
+    state['undo'] = state['undo'][-app.config['HISTORY_MAX_STEPS']:]
+    cleared_redo = state['redo']
+    state['redo'] = [] # Clear redo on new action
+    save_dataset_state(state)
+    return cleared_redo
+
+def rollback_last_undo_entry(restore=True, redo=None):
+    """
+    Drops the undo entry recorded for an operation that did not complete.
+    With restore=True the dropped version also becomes current again. `redo`
+    (what add_to_undo cleared) is put back if no new version was stored in
+    between; storing one prunes the versions it points to.
+    """
+    state = load_dataset_state()
+    if not state['undo']:
+        return False
+    last_good_version = state['undo'].pop()
+    if redo and state['version'] == last_good_version:
+        state['redo'] = redo
+    if restore:
+        state['version'] = last_good_version
+    save_dataset_state(state)
+    return True
 
 def get_undo_redo_status():
     """Return boolean status for undo/redo availability."""
+    state = load_dataset_state()
     return {
-        'undo_enabled': bool(session.get('undo_history')),
-        'redo_enabled': bool(session.get('redo_history'))
+        'undo_enabled': bool(state['undo']),
+        'redo_enabled': bool(state['redo'])
     }
 
-# Modified: render_table_html now optionally returns counts too
+@app.before_request
+def migrate_legacy_session_data():
+    """
+    Older sessions kept the DataFrame JSON (and JSON undo/redo copies) inside
+    the session file. Move any such payload into the dataset store once so the
+    session stays small from then on.
+    """
+    if 'current_df_json' not in session and 'undo_history' not in session and 'redo_history' not in session:
+        return
+    current_json = session.pop('current_df_json', None)
+    undo_entries = session.pop('undo_history', None) or []
+    redo_entries = session.pop('redo_history', None) or []
+    handle = get_dataset_handle()
+    state = load_dataset_state()
+    if handle and 'version' in handle: # Handle from before state.json existed
+        state['version'] = handle['version']
+        state['latest'] = max(handle.get('latest', 0), state['latest'])
+        session['dataset_handle'] = handle = {'store_id': handle['store_id']}
+
+    if current_json is None:
+        # Histories that already hold version numbers just move to the store.
+        if handle:
+            state['undo'] = [v for v in undo_entries if isinstance(v, int)]
+            state['redo'] = [v for v in redo_entries if isinstance(v, int)]
+            save_dataset_state(state)
+        return
+
+    try:
+        if not handle:
+            session['dataset_handle'] = handle = {'store_id': new_dataset_store_id()}
+        def _store_legacy(df_json):
+            state['latest'] += 1
+            df = pd.read_json(io.StringIO(df_json), orient='split')
+            write_dataset_version(handle['store_id'], state['latest'], df)
+            return state['latest']
+        state['undo'] = [_store_legacy(j) for j in undo_entries if isinstance(j, str)][-app.config['HISTORY_MAX_STEPS']:]
+        state['redo'] = [_store_legacy(j) for j in redo_entries if isinstance(j, str)][:app.config['HISTORY_MAX_STEPS']]
+        state['version'] = _store_legacy(current_json)
+        save_dataset_state(state)
+        prune_dataset_versions(state)
+    except Exception as e:
+        app.logger.warning(f"Could not migrate legacy session data: {e}")
+
+# --- Streaming Upload Ingest ---
+# Uploads are parsed while they arrive instead of being saved to uploads/ and
+# read back. The multipart body is decoded incrementally; for delimited files
+# the dialect is sniffed from a sample and Arrow's multi-threaded streaming
+# CSV reader parses blocks of INGEST_CHUNK_BYTES, each appended as a string
+# batch to a staging file in the new dataset's store folder. When the
+# upload ends, the staging file is memory-mapped and split into the store's
+# column files one column at a time, each getting the dtype pandas would have
+# inferred. Peak memory follows the chunk size, not the file size. A sha256 of
+# the uploaded bytes is computed on the way and kept in the manifest.
+
+INGEST_STAGING_FILE = 'ingest.arrow'
+
+class MultipartFileReader(io.RawIOBase):
+    """
+    Readable stream over the file part of a multipart request body, read
+    straight from the socket. Form fields sent before the file are collected
+    in `fields`; `filename` is None when the body has no such file part.
+    """
+    def __init__(self, stream, boundary, field_name='file', chunk_size=None):
+        super().__init__()
+        self._stream = stream
+        self._chunk_size = chunk_size or app.config['INGEST_CHUNK_BYTES']
+        self._decoder = MultipartDecoder(boundary)
+        self._pending = memoryview(b'')
+        self._part_done = True
+        self.fields = {}
+        self.filename = None
+        self.bytes_read = 0
+        self.hasher = hashlib.sha256()
+        self.done = threading.Event() # Set once the whole file part has been read
+        self._find_file_part(field_name)
+
+    def _next_event(self):
+        event = self._decoder.next_event()
+        while isinstance(event, NeedData):
+            self._decoder.receive_data(self._stream.read(self._chunk_size) or None)
+            event = self._decoder.next_event()
+        return event
+
+    def _find_file_part(self, field_name):
+        name, value = None, []
+        while True:
+            event = self._next_event()
+            if isinstance(event, File) and event.name == field_name:
+                self.filename = event.filename or ''
+                self._part_done = False
+                return
+            if isinstance(event, Field):
+                name, value = event.name, []
+            elif isinstance(event, File):
+                name = None # Other file parts are skipped
+            elif isinstance(event, Data):
+                if name is not None:
+                    value.append(event.data)
+                    if not event.more_data:
+                        self.fields[name] = b''.join(value).decode('utf-8', errors='replace')
+            elif isinstance(event, Epilogue): # No file part
+                return
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        # Fill the whole buffer unless the file ends: Arrow's CSV reader
+        # takes each read as one block and rows must not straddle blocks.
+        filled = 0
+        while filled < len(buffer):
+            while not self._pending and not self._part_done:
+                event = self._next_event()
+                if not isinstance(event, Data):
+                    self._part_done = True
+                    break
+                self._pending = memoryview(event.data)
+                self._part_done = not event.more_data
+                self.hasher.update(event.data)
+                self.bytes_read += len(event.data)
+            if not self._pending:
+                self.done.set()
+                break
+            size = min(len(buffer) - filled, len(self._pending))
+            buffer[filled:filled + size] = self._pending[:size]
+            self._pending = self._pending[size:]
+            filled += size
+        return filled
+
+    def peek_sample(self, size):
+        """Returns up to `size` leading bytes of the file without consuming them."""
+        chunks, total = [], 0
+        while total < size:
+            chunk = self.read(size - total)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            total += len(chunk)
+        sample = b''.join(chunks)
+        self._pending = memoryview(sample + bytes(self._pending))
+        return sample
+
+    def finish(self):
+        """Reads whatever the parser left unread and describes the uploaded bytes."""
+        while self.read(self._chunk_size):
+            pass
+        return {'filename': self.filename, 'bytes': self.bytes_read, 'sha256': self.hasher.hexdigest()}
+
+# Values pandas' CSV parser treats as missing by default
+CSV_NULL_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+                   '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+CSV_SNIFF_BYTES = 64 * 1024
+
+def peek_stream(stream, size):
+    """Returns up to `size` leading bytes of an upload or seekable file without consuming them."""
+    if hasattr(stream, 'peek_sample'):
+        return stream.peek_sample(size)
+    position = stream.tell()
+    sample = stream.read(size)
+    stream.seek(position)
+    return sample
+
+def detect_text_encoding(sample):
+    """Picks the encoding of a byte sample: BOMs first, then strict UTF-8, then Windows-1252."""
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8'
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    try:
+        sample.decode('utf-8')
+        return 'utf-8'
+    except UnicodeDecodeError as e:
+        if e.reason == 'unexpected end of data': # Sample ends mid-character
+            return 'utf-8'
+    try:
+        sample.decode('cp1252')
+        return 'cp1252'
+    except UnicodeDecodeError:
+        return 'latin-1'
+
+def _looks_numeric(value):
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+def sniff_csv_dialect(sample, delimiter=None):
+    """
+    Detects encoding, delimiter, quoting and whether the first row is a
+    header from the first bytes of a delimited file. A `delimiter` passed in
+    (e.g. for .tsv) is kept. Without a clear answer the delimiter falls back
+    to a comma, like the old sep=None read did.
+    """
+    encoding = detect_text_encoding(sample)
+    text = sample.decode(encoding, errors='ignore').lstrip('\ufeff')
+    if len(sample) >= CSV_SNIFF_BYTES and '\n' in text:
+        text = text[:text.rindex('\n') + 1] # Only whole lines
+    sniffer = csv.Sniffer()
+    quotechar, escapechar = '"', None
+    try:
+        dialect = sniffer.sniff(text, delimiters=delimiter or ',;\t|')
+        quotechar, escapechar = dialect.quotechar or '"', dialect.escapechar or None
+        if delimiter is None:
+            delimiter = dialect.delimiter
+    except csv.Error:
+        pass
+    first_row = next(csv.reader(io.StringIO(text), delimiter=delimiter or ',', quotechar=quotechar), [])
+    if delimiter is None or len(first_row) <= 1:
+        delimiter = delimiter if delimiter == '\t' else ','
+        first_row = next(csv.reader(io.StringIO(text), delimiter=delimiter, quotechar=quotechar), [])
+
+    # A row holding numbers is data unless the sniffer is confident it is a header
+    header = True
+    if any(_looks_numeric(v) for v in first_row):
+        try:
+            header = sniffer.has_header(text)
+        except csv.Error:
+            pass
+    return {'encoding': encoding, 'delimiter': delimiter, 'quotechar': quotechar,
+            'escapechar': escapechar, 'header': header, 'first_row': first_row}
+
+def _dedupe_column_names(names):
+    """Names columns the way pandas does: blanks become 'Unnamed: i', repeats get '.1', '.2', ..."""
+    counts, result = {}, []
+    for i, name in enumerate(names):
+        name = name if name != '' else f'Unnamed: {i}'
+        count = counts.get(name, 0)
+        while count > 0:
+            counts[name] = count + 1
+            name = f'{name}.{count}'
+            count = counts.get(name, 0)
+        counts[name] = count + 1
+        result.append(name)
+    return result
+
+def _infer_ingested_column(strings):
+    """
+    Converts a column parsed as strings to the type pandas' CSV parser would
+    infer: int64, float64 (ints with missing values too), bool, or strings.
+    """
+    if len(strings) == 0:
+        return strings, 'object'
+    trimmed = pc.utf8_trim_whitespace(strings)
+    for target in (pa.int64(), pa.float64(), pa.bool_()):
+        try:
+            typed = pc.cast(trimmed, target)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            continue
+        if typed.null_count and target != pa.bool_():
+            return pc.cast(typed, pa.float64()), 'float64'
+        return typed, 'object' if typed.null_count else str(target).replace('double', 'float64')
+    return strings, 'object'
+
+def _text_column_bytes(strings):
+    """
+    What memory_usage(deep=True) reports for an Arrow string column once it
+    is an object Series: a pointer per row, 49 bytes plus the length per
+    str, 16 per None. Exact for ASCII text, close otherwise.
+    """
+    lengths = pc.sum(pc.binary_length(strings)).as_py() or 0
+    valid = len(strings) - strings.null_count
+    return 8 * len(strings) + 49 * valid + lengths + 16 * strings.null_count
+
+def ingest_delimited_stream(store_id, stream, delimiter=None, job=None):
+    """
+    Parses a CSV/TSV byte stream into the column files of a new dataset store
+    and returns the manifest for version 1, left for the caller to complete
+    and write. The dialect is sniffed from a sample; the file itself is read
+    once by Arrow's multi-threaded streaming CSV reader. `job` receives
+    progress when given.
+    """
+    dialect = sniff_csv_dialect(peek_stream(stream, CSV_SNIFF_BYTES), delimiter)
+    if not dialect['first_row']:
+        raise ValueError('No columns to parse from file')
+    width = len(dialect['first_row'])
+    if dialect['header']:
+        names = _dedupe_column_names(dialect['first_row'])
+    else:
+        names = list(range(width)) # pandas' header=None names
+
+    invalid_rows = []
+    def _skip_invalid_row(row):
+        invalid_rows.append(row.actual_columns)
+        return 'skip'
+
+    # Everything is read as strings and typed per column afterwards, so a
+    # value late in the file cannot contradict a type guessed from early blocks.
+    field_names = [f'c{i}' for i in range(width)]
+    reader = pa_csv.open_csv(
+        stream,
+        read_options=pa_csv.ReadOptions(use_threads=True, block_size=app.config['INGEST_CHUNK_BYTES'],
+                                        column_names=field_names, skip_rows=1 if dialect['header'] else 0,
+                                        encoding=dialect['encoding']),
+        parse_options=pa_csv.ParseOptions(delimiter=dialect['delimiter'], quote_char=dialect['quotechar'],
+                                          double_quote=True, escape_char=dialect['escapechar'] or False,
+                                          newlines_in_values=True, invalid_row_handler=_skip_invalid_row),
+        convert_options=pa_csv.ConvertOptions(column_types={f: pa.string() for f in field_names},
+                                              null_values=CSV_NULL_VALUES, strings_can_be_null=True,
+                                              quoted_strings_can_be_null=True))
+
+    store_dir = get_dataset_store_dir(store_id)
+    os.makedirs(store_dir, exist_ok=True)
+    staging_path = os.path.join(store_dir, INGEST_STAGING_FILE)
+    total_rows = 0
+    with pa.ipc.new_file(staging_path, reader.schema) as writer:
+        for batch in reader:
+            writer.write_batch(batch)
+            total_rows += batch.num_rows
+            if job is not None:
+                job.rows = total_rows
+    if invalid_rows:
+        app.logger.warning(f"Skipped {len(invalid_rows)} rows whose field count did not match the header ({width}).")
+
+    if job is not None:
+        job.phase = 'Typing columns'
+    columns = []
+    report = {'columns': [], 'bytes_before': 0, 'bytes_after': 0} if app.config['INGEST_OPTIMIZE_DTYPES'] else None
+    staged = feather.read_table(staging_path, memory_map=True)
+    for i, name in enumerate(names):
+        values, dtype = _infer_ingested_column(staged.column(i))
+        if report is not None and pa.types.is_string(values.type):
+            # Text is typed from Arrow directly; no need to build millions of str objects
+            size = _text_column_bytes(values)
+            optimized = optimize_ingested_text(values) if app.config['INGEST_CONVERT_TEXT_DTYPES'] else None
+            report['bytes_before'] += size
+            report['bytes_after'] += size if optimized is None else int(optimized.memory_usage(deep=True, index=False))
+            if optimized is not None:
+                report['columns'].append([str(name), f"object → {optimized.dtype}"])
+                columns.append(dict(write_dataset_column(store_id, optimized), name=_encode_column_name(name)))
+                continue
+        elif report is not None:
+            ref = {'column': None, 'dtype': dtype, 'storage': 'arrow', 'rows': None}
+            series = restore_column_values(pa.table({'values': values}), ref)
+            optimized, change = optimize_column_dtype(series)
+            report['bytes_before'] += int(series.memory_usage(deep=True, index=False))
+            report['bytes_after'] += int(optimized.memory_usage(deep=True, index=False))
+            if change:
+                report['columns'].append([str(name), change])
+                columns.append(dict(write_dataset_column(store_id, optimized), name=_encode_column_name(name)))
+                continue
+        column_id = uuid.uuid4().hex
+        _write_arrow_atomic(get_dataset_column_path(store_id, column_id),
+                            pa.table({'values': values.combine_chunks()}))
+        columns.append({'column': column_id, 'dtype': dtype, 'storage': 'arrow', 'rows': None,
+                        'name': _encode_column_name(name)})
+    del staged # Unmap before removing, required on Windows
+    _remove_store_file(staging_path)
+
+    manifest = {
+        'columns': columns,
+        'index': _index_to_ref(store_id, pd.RangeIndex(total_rows)),
+        'columns_dtype': 'object' if dialect['header'] else 'int64',
+        'shape': [total_rows, len(columns)],
+        'skipped_rows': len(invalid_rows)
+    }
+    if report is not None:
+        manifest['dtype_optimization'] = report
+    return manifest
+
+# Compressed CSV/TSV/JSON Lines uploads (data.csv.gz, .bz2, .xz, .zst) are
+# decompressed on the fly between the upload stream and the parser, so the
+# uncompressed file never exists in memory or on disk. Only compressed bytes
+# are spooled, hashed and counted for progress.
+
+def open_decompressed(stream, compression):
+    """Forward-only reader of the decompressed bytes of a compressed stream (the stream itself without compression)."""
+    if compression == 'gz':
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    if compression == 'bz2':
+        return bz2.BZ2File(stream, mode='rb')
+    if compression == 'xz':
+        return lzma.LZMAFile(stream, mode='rb')
+    if compression == 'zst': # Not in the standard library; Arrow bundles it
+        return pa.CompressedInputStream(pa.PythonFile(stream, mode='r'), 'zstd')
+    return stream
+
+class DecompressedReader(io.RawIOBase):
+    """
+    Readable stream of decompressed bytes for the CSV parser. Like
+    MultipartFileReader it fills whole buffers and can hand out a leading
+    sample without consuming it, since a decompressor cannot seek back.
+    """
+    def __init__(self, stream, compression):
+        super().__init__()
+        self._source = open_decompressed(stream, compression)
+        self._pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        filled = min(len(buffer), len(self._pending))
+        buffer[:filled] = self._pending[:filled]
+        self._pending = self._pending[filled:]
+        while filled < len(buffer):
+            chunk = self._source.read(len(buffer) - filled)
+            if not chunk:
+                break
+            buffer[filled:filled + len(chunk)] = chunk
+            filled += len(chunk)
+        return filled
+
+    def peek_sample(self, size):
+        """Returns up to `size` leading bytes without consuming them."""
+        sample = self.read(size)
+        self._pending = sample + self._pending
+        return sample
+
+def ingest_upload(store_id, upload, filename, job=None):
+    """
+    Parses an upload stream into version 1 of a new dataset store. Delimited
+    files are parsed as they stream in. JSON Lines is read whole, and a file
+    whose first bytes match an ingest cache entry has to be hashed in full
+    before it is parsed, so both are spooled once (in memory while small).
+    A cache hit then only links the cached column files.
+    """
+    file_ext, compression = split_upload_extension(filename)
+    variant = f"{file_ext}.{compression}" if compression else file_ext
+    delimiter = {'csv': None, 'tsv': '\t'}.get(file_ext)
+    probe = hashlib.sha256(peek_stream(upload, app.config['INGEST_CACHE_PROBE_BYTES'])).hexdigest()
+    cached = False
+    if file_ext in ('csv', 'tsv') and not ingest_cache.has_probe(probe, variant):
+        stream = DecompressedReader(upload, compression) if compression else upload
+        manifest = ingest_delimited_stream(store_id, stream, delimiter, job=job)
+        source = upload.finish()
+    else:
+        chunk_bytes = app.config['INGEST_CHUNK_BYTES']
+        with tempfile.SpooledTemporaryFile(max_size=chunk_bytes, dir=app.config['UPLOAD_FOLDER']) as spool:
+            shutil.copyfileobj(upload, spool, chunk_bytes)
+            spool.seek(0)
+            source = upload.finish()
+            manifest = ingest_cache.restore(source['sha256'], variant, store_id)
+            cached = manifest is not None
+            if not cached and file_ext in ('csv', 'tsv'):
+                stream = DecompressedReader(spool, compression) if compression else spool
+                manifest = ingest_delimited_stream(store_id, stream, delimiter, job=job)
+            elif not cached:
+                if job is not None:
+                    job.phase = 'Parsing JSON lines'
+                manifest = write_ingested_version(store_id, read_json_lines(spool, compression))
+    manifest['source'] = dict(source, probe=probe, cached=cached)
+    _write_json_atomic(get_dataset_version_path(store_id, 1), manifest)
+    if not cached:
+        ingest_cache.add(store_id, manifest, variant)
+    app.logger.info(f"Ingested {filename} ({source['bytes']} bytes, sha256 {source['sha256'][:12]}"
+                    f"{', from cache' if cached else ''}) as {manifest['shape'][0]} rows x {manifest['shape'][1]} columns")
+    return manifest
+
+# Parquet and Arrow IPC (Feather v2) uploads are saved to disk as they stream
+# in and described from their metadata first. The user then picks columns and
+# row groups (record batches, for Arrow), and only those are read, so loading
+# costs what the selection holds rather than what the file holds. JSON Lines
+# has no schema to preview and is parsed whole by Arrow's block reader.
+COLUMNAR_EXTENSIONS = {'parquet', 'feather', 'arrow'}
+JSON_LINES_EXTENSIONS = {'jsonl', 'ndjson'}
+
+def read_json_lines(source, compression=None):
+    """
+    Parses JSON Lines from a seekable file, optionally compressed, with Arrow,
+    falling back to pandas when a field changes type between blocks.
+    """
+    try:
+        table = pa_json.read_json(open_decompressed(source, compression),
+                                  read_options=pa_json.ReadOptions(block_size=app.config['INGEST_CHUNK_BYTES']))
+    except pa.ArrowInvalid as e:
+        app.logger.info(f"Arrow could not parse the JSON lines ({e}); using pandas")
+        source.seek(0)
+        return pd.read_json(open_decompressed(source, compression), lines=True)
+    return arrow_table_to_pandas(table)
+
+def describe_columnar_file(path, file_ext):
+    """Columns (name, Arrow type) and row groups (rows, bytes) of a Parquet or Arrow IPC file."""
+    if file_ext == 'parquet':
+        parquet_file = pq.ParquetFile(path)
+        schema = parquet_file.schema_arrow
+        row_groups = [{'rows': group.num_rows, 'bytes': group.total_byte_size}
+                      for group in map(parquet_file.metadata.row_group, range(parquet_file.metadata.num_row_groups))]
+    else:
+        with pa.memory_map(path) as source:
+            reader = pa.ipc.open_file(source)
+            schema = reader.schema
+            row_groups = [{'rows': batch.num_rows, 'bytes': batch.nbytes}
+                          for batch in map(reader.get_batch, range(reader.num_record_batches))]
+    return {'columns': [{'name': field.name, 'type': str(field.type)} for field in schema], 'row_groups': row_groups}
+
+def read_columnar_file(path, file_ext, columns, row_groups):
+    """Reads only the given columns and row groups (positions) of a Parquet or Arrow IPC file."""
+    if file_ext == 'parquet':
+        parquet_file = pq.ParquetFile(path)
+        names = [parquet_file.schema_arrow.field(i).name for i in columns]
+        return arrow_table_to_pandas(parquet_file.read_row_groups(row_groups, columns=names, use_threads=True))
+    with pa.memory_map(path) as source:
+        # Memory-mapped, so batches and columns that were not picked are never read
+        reader = pa.ipc.open_file(source)
+        schema = pa.schema([reader.schema.field(i) for i in columns], metadata=reader.schema.metadata)
+        table = pa.Table.from_batches([reader.get_batch(i).select(columns) for i in row_groups], schema=schema)
+        return arrow_table_to_pandas(table)
+
+def stage_upload(job, upload, file_ext):
+    """Saves a Parquet/Arrow, zip or XLSX upload to disk as it streams in and describes it for the selection page."""
+    path = os.path.join(app.config['UPLOAD_FOLDER'], f"{job.id}.{file_ext}")
+    job.staged = {'path': path, 'ext': file_ext}
+    probe = hashlib.sha256(peek_stream(upload, app.config['INGEST_CACHE_PROBE_BYTES'])).hexdigest()
+    with open(path, 'wb') as f:
+        shutil.copyfileobj(upload, f, app.config['INGEST_CHUNK_BYTES'])
+    job.staged['source'] = dict(upload.finish(), probe=probe)
+    if file_ext in ARCHIVE_EXTENSIONS:
+        job.phase = 'Reading archive'
+        job.staged['members'] = describe_archive(path)
+    elif file_ext == 'xlsx':
+        job.phase = 'Reading sheet list'
+        job.staged['members'] = describe_workbook(path)
+    else:
+        job.phase = 'Reading schema'
+        job.staged['schema'] = describe_columnar_file(path, file_ext)
+
+def discard_staged_upload(job):
+    if job.staged and os.path.exists(job.staged['path']):
+        _remove_store_file(job.staged['path'])
+
+def ingest_columnar_file(store_id, staged, columns, row_groups, job=None):
+    """
+    Loads the picked columns and row groups of a staged Parquet/Arrow upload
+    into version 1 of a new dataset store. The same file and selection
+    uploaded again is served from the ingest cache.
+    """
+    selection = json.dumps({'columns': columns, 'row_groups': row_groups})
+    variant = f"{staged['ext']}-{hashlib.sha1(selection.encode('utf-8')).hexdigest()[:16]}"
+    source = staged['source']
+    manifest = ingest_cache.restore(source['sha256'], variant, store_id)
+    cached = manifest is not None
+    if not cached:
+        if job is not None:
+            job.phase = 'Reading selected columns'
+        manifest = write_ingested_version(store_id, read_columnar_file(staged['path'], staged['ext'], columns, row_groups))
+    manifest['source'] = dict(source, cached=cached, columns=len(columns), row_groups=len(row_groups))
+    _write_json_atomic(get_dataset_version_path(store_id, 1), manifest)
+    if not cached:
+        ingest_cache.add(store_id, manifest, variant)
+    app.logger.info(f"Ingested {len(columns)} of {len(staged['schema']['columns'])} columns and {len(row_groups)} of "
+                    f"{len(staged['schema']['row_groups'])} row groups ({source['bytes']} bytes{', from cache' if cached else ''}) "
+                    f"as {manifest['shape'][0]} rows x {manifest['shape'][1]} columns")
+    return manifest
+
+# A zip upload is staged compressed like a Parquet file, and the user picks
+# which of the CSV/TSV/JSON Lines files inside to load. Each one is
+# decompressed as it is parsed. Picked files either become separate datasets,
+# the first opened now and, only when the user asks for it, the rest written
+# to the saved sessions folder, or are stacked into one dataset.
+ARCHIVE_EXTENSIONS = {'zip'}
+
+def describe_archive(path):
+    """Name and uncompressed size of each CSV/TSV/JSON Lines file (compressed or not) in a zip archive."""
+    with zipfile.ZipFile(path) as archive:
+        members = [{'name': info.filename, 'bytes': info.file_size} for info in archive.infolist()
+                   if not info.is_dir() and not info.filename.startswith('__MACOSX/')
+                   and split_upload_extension(info.filename)[0] in COMPRESSIBLE_EXTENSIONS]
+    if not members:
+        raise ValueError('The archive holds no CSV, TSV or JSON Lines files.')
+    return members
+
+def ingest_archive_member(store_id, archive, name, job=None):
+    """Parses one file of an open zip archive into version 1 of a new dataset store."""
+    file_ext, compression = split_upload_extension(name)
+    with archive.open(name) as member:
+        if file_ext in ('csv', 'tsv'):
+            stream = DecompressedReader(member, compression) if compression else member
+            manifest = ingest_delimited_stream(store_id, stream, {'csv': None, 'tsv': '\t'}[file_ext], job=job)
+        else:
+            manifest = write_ingested_version(store_id, read_json_lines(member, compression))
+    _write_json_atomic(get_dataset_version_path(store_id, 1), manifest)
+    return manifest
+
+def _saved_session_filename(name):
+    """A saved sessions file name for an archive member or sheet that does not overwrite an existing save."""
+    base = secure_filename(os.path.basename(name).split('.')[0]) or 'dataset'
+    filename = f"{base}.parquet"
+    if os.path.exists(os.path.join(app.config['SAVED_SESSIONS_FOLDER'], filename)):
+        filename = f"{base}_{uuid.uuid4().hex[:8]}.parquet"
+    return filename
+
+def ingest_archive(store_id, staged, members, combine, job=None, save_others=False):
+    """
+    Loads the picked files of a staged zip archive into version 1 of
+    store_id: stacked into one dataset (columns matched by name) when
+    combining, otherwise the first file alone, with each other file saved as
+    a saved session if save_others is set. Returns the manifest and the saved
+    file names.
+    """
+    if not combine and not save_others:
+        members = members[:1]
+    frames, saved, skipped_rows = [], [], 0
+    with zipfile.ZipFile(staged['path']) as archive:
+        for i, name in enumerate(members):
+            if job is not None:
+                job.phase = f"Reading {name}"
+            if i == 0 and not combine:
+                manifest = ingest_archive_member(store_id, archive, name, job=job)
+                skipped_rows += manifest.get('skipped_rows', 0)
+                continue
+            part_store = f"{store_id}-part{i}" # Job threads have no session for new_dataset_store_id
+            try:
+                part = ingest_archive_member(part_store, archive, name, job=job)
+                skipped_rows += part.get('skipped_rows', 0)
+                df = read_dataset_version(part_store, 1)
+            finally:
+                delete_dataset_store(part_store)
+            if combine:
+                frames.append(df)
+            else:
+                filename = _saved_session_filename(name)
+                df.rename(columns=str).to_parquet(os.path.join(app.config['SAVED_SESSIONS_FOLDER'], filename), index=False)
+                saved.append(filename)
+    if combine:
+        if job is not None:
+            job.phase = 'Storing data'
+        # Same all-NA concat notice as for chunked query results
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', FutureWarning)
+            df = pd.concat(frames, ignore_index=True).infer_objects() if len(frames) > 1 else frames[0]
+        manifest = write_ingested_version(store_id, df)
+    manifest['skipped_rows'] = skipped_rows
+    manifest['source'] = dict(staged['source'], members=members, combined=combine)
+    _write_json_atomic(get_dataset_version_path(store_id, 1), manifest)
+    app.logger.info(f"Ingested {len(members)} of {len(staged['members'])} files of {staged['source']['filename']} "
+                    f"({'combined' if combine else 'separately'}) as {manifest['shape'][0]} rows x {manifest['shape'][1]} columns")
+    return manifest, saved
+
+# XLSX uploads are staged as well. Sheet names, and row counts from each
+# sheet's <dimension> element, are read from the workbook's XML parts without
+# parsing any cells. Only the picked sheets are read, by pandas with openpyxl
+# in read-only (streaming) mode or with calamine when it is installed, and
+# several sheets are read in parallel worker processes. Picked sheets are
+# loaded separately or stacked, as for zip archives.
+XLSX_ENGINE = 'calamine' if CALAMINE_AVAILABLE else 'openpyxl'
+XLSX_DIMENSION_PROBE_BYTES = 4096 # <dimension> comes before the cell data of a sheet part
+
+def _xml_local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+def _sheet_data_rows(workbook, part):
+    """Data rows below the header of a sheet part according to its <dimension>, or None if not recorded."""
+    try:
+        with workbook.open(part) as sheet:
+            head = sheet.read(XLSX_DIMENSION_PROBE_BYTES).decode('utf-8', errors='ignore')
+    except KeyError:
+        return None
+    match = re.search(r'<(?:\w+:)?dimension ref="[A-Z]+(\d+)(?::[A-Z]+(\d+))?"', head)
+    if not match:
+        return None
+    return int(match.group(2) or match.group(1)) - int(match.group(1))
+
+def describe_workbook(path):
+    """Name, visibility and approximate row count of each worksheet, from workbook metadata only."""
+    with zipfile.ZipFile(path) as workbook:
+        parts = {}
+        for rel in ElementTree.fromstring(workbook.read('xl/_rels/workbook.xml.rels')):
+            if rel.get('Type', '').endswith('/worksheet'): # Chart sheets hold no data
+                target = rel.get('Target', '')
+                parts[rel.get('Id')] = target.lstrip('/') if target.startswith('/') else f"xl/{target}"
+        sheets = []
+        for element in ElementTree.fromstring(workbook.read('xl/workbook.xml')).iter():
+            if _xml_local_name(element.tag) != 'sheet':
+                continue
+            rel_id = next((value for key, value in element.attrib.items() if _xml_local_name(key) == 'id'), None)
+            if rel_id in parts:
+                sheets.append({'name': element.get('name'), 'hidden': element.get('state', 'visible') != 'visible',
+                               'rows': _sheet_data_rows(workbook, parts[rel_id])})
+    if not sheets:
+        raise ValueError('The workbook has no worksheets.')
+    return sheets
+
+def read_workbook_sheet(path, sheet_name):
+    """Reads one sheet. Runs in worker processes, so it takes only picklable arguments."""
+    return pd.read_excel(path, sheet_name=sheet_name, engine=XLSX_ENGINE)
+
+def read_workbook_sheets(path, sheet_names):
+    """
+    Reads the given sheets, several at once in worker processes when there is
+    more than one. Workers are spawned, not forked: a fork would copy this
+    multi-threaded server (its locks included) into each worker.
+    """
+    workers = min(len(sheet_names), app.config['XLSX_SHEET_WORKERS'])
+    if workers <= 1:
+        return [read_workbook_sheet(path, name) for name in sheet_names]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return list(pool.map(read_workbook_sheet, [path] * len(sheet_names), sheet_names))
+
+def ingest_workbook(store_id, staged, sheets, combine, job=None, save_others=False):
+    """
+    Loads the picked sheets of a staged XLSX upload into version 1 of
+    store_id, stacked or, if save_others is set, with the other sheets saved
+    separately as for zip archives. The same file and selection uploaded
+    again is served from the ingest cache. Returns the manifest and the saved
+    file names.
+    """
+    if not combine and not save_others:
+        sheets = sheets[:1]
+    separate = len(sheets) > 1 and not combine
+    selection = json.dumps({'sheets': sheets, 'combine': combine})
+    variant = f"xlsx-{hashlib.sha1(selection.encode('utf-8')).hexdigest()[:16]}"
+    source = staged['source']
+    # Sheets saved separately would be missing on a cache hit
+    manifest = None if separate else ingest_cache.restore(source['sha256'], variant, store_id)
+    cached = manifest is not None
+    saved = []
+    if not cached:
+        if job is not None:
+            job.phase = f"Reading {len(sheets)} sheets" if len(sheets) > 1 else f"Reading sheet {sheets[0]}"
+        frames = read_workbook_sheets(staged['path'], sheets)
+        if combine and len(frames) > 1:
+            if job is not None:
+                job.phase = 'Storing data'
+            # Same all-NA concat notice as for chunked query results
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', FutureWarning)
+                df = pd.concat(frames, ignore_index=True).infer_objects()
+        else:
+            df = frames[0]
+        if separate:
+            workbook_name = os.path.splitext(source['filename'])[0]
+            for name, frame in zip(sheets[1:], frames[1:]):
+                filename = _saved_session_filename(f"{workbook_name}_{name}")
+                frame.rename(columns=str).to_parquet(os.path.join(app.config['SAVED_SESSIONS_FOLDER'], filename), index=False)
+                saved.append(filename)
+        manifest = write_ingested_version(store_id, df)
+    manifest['source'] = dict(source, cached=cached, sheets=sheets, combined=combine)
+    _write_json_atomic(get_dataset_version_path(store_id, 1), manifest)
+    if not cached and not separate:
+        ingest_cache.add(store_id, manifest, variant)
+    app.logger.info(f"Ingested {len(sheets)} of {len(staged['members'])} sheets of {source['filename']} "
+                    f"({source['bytes']} bytes{', from cache' if cached else ''}) "
+                    f"as {manifest['shape'][0]} rows x {manifest['shape'][1]} columns")
+    return manifest, saved
+
+# --- Load-Time Type Optimization ---
+# Loaded data arrives as int64, float64 and object columns. Before version 1
+# is written, each column moves to the smallest dtype that holds its values
+# exactly: integers to the narrowest integer type and floats to float32 when
+# every value survives the round trip. With INGEST_CONVERT_TEXT_DTYPES (on by
+# default), text with few distinct values also becomes category and ISO 8601
+# date strings datetime64. The text cleaning steps work on category columns
+# per category (transform_text, text_mask), giving the same values as on text.
+# Text columns are first profiled on an evenly spaced sample, so only likely
+# candidates are scanned in full, and every conversion is checked against the
+# whole column. CSV columns are typed from Arrow without building str objects.
+# The manifest records the memory use before and after.
+
+DTYPE_SAMPLE_ROWS = 10000
+DTYPE_CATEGORY_MAX_UNIQUE_FRACTION = 0.5 # Same cut-off as Optimize Categories
+ISO_DATETIME_PATTERN = r'\d{4}-\d{2}-\d{2}(?:[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d{1,9})?)?)?(?:Z|[+-]\d{2}:?\d{2})?'
+
+def _dtype_sample(series):
+    """Non-missing values of up to DTYPE_SAMPLE_ROWS evenly spaced rows."""
+    return series.iloc[::max(1, len(series) // DTYPE_SAMPLE_ROWS)].dropna()
+
+def _parse_iso_datetimes(series):
+    """series as datetime64 if every non-missing value is an ISO 8601 date string, else None."""
+    if pd.api.types.infer_dtype(series, skipna=True) != 'string':
+        return None
+    try:
+        with warnings.catch_warnings(): # Mixed UTC offsets: pandas warns and returns objects, rejected below
+            warnings.simplefilter('ignore', FutureWarning)
+            parsed = pd.to_datetime(series, format='ISO8601', errors='coerce')
+    except (ValueError, TypeError, OverflowError):
+        return None
+    if not pd.api.types.is_datetime64_any_dtype(parsed) or parsed.isna().sum() != series.isna().sum():
+        return None
+    return parsed
+
+def _to_category(series):
+    """series as category if it is text with few distinct values, else None."""
+    if pd.api.types.infer_dtype(series, skipna=True) != 'string':
+        return None
+    if series.nunique() > series.count() * DTYPE_CATEGORY_MAX_UNIQUE_FRACTION:
+        return None
+    return series.astype('category')
+
+def _arrow_text_to_category(strings):
+    """
+    An Arrow string column as a category Series, with categories sorted as
+    astype('category') sorts them, if it has few distinct values; else None.
+    """
+    encoded = strings.combine_chunks().dictionary_encode()
+    if len(encoded.dictionary) > (len(encoded) - encoded.null_count) * DTYPE_CATEGORY_MAX_UNIQUE_FRACTION:
+        return None
+    order = np.asarray(pc.sort_indices(encoded.dictionary))
+    rank = np.empty(len(order) + 1, dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    rank[-1] = -1 # Missing values (index -1 below)
+    codes = rank[np.asarray(pc.fill_null(encoded.indices, -1))]
+    return pd.Series(pd.Categorical.from_codes(codes, encoded.dictionary.take(order).to_pylist()))
+
+def _arrow_text_to_datetimes(strings):
+    """
+    _parse_iso_datetimes for an Arrow string column, run on one slice at a
+    time so that only a slice is ever held as Python strings.
+    """
+    step, parts, dtypes = app.config['LARGE_DATASET_CHUNK_ROWS'], [], set()
+    for start in range(0, len(strings), step):
+        part = strings.slice(start, step)
+        if part.null_count == len(part):
+            parts.append(len(part)) # All missing; typed like the other slices below
+            continue
+        parsed = _parse_iso_datetimes(arrow_table_to_pandas(pa.table({'values': part})).iloc[:, 0])
+        if parsed is None:
+            return None
+        parts.append(parsed)
+        dtypes.add(parsed.dtype)
+    if len(dtypes) != 1: # Slices with different UTC offsets; the whole column would not parse either
+        return None
+    dtype = dtypes.pop()
+    return pd.concat([pd.Series(pd.NaT, index=range(p), dtype=dtype) if isinstance(p, int) else p for p in parts],
+                     ignore_index=True).rename(None)
+
+def optimize_ingested_text(strings):
+    """
+    optimize_column_dtype for a text column still in Arrow form (as parsed
+    from CSV): returns the category or datetime64 Series, or None when the
+    column stays text.
+    """
+    if len(strings) == 0:
+        return None
+    rows = np.arange(0, len(strings), max(1, len(strings) // DTYPE_SAMPLE_ROWS))
+    sample = arrow_table_to_pandas(pa.table({'values': strings.take(rows)})).iloc[:, 0].dropna()
+    if sample.empty:
+        return None
+    if sample.str.fullmatch(ISO_DATETIME_PATTERN).all():
+        return _arrow_text_to_datetimes(strings)
+    if sample.nunique() <= len(sample) * DTYPE_CATEGORY_MAX_UNIQUE_FRACTION:
+        return _arrow_text_to_category(strings)
+    return None
+
+def optimize_column_dtype(series):
+    """
+    Returns (series in the smallest dtype holding its values exactly,
+    description of the change or None when the column is left as it is).
+    """
+    dtype = series.dtype
+    optimized = None
+    if len(series) == 0 or isinstance(dtype, pd.api.extensions.ExtensionDtype):
+        return series, None
+    if pd.api.types.is_integer_dtype(dtype):
+        optimized = pd.to_numeric(series, downcast='integer')
+    elif dtype == np.float64:
+        narrowed = series.astype(np.float32)
+        if np.array_equal(narrowed.to_numpy(dtype=np.float64), series.to_numpy(), equal_nan=True):
+            optimized = narrowed
+    elif pd.api.types.is_object_dtype(dtype) and app.config['INGEST_CONVERT_TEXT_DTYPES']:
+        sample = _dtype_sample(series)
+        if not sample.empty and pd.api.types.infer_dtype(sample, skipna=False) == 'string':
+            if sample.str.fullmatch(ISO_DATETIME_PATTERN).all():
+                optimized = _parse_iso_datetimes(series)
+            elif sample.nunique() <= len(sample) * DTYPE_CATEGORY_MAX_UNIQUE_FRACTION:
+                optimized = _to_category(series)
+    if optimized is None or optimized.dtype == dtype:
+        return series, None
+    return optimized, f"{dtype} → {optimized.dtype}"
+
+def optimize_dtypes(df):
+    """
+    Applies optimize_column_dtype to every column of df. Returns the
+    optimized frame and a report of the changed columns and of the memory
+    used before and after.
+    """
+    report = {'columns': [], 'bytes_before': int(df.memory_usage(deep=True, index=False).sum())}
+    df = df.copy(deep=False)
+    for position, name in enumerate(df.columns):
+        optimized, change = optimize_column_dtype(df.iloc[:, position])
+        if change:
+            df.isetitem(position, optimized)
+            report['columns'].append([str(name), change])
+    report['bytes_after'] = int(df.memory_usage(deep=True, index=False).sum())
+    return df, report
+
+def write_ingested_version(store_id, df):
+    """Writes a freshly loaded frame as version 1 of store_id, optimizing its dtypes first; returns the manifest."""
+    report = None
+    if app.config['INGEST_OPTIMIZE_DTYPES']:
+        df, report = optimize_dtypes(df)
+    manifest = write_dataset_version(store_id, 1, df)
+    dataframe_cache.put((store_id, 1), df)
+    if report is not None:
+        manifest['dtype_optimization'] = report
+    return manifest
+
+# --- Ingest Cache ---
+# Analysts often upload the same extract again. Every parsed upload is kept in
+# INGEST_CACHE_FOLDER/<sha256>-<variant>/, where the variant names anything
+# that changes how the bytes are parsed (e.g. the file extension). The entry
+# is a copy of the version 1 manifest plus hard links to its column files.
+# Store files are immutable, so linking is safe and costs no extra disk while
+# the dataset is still open. A repeat upload links the files back into a new
+# store instead of parsing. Entries are evicted least recently used first
+# once their total size exceeds INGEST_CACHE_MAX_BYTES.
+
+def _link_or_copy(src, dst):
+    """Hard-links an immutable store file, copying where links are not supported."""
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+class IngestCache:
+    """Parsed uploads keyed by content hash, with LRU eviction by size on disk."""
+    FORMAT = 3 # Bump when the parser changes what a manifest would contain
+
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.folder, secure_filename(key))
+
+    @staticmethod
+    def _key(sha256, variant):
+        # Column dtypes depend on load-time optimization, so entries made with other settings are kept apart
+        if not app.config['INGEST_OPTIMIZE_DTYPES']:
+            return f"{sha256}-{variant}-unoptimized"
+        return f"{sha256}-{variant}" + ('-text' if app.config['INGEST_CONVERT_TEXT_DTYPES'] else '')
+
+    def _load_index(self):
+        try:
+            with open(os.path.join(self.folder, 'index.json'), 'r') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return index.get('entries', {}) if index.get('format') == self.FORMAT else {}
+
+    def _save_index(self, entries):
+        os.makedirs(self.folder, exist_ok=True)
+        _write_json_atomic(os.path.join(self.folder, 'index.json'), {'format': self.FORMAT, 'entries': entries})
+
+    def has_probe(self, probe, variant):
+        """True if a cached upload started with the same bytes, so it is worth hashing this one in full."""
+        with self._lock:
+            return any(e['probe'] == probe and e['variant'] == variant for e in self._load_index().values())
+
+    def restore(self, sha256, variant, store_id):
+        """Links a cached dataset into store_id as version 1 and returns its manifest, or None."""
+        key = self._key(sha256, variant)
+        with self._lock:
+            entries = self._load_index()
+            entry = entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            try:
+                with open(os.path.join(self._entry_dir(key), 'manifest.json'), 'r') as f:
+                    manifest = json.load(f)
+                for ref in manifest['columns']:
+                    _link_or_copy(os.path.join(self._entry_dir(key), 'columns', f"{ref['column']}.arrow"),
+                                  get_dataset_column_path(store_id, ref['column']))
+            except (OSError, ValueError) as e:
+                app.logger.warning(f"Dropping unreadable ingest cache entry {key}: {e}")
+                del entries[key]
+                shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+                self._save_index(entries)
+                self.misses += 1
+                return None
+            entry['last_used'] = time.time()
+            self._save_index(entries)
+            self.hits += 1
+        return manifest
+
+    def add(self, store_id, manifest, variant):
+        """Keeps the version 1 files of a freshly parsed upload, then evicts down to budget."""
+        refs = manifest['columns'] + [manifest['index']]
+        if any(ref.get('rows') for ref in refs) or 'range' not in manifest['index']:
+            return # Only plain ingest manifests: one file per column, nothing shared
+        key = self._key(manifest['source']['sha256'], variant)
+        entry_dir = self._entry_dir(key)
+        with self._lock:
+            entries = self._load_index()
+            if key in entries:
+                return
+            try:
+                size = 0
+                for ref in manifest['columns']:
+                    path = os.path.join(entry_dir, 'columns', f"{ref['column']}.arrow")
+                    _link_or_copy(get_dataset_column_path(store_id, ref['column']), path)
+                    size += os.path.getsize(path)
+                _write_json_atomic(os.path.join(entry_dir, 'manifest.json'), manifest)
+            except OSError as e:
+                app.logger.warning(f"Could not add {key} to the ingest cache: {e}")
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                return
+            entries[key] = {'probe': manifest['source']['probe'], 'variant': variant, 'size': size,
+                            'shape': manifest['shape'], 'last_used': time.time()}
+            total = sum(e['size'] for e in entries.values())
+            for old_key in sorted(entries, key=lambda k: entries[k]['last_used']):
+                if total <= self.max_bytes:
+                    break
+                total -= entries.pop(old_key)['size']
+                shutil.rmtree(self._entry_dir(old_key), ignore_errors=True)
+            self._save_index(entries)
+
+    def stats(self):
+        with self._lock:
+            entries = self._load_index()
+        return {'entries': len(entries), 'bytes': sum(e['size'] for e in entries.values()),
+                'max_bytes': self.max_bytes, 'hits': self.hits, 'misses': self.misses}
+
+ingest_cache = IngestCache(app.config['INGEST_CACHE_FOLDER'], app.config['INGEST_CACHE_MAX_BYTES'])
+
+# --- Background Ingest Jobs ---
+# Loading a dataset runs on its own thread so request threads stay free for
+# other users. An upload request only waits until the body has been read; the
+# rest of the work (typing columns, reading workbooks, running queries) goes
+# on after the browser has been sent to a progress page. That page polls
+# /ingest_jobs/<id>, whose first response after completion attaches the new
+# store to the session, since job threads cannot touch the session themselves.
+
+class IngestError(Exception):
+    """Raised by ingest jobs with a message meant for the user."""
+
+class IngestJob:
+    """Progress and outcome of one dataset load."""
+
+    def __init__(self, owner, source_info, failure_url, bytes_total=None, stream=None):
+        self.id = uuid.uuid4().hex
+        self.owner = owner
+        self.source_info = source_info
+        self.failure_url = failure_url
+        self.store_id = new_dataset_store_id()
+        self.bytes_total = bytes_total
+        self.stream = stream # Reader whose bytes_read reflects progress, if any
+        self.rows = 0
+        self.phase = 'Reading data'
+        self.status = 'running'
+        self.error = None
+        self.messages = [] # (category, message) to flash once claimed
+        self.started = time.time()
+        self.finished = None
+        self.claimed = False
+        self.staged = None # Uploaded Parquet/Arrow or zip file waiting for the user's selection
+        self.done = threading.Event()
+
+    def restart(self, phase):
+        """Reuses a job that waited for the user's selection for the load that follows."""
+        self.phase = phase
+        self.status = 'running'
+        self.stream = None
+        self.bytes_total = None
+        self.started = time.time()
+        self.finished = None
+        self.done.clear()
+
+    def progress(self):
+        elapsed = (self.finished or time.time()) - self.started
+        bytes_read = self.stream.bytes_read if self.stream is not None else None
+        eta = None
+        if self.status == 'running' and bytes_read and self.bytes_total and bytes_read < self.bytes_total:
+            eta = round(elapsed * (self.bytes_total - bytes_read) / bytes_read, 1)
+        return {'job_id': self.id, 'status': self.status, 'phase': self.phase, 'bytes_read': bytes_read,
+                'bytes_total': self.bytes_total, 'rows': self.rows, 'elapsed_seconds': round(elapsed, 1),
+                'eta_seconds': eta, 'error': self.error}
+
+ingest_jobs = {}
+_ingest_jobs_guard = threading.Lock()
+
+def _purge_ingest_jobs():
+    """Drops finished jobs nobody collected in time, along with their data."""
+    cutoff = time.time() - app.config['INGEST_JOB_TTL_SECONDS']
+    for job_id, job in list(ingest_jobs.items()):
+        if job.finished is not None and job.finished < cutoff:
+            del ingest_jobs[job_id]
+            if not job.claimed and job.status == 'done':
+                delete_dataset_store(job.store_id)
+            discard_staged_upload(job)
+
+def start_ingest_job(job, target, *args):
+    """
+    Runs target(job, *args) on a background thread. It returns the new store's
+    manifest, or None when the user has to pick what to load first.
+    """
+    def _run():
+        with app.app_context():
+            try:
+                manifest = target(job, *args)
+                if manifest is None:
+                    job.phase = 'Waiting for selection'
+                    job.status = 'selecting'
+                else:
+                    job.rows = manifest['shape'][0]
+                    report = manifest.get('dtype_optimization')
+                    if report and report['columns']:
+                        job.messages.append(('info', f"Optimized the types of {len(report['columns'])} column(s) at load: "
+                                                     f"memory {format_memory_size(report['bytes_before'])} → "
+                                                     f"{format_memory_size(report['bytes_after'])}."))
+                    job.status = 'done'
+            except Exception as e:
+                app.logger.error(f"Ingest job {job.id} failed: {e}")
+                job.error = str(e) if isinstance(e, IngestError) else f"An unexpected error occurred: {str(e)}"
+                job.status = 'failed'
+                delete_dataset_store(job.store_id) # Drop the partially written store
+                discard_staged_upload(job)
+            finally:
+                job.finished = time.time()
+                job.done.set()
+    with _ingest_jobs_guard:
+        _purge_ingest_jobs()
+        ingest_jobs[job.id] = job
+    threading.Thread(target=_run, name=f"ingest-{job.id[:8]}", daemon=True).start()
+    return job
+
+def get_ingest_job(job_id):
+    """Returns a job started by the current session, or None."""
+    with _ingest_jobs_guard:
+        job = ingest_jobs.get(job_id)
+    if job is None or job.owner != getattr(session, 'sid', None):
+        return None
+    return job
+
+def ingest_job_response(job):
+    """Sends the browser to the job's progress page (or returns its id to scripts)."""
+    if request.is_json or request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return jsonify({'job_id': job.id, 'status_url': url_for('ingest_job_status', job_id=job.id),
+                        'progress_url': url_for('ingest_progress', job_id=job.id)}), 202
+    return redirect(url_for('ingest_progress', job_id=job.id))
+
+# --- Table Preview Rendering ---
+# DataFrame.to_html spends most of its time in per-cell Python calls. The
+# preview renderer below produces the same markup, but formats whole columns
+# at once and writes everything into a single buffer.
+PREVIEW_TABLE_CLASSES = 'table table-bordered table-hover table-sm'
+_CELL_SEPARATOR = '\x00'
+_STRING_CONTROL_ESCAPES = str.maketrans({'\t': r'\t', '\n': r'\n', '\r': r'\r'})
+
+def escape_html_cells(cells):
+    """HTML-escapes a list of cell strings the way to_html does (&, < and > only)."""
+    joined = _CELL_SEPARATOR.join(cells)
+    if '&' not in joined and '<' not in joined and '>' not in joined:
+        return cells
+    if joined.count(_CELL_SEPARATOR) != len(cells) - 1: # A cell contains the separator itself
+        return [c.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;') for c in cells]
+    return joined.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').split(_CELL_SEPARATOR)
+
+def _format_float_cells(values):
+    """
+    Fixed-point formatting of a float column as pandas does it: 6 decimals,
+    trailing zeros trimmed evenly across the column. Returns None when pandas
+    would switch to scientific notation.
+    """
+    present = values[~np.isnan(values)]
+    abs_values = np.abs(present)
+    if ((abs_values > 1e6) | ((abs_values < 1e-6) & (abs_values > 0))).any():
+        return None
+    finite = np.isfinite(values)
+    cells = np.full(len(values), '', dtype=object) # '' for NaN
+    infinite = ~finite & ~np.isnan(values)
+    cells[infinite] = values[infinite].astype(str) # 'inf'/'-inf' as is
+    fixed = [f'{v:.6f}' for v in values[finite].tolist()]
+    trim = 0 # Trailing zeros every value has, keeping at least one decimal; stops at the first value without
+    while fixed and trim < 5 and all(s[-1 - trim] == '0' for s in fixed):
+        trim += 1
+    if trim:
+        fixed = [s[:-trim] for s in fixed]
+    cells[finite] = fixed
+    return cells.tolist()
+
+def format_preview_cells(series):
+    """Escaped display strings for one column, identical to to_html(na_rep='') output."""
+    values = series._values
+    if isinstance(values, np.ndarray):
+        if values.dtype.kind in 'iu':
+            return values.astype(str).tolist()
+        if values.dtype.kind == 'b':
+            return np.where(values, 'True', 'False').tolist()
+        if values.dtype.kind == 'f':
+            cells = _format_float_cells(values)
+            if cells is not None:
+                return cells
+        elif values.dtype == object and pd.api.types.infer_dtype(values, skipna=True) == 'string':
+            missing = pd.isna(values)
+            cells = values.copy()
+            if missing.any():
+                cells[missing] = ''
+                cells[np.equal(values, None)] = 'None' # to_html prints None, but na_rep for NaN
+            return escape_html_cells([c.translate(_STRING_CONTROL_ESCAPES).strip() for c in cells.tolist()])
+    elif isinstance(values, pd.Categorical) and pd.api.types.infer_dtype(values.categories, skipna=True) == 'string':
+        # Text categories: format each category once and pick by code ('' for missing, code -1)
+        labels = format_preview_cells(pd.Series(values.categories, dtype=object)) + ['']
+        return np.array(labels, dtype=object)[values.codes].tolist()
+    # Datetimes, other categoricals, extension and mixed object columns: pandas' own formatter
+    cells = pandas_format_array(values, None, na_rep='', leading_space=False)
+    return escape_html_cells([c.strip() for c in cells])
+
+def _render_preview_table(df):
+    out = io.StringIO()
+    out.write(f'<table class="dataframe {PREVIEW_TABLE_CLASSES}">\n  <thead>\n    <tr style="text-align: right;">\n')
+    for name in escape_html_cells(['#'] + [str(col) for col in df.columns]):
+        out.write(f'      <th>{name}</th>\n')
+    out.write('    </tr>\n  </thead>\n  <tbody>\n')
+    columns = [[str(i) for i in range(1, len(df) + 1)]] # 1-based row numbers
+    columns += [format_preview_cells(df.iloc[:, position]) for position in range(df.shape[1])]
+    for row in zip(*columns):
+        out.write('    <tr>\n      <td>')
+        out.write('</td>\n      <td>'.join(row))
+        out.write('</td>\n    </tr>\n')
+    out.write('  </tbody>\n</table>')
+    return out.getvalue()
+
 def render_table_html(df, max_rows=999):
     """Generates HTML for the table preview and returns dimensions."""
     if df is None or df.empty:
-        table_html = "<p class='text-center text-muted p-4'>No data to display or data is empty.</p>"
-        total_rows = 0
-        total_columns = 0
-    else:
-        # Create a display version, limiting rows
-        display_df = df.head(max_rows).copy() # Use .copy() to avoid SettingWithCopyWarning
-
-        # Add a 1-based row number column at the beginning
-        # This column is purely for display in this HTML table
-        # Ensure the column name '#' doesn't already exist in a conflicting way,
-        # though for a simple display '#' is standard.
-        # If df could legitimately have a '#' column that needs preserving,
-        # a more robust unique name generation for the row number column would be needed.
-        # For typical use, this is fine.
-        display_df.insert(0, '#', range(1, len(display_df) + 1))
+        return "<p class='text-center text-muted p-4'>No data to display or data is empty.</p>", 0, 0
 
+    display_df = df.head(max_rows) # No copy: the renderer only reads
+    table_html = None
+    if PANDAS_FORMAT_ARRAY_AVAILABLE and not isinstance(df.columns, pd.MultiIndex):
+        try:
+            table_html = _render_preview_table(display_df)
+        except Exception as e:
+            app.logger.warning(f"Fast table preview failed, falling back to to_html: {e}")
+    if table_html is None:
+        # Add a 1-based row number column at the beginning; purely for display
+        display_df = display_df.copy()
+        display_df.insert(0, '#', range(1, len(display_df) + 1), allow_duplicates=True)
         table_html = display_df.to_html(
-            classes='table table-bordered table-hover table-sm', # smaller table
+            classes=PREVIEW_TABLE_CLASSES,
             index=False, # Crucial: we've manually added our row number column
             border=0,
             escape=True, # Default and good for security
             na_rep='' # Custom NaN representation
         )
-        total_rows = len(df) # Get total rows from the full DataFrame
-        total_columns = len(df.columns) # Get total data columns from the full DataFrame (excludes the display-only '#')
+    return table_html, len(df), len(df.columns) # Totals come from the full DataFrame (excludes the display-only '#')
+
+def search_mask(df, column_name, search_term):
+    """Case-insensitive 'contains' match of search_term against one column."""
+    return df[column_name].astype(str).str.lower().str.contains(search_term.lower(), na=False)
+
+# --- Grid Views ---
+# Searching and sorting only change which rows the grid shows and in what
+# order. A view is stored as an array of row positions per (version, view
+# spec) and applied to a page at a time, so the dataset is never copied and
+# no history entry is made.
+
+def get_view_spec():
+    """The session's active search and sort, or None when the grid shows rows in data order."""
+    spec = {}
+    if session.get('active_search_criteria'):
+        spec['search'] = session['active_search_criteria']
+    if session.get('active_sort'):
+        spec['sort'] = session['active_sort']
+    return spec or None
+
+def _drop_stale_view(df):
+    """Forgets view parts that refer to columns which were dropped or renamed since."""
+    criteria = session.get('active_search_criteria')
+    if criteria and criteria.get('column') not in df.columns:
+        session.pop('active_search_criteria', None)
+    sort = session.get('active_sort')
+    if sort and not all(col in df.columns for col in sort['columns']):
+        session.pop('active_sort', None)
+
+def compute_view_positions(df, spec):
+    """Row positions of df matching spec's search, in spec's sort order."""
+    positions = np.arange(len(df))
+    search = spec.get('search')
+    if search:
+        positions = np.flatnonzero(search_mask(df, search['column'], search.get('term_raw', '')).to_numpy())
+    sort = spec.get('sort')
+    if sort:
+        keys = df.iloc[positions][sort['columns']].reset_index(drop=True)
+        order = keys.sort_values(by=sort['columns'], ascending=sort['ascending'], kind='stable').index.to_numpy()
+        positions = positions[order]
+    return positions
+
+def get_view_positions(df):
+    """Cached row positions for the active view, or None when there is no view."""
+    if df is None:
+        return None
+    _drop_stale_view(df)
+    spec = get_view_spec()
+    if not spec:
+        return None
+    key = get_preview_cache_key('view')
+    positions = preview_cache.get(key) if key else None
+    if positions is None:
+        positions = compute_view_positions(df, spec)
+        positions.setflags(write=False) # Shared through the cache
+        if key:
+            preview_cache.put(key, positions)
+    return positions
+
+def _view_slice(df, positions, offset, limit):
+    if positions is None:
+        return df.iloc[offset:offset + limit]
+    return df.iloc[positions[offset:offset + limit]]
+
+def format_grid_columns(page_df):
+    """Formats a slice of the frame as one list of display strings ('' for missing) per column."""
+    if not len(page_df):
+        return [[] for _ in range(page_df.shape[1])] # astype(str) fails on an empty categorical
+    cells = []
+    for position in range(page_df.shape[1]):
+        series = page_df.iloc[:, position]
+        cells.append(series.astype(str).where(series.notna(), '').tolist())
+    return cells
+
+def format_grid_rows(page_df):
+    """Formats a slice of the frame as row lists of display strings ('' for missing)."""
+    cells = format_grid_columns(page_df)
+    if not cells:
+        return [[] for _ in range(len(page_df))]
+    return [list(row) for row in zip(*cells)]
+
+def _grid_page_bounds(df, offset, limit, positions=None, total_rows=None):
+    """
+    Clamps a requested page to the frame (or view); returns (offset, limit, grid
+    metadata). total_rows overrides the row count when df only holds the columns.
+    """
+    page_size = app.config['GRID_PAGE_SIZE']
+    limit = max(1, min(limit or page_size, app.config['GRID_MAX_PAGE_SIZE']))
+    if total_rows is None:
+        total_rows = len(positions) if positions is not None else len(df) if df is not None else 0
+    offset = max(0, min(offset, total_rows))
+    meta = {
+        'version': get_current_dataset_version(),
+        'columns': [str(col) for col in df.columns] if df is not None else [],
+        'total_rows': total_rows,
+        'total_columns': len(df.columns) if df is not None else 0,
+        'page_size': page_size,
+        'offset': offset,
+        'view': get_view_spec() # Active search/sort, so the client can show what it is looking at
+    }
+    return offset, limit, meta
+
+def get_grid_page(df, offset=0, limit=None, include_rows=True, positions=None):
+    """
+    Returns one page of the data grid as compact JSON-ready data.
+    Only the requested rows are formatted, so the cost is independent of the
+    dataset's size. `positions` restricts and orders the rows (a view).
+    """
+    offset, limit, page = _grid_page_bounds(df, offset, limit, positions)
+    page['rows'] = format_grid_rows(_view_slice(df, positions, offset, limit)) if page['total_rows'] and include_rows else []
+    return page
+
+ARROW_STREAM_MIMETYPE = 'application/vnd.apache.arrow.stream'
+
+def dataframe_to_arrow(df):
+    """
+    Converts df to an Arrow table column by column, keeping native types where
+    Arrow has them and falling back to display strings where it does not.
+    Duplicate and non-string column names are kept (as strings).
+    """
+    arrays = []
+    for position in range(df.shape[1]):
+        series = df.iloc[:, position]
+        try:
+            arrays.append(pa.Array.from_pandas(series))
+        except (pa.ArrowTypeError, pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            arrays.append(pa.array(series.astype(str).where(series.notna(), None), type=pa.string()))
+    return pa.Table.from_arrays(arrays, names=[str(col) for col in df.columns])
+
+def arrow_ipc_stream(table, max_chunksize=None):
+    """Serializes a table as Arrow IPC stream bytes (one or more record batches)."""
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table, max_chunksize=max_chunksize)
+    return sink.getvalue().to_pybytes()
+
+def get_cached_grid_page(df, offset=0, limit=None):
+    """
+    get_grid_page for the active view, formatted once per (version, view, page).
+    Without df (see load_grid_frame) the page of a large version is read.
+    """
+    key = get_preview_cache_key('grid', offset, limit)
+    page = preview_cache.get(key) if key else None
+    if page is None:
+        large = get_large_dataset() if df is None else None
+        if large is not None:
+            page = get_large_grid_page(*large, offset=offset, limit=limit)
+        else:
+            page = get_grid_page(df, offset=offset, limit=limit, positions=get_view_positions(df))
+        if key:
+            preview_cache.put(key, page)
+    return page
+
+def build_grid_payload(df):
+    """Grid metadata plus the first page, sent back by every data-changing route."""
+    return get_cached_grid_page(df)
+
+def _true_runs(mask):
+    """[start, stop) position ranges where a boolean array is True."""
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.astype(np.int8), [0]))))
+    return edges.reshape(-1, 2).tolist()
+
+def build_grid_patch(df, parent_df, window=None):
+    """
+    Describes df as edits to parent_df for the grid: row ranges removed and a
+    column layout of kept/renamed parent spans plus new columns, with the new
+    columns' cells for the client's visible window. Returns None when the
+    change is not a patchable one (rows or columns reordered, most columns new).
+    """
+    diff = _diff_against_parent(df, parent_df)
+    if diff is None:
+        return None
+    row_positions, column_sources = diff
+
+    removed_rows = []
+    if row_positions is not None:
+        if len(row_positions) > 1 and (np.diff(row_positions) <= 0).any():
+            return None # Rows were reordered, not just removed
+        kept = np.zeros(len(parent_df), dtype=bool)
+        kept[row_positions] = True
+        removed_rows = _true_runs(~kept)
+
+    layout, new_columns, last_source = [], [], -1
+    for i, source in enumerate(column_sources):
+        name = str(df.columns[i])
+        if source is None:
+            layout.append({'new': name})
+            new_columns.append(i)
+        elif source <= last_source:
+            return None # Columns were reordered
+        elif name != str(parent_df.columns[source]):
+            layout.append({'rename': [source, name]})
+        elif layout and 'keep' in layout[-1] and layout[-1]['keep'][1] == source:
+            layout[-1]['keep'][1] = source + 1
+        else:
+            layout.append({'keep': [source, source + 1]})
+        last_source = source if source is not None else last_source
+    if len(new_columns) > max(1, df.shape[1] // 2):
+        return None # Mostly rewritten; a fresh page is smaller
+
+    start, stop = window if window else (0, app.config['GRID_PAGE_SIZE'])
+    start = max(0, min(int(start), len(df)))
+    stop = max(start, min(int(stop), len(df), start + app.config['GRID_MAX_PAGE_SIZE']))
+    return {
+        'version': get_current_dataset_version(),
+        'total_rows': len(df),
+        'total_columns': len(df.columns),
+        'removed_rows': removed_rows,
+        'layout': layout,
+        'cells': {
+            'offset': start,
+            'columns': new_columns,
+            'rows': format_grid_rows(df.iloc[start:stop, new_columns]) if new_columns else []
+        }
+    }
+
+def build_grid_update(df):
+    """
+    Grid fields for a data-changing response: a patch against the version the
+    client was showing when the change is small, otherwise the full first page.
+    The column list is only included when it changed.
+    """
+    handle = get_dataset_handle()
+    state = load_dataset_state()
+    base_version = state['undo'][-1] if state['undo'] else None
+    parent_df = g.get('dataset_frames', {}).get((handle['store_id'], base_version)) if handle else None
+    payload = request.get_json(silent=True) if request.is_json else None
+    window = payload.get('grid_window') if isinstance(payload, dict) else None
+
+    patch = None
+    if parent_df is not None and df is not None and not get_view_spec():
+        try:
+            patch = build_grid_patch(df, parent_df, window=window)
+        except Exception as e: # A patch is only an optimization; the full page always works
+            app.logger.warning(f"Could not build grid patch: {e}")
+    if patch is None:
+        grid = build_grid_payload(df)
+        return {'grid': grid, 'columns': df.columns.tolist() if df is not None else [],
+                'total_rows': grid['total_rows'], 'total_columns': grid['total_columns']}
+
+    patch['base_version'] = base_version
+    update = {'grid_patch': patch, 'total_rows': patch['total_rows'], 'total_columns': patch['total_columns']}
+    if df.columns.tolist() != parent_df.columns.tolist():
+        update['columns'] = df.columns.tolist()
+    return update
+
+def render_cached_table_html(df, max_rows=999):
+    """render_table_html, generated once per (version, max_rows)."""
+    key = get_preview_cache_key('html', max_rows)
+    rendered = preview_cache.get(key) if key else None
+    if rendered is None:
+        rendered = render_table_html(df, max_rows=max_rows)
+        if key:
+            preview_cache.put(key, rendered)
+    return rendered
+
+# --- Large Datasets ---
+# Versions whose column files add up to more than LARGE_DATASET_BYTES are not
+# loaded whole by the grid and the common cleaning steps. Their memory-mapped
+# column files are read in chunks of LARGE_DATASET_CHUNK_ROWS rows instead:
+#   - the page, grid pages and undo/redo responses read only the rows on screen;
+#   - row-wise steps run apply_clean_operation on one chunk at a time and
+#     append the result to new files for just the columns they change;
+#   - steps that drop or reorder rows only write a rows file, sharing every
+#     column file with the parent version;
+#   - steps that need the whole column first gather it in bounded passes:
+#     means as running sums, medians and IQR bounds by narrowing histograms,
+#     duplicates by hashing rows into spill files on disk, sorts as an Arrow
+#     sort of the memory-mapped key columns.
+# Each result is an ordinary version manifest, so history, pruning and cold
+# storage treat it like any other. Steps without a chunked form (and all the
+# other routes) still load the version as a DataFrame.
+
+QUANTILE_BINS = 4096 # Histogram bins per refinement pass
+QUANTILE_COLLECT_VALUES = 1024 * 1024 # Values few enough to collect and sort directly
+DUPLICATE_HASH_KEY = '5f1d3b9a7c2e4068' # Second, independent row hash; both must match for a duplicate
+
+class ChunkedExecutionUnsupported(Exception):
+    """Raised when a step cannot run out of core; the caller loads the version instead."""
+
+def get_manifest_bytes(store_id, manifest):
+    """Size on disk of the column files a manifest references (cold files count compressed)."""
+    total = 0
+    for ref in manifest['columns']:
+        for cold in (False, True):
+            path = get_dataset_column_path(store_id, ref['column'], cold)
+            if os.path.exists(path):
+                total += os.path.getsize(path)
+                break
+    return total
+
+def get_large_dataset():
+    """(store id, manifest) of the current version when it is processed out of core, else None."""
+    handle = get_dataset_handle()
+    version = get_current_dataset_version()
+    if not handle or version is None:
+        return None
+    manifest = read_dataset_manifest(handle['store_id'], version)
+    if manifest is None or manifest['index'].get('range') != [0, manifest['shape'][0], 1] or manifest['index'].get('rows'):
+        return None # Only logged, or a custom index chunks would have to carry along
+    if get_manifest_bytes(handle['store_id'], manifest) < app.config['LARGE_DATASET_BYTES']:
+        return None
+    return handle['store_id'], manifest
+
+def _column_positions(names, wanted):
+    """Positions of every column whose name is in wanted (duplicates included)."""
+    return [position for position, name in enumerate(names) if name in wanted]
+
+def _open_manifest_columns(store_id, manifest, column_positions=None):
+    """Memory-maps the files of a manifest's columns: [(table, row positions or None, ref)]."""
+    rows_cache, opened = {}, []
+    refs = manifest['columns']
+    for position in (range(len(refs)) if column_positions is None else column_positions):
+        ref = refs[position]
+        table = read_store_table(store_id, 'columns', ref['column'])
+        rows = None
+        if ref.get('rows'):
+            if ref['rows'] not in rows_cache:
+                rows_cache[ref['rows']] = read_dataset_rows(store_id, ref['rows'])
+            rows = rows_cache[ref['rows']]
+        opened.append((table, rows, ref))
+    return opened
+
+def _read_opened_rows(opened, names, start, stop):
+    columns = []
+    for table, rows, ref in opened:
+        part = table.slice(start, stop - start) if rows is None else table.take(rows[start:stop])
+        columns.append(restore_column_values(part, ref))
+    index = pd.RangeIndex(start, stop)
+    if columns:
+        df = pd.concat(columns, axis=1, ignore_index=True).set_axis(index)
+    else:
+        df = pd.DataFrame(index=index)
+    df.columns = names
+    return df
+
+def iter_dataset_chunks(store_id, manifest, column_positions=None):
+    """
+    Yields a version as DataFrames of LARGE_DATASET_CHUNK_ROWS rows, indexed by
+    row position, optionally holding only the columns at column_positions.
+    """
+    chunk_rows = app.config['LARGE_DATASET_CHUNK_ROWS']
+    opened = _open_manifest_columns(store_id, manifest, column_positions)
+    names = manifest_columns_index(manifest)
+    if column_positions is not None:
+        names = names.take(column_positions)
+    total_rows = manifest['shape'][0]
+    for start in range(0, total_rows, chunk_rows):
+        yield _read_opened_rows(opened, names, start, min(start + chunk_rows, total_rows))
+
+def read_dataset_window(store_id, manifest, start, stop):
+    """Rows [start, stop) of a version, reading nothing else."""
+    stop = max(start, min(stop, manifest['shape'][0]))
+    return _read_opened_rows(_open_manifest_columns(store_id, manifest), manifest_columns_index(manifest), start, stop)
+
+class _ArrowFileAppender:
+    """A one-column Arrow file in the dataset store, written batch by batch and published on close."""
+
+    def __init__(self, path, field_name, arrow_type):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.field_name = field_name
+        self.tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        self.writer = pa.ipc.new_file(self.tmp_path, pa.schema([(field_name, arrow_type)]))
+
+    def append(self, array):
+        self.writer.write_batch(pa.record_batch([array], names=[self.field_name]))
+
+    def close(self):
+        self.writer.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        try:
+            self.writer.close()
+        except (OSError, pa.ArrowException):
+            pass
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+def _chunk_to_arrow(series):
+    """One chunk of a column as an Arrow array; categoricals stay dictionary-encoded so their categories keep their order."""
+    try:
+        array = None
+        if pd.api.types.is_object_dtype(series.dtype):
+            try: # A chunk of only missing text would otherwise come out untyped
+                array = pa.Array.from_pandas(series, type=pa.string())
+            except (pa.ArrowTypeError, pa.ArrowInvalid):
+                pass
+        if array is None:
+            array = pa.Array.from_pandas(series)
+    except (pa.ArrowTypeError, pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+        raise ChunkedExecutionUnsupported(f"column {series.name!r} cannot be stored as Arrow: {e}")
+    if pa.types.is_dictionary(array.type) and not isinstance(series.dtype, pd.CategoricalDtype):
+        array = array.dictionary_decode()
+    return array
+
+class ChunkedColumnWriter:
+    """
+    Writes new column files chunk by chunk. Each column keeps the Arrow type
+    and pandas dtype (categories included) of its first chunk; later chunks
+    that disagree make the step unsupported rather than silently changing
+    the column's type.
+    """
+
+    def __init__(self, store_id, column_count):
+        self.store_id = store_id
+        self.column_count = column_count
+        self._columns = [] # (column id, appender, arrow type, dtype)
+        self._categories = {} # Position -> categories of a categorical column's first chunk
+
+    def write(self, df):
+        if df.shape[1] != self.column_count:
+            raise ChunkedExecutionUnsupported('the step changed the columns')
+        arrays = [_chunk_to_arrow(df.iloc[:, position]) for position in range(df.shape[1])]
+        if not self._columns:
+            for position, array in enumerate(arrays):
+                column_id = uuid.uuid4().hex
+                appender = _ArrowFileAppender(get_dataset_column_path(self.store_id, column_id), 'values', array.type)
+                self._columns.append((column_id, appender, array.type, str(df.iloc[:, position].dtype)))
+                if isinstance(df.iloc[:, position].dtype, pd.CategoricalDtype):
+                    self._categories[position] = df.iloc[:, position].dtype
+        for position, (array, (_, appender, arrow_type, dtype)) in enumerate(zip(arrays, self._columns)):
+            if str(df.iloc[:, position].dtype) != dtype:
+                raise ChunkedExecutionUnsupported(f"column {df.columns[position]!r} changed dtype between chunks")
+            if position in self._categories and df.iloc[:, position].dtype != self._categories[position]:
+                raise ChunkedExecutionUnsupported(f"column {df.columns[position]!r} changed categories between chunks")
+            if array.type != arrow_type:
+                try:
+                    array = array.cast(arrow_type)
+                except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+                    raise ChunkedExecutionUnsupported(f"column {df.columns[position]!r} changed type between chunks: {e}")
+            appender.append(array)
+
+    def close(self):
+        """Publishes the files and returns their column references (without names)."""
+        refs = []
+        for column_id, appender, _, dtype in self._columns:
+            appender.close()
+            refs.append({'column': column_id, 'dtype': dtype, 'storage': 'arrow', 'rows': None})
+        return refs
+
+    def abort(self):
+        for _, appender, _, _ in self._columns:
+            appender.abort()
+            _remove_store_file(appender.path)
+
+def _rewrite_columns(store_id, manifest, column_positions, transform):
+    """
+    Runs transform over chunks holding only the given columns and writes what
+    it returns as those columns' new files; every other column is shared.
+    """
+    writer = ChunkedColumnWriter(store_id, len(column_positions))
+    try:
+        for chunk in iter_dataset_chunks(store_id, manifest, column_positions):
+            writer.write(transform(chunk))
+        refs = writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+    replaced = dict(zip(column_positions, refs))
+    columns = [dict(replaced.get(position, ref), name=ref['name']) for position, ref in enumerate(manifest['columns'])]
+    return dict(manifest, columns=columns)
+
+def _select_rows(store_id, manifest, position_batches):
+    """
+    Derives a manifest showing the parent's rows at the given positions
+    (batches of int64 arrays, in output order). Only rows files are written;
+    the column files are shared with the parent.
+    """
+    derived = {} # Parent rows id -> (parent positions, new rows id, appender)
+    for ref in manifest['columns']:
+        parent_rows = ref.get('rows')
+        if parent_rows not in derived:
+            rows_id = uuid.uuid4().hex
+            derived[parent_rows] = (
+                read_dataset_rows(store_id, parent_rows) if parent_rows else None, rows_id,
+                _ArrowFileAppender(get_dataset_rows_path(store_id, rows_id), 'positions', pa.int64())
+            )
+    total_rows = 0
+    try:
+        for batch in position_batches:
+            for parent_positions, _, appender in derived.values():
+                positions = batch if parent_positions is None else parent_positions[batch]
+                appender.append(pa.array(positions, type=pa.int64()))
+            total_rows += len(batch)
+        for _, _, appender in derived.values():
+            appender.close()
+    except BaseException:
+        for _, _, appender in derived.values():
+            appender.abort()
+            _remove_store_file(appender.path)
+        raise
+    columns = [dict(ref, rows=derived[ref.get('rows')][1]) for ref in manifest['columns']]
+    return dict(manifest, columns=columns, index={'range': [0, total_rows, 1], 'rows': None, 'name': manifest['index']['name']},
+                shape=[total_rows, len(columns)])
+
+def _column_numbers(store_id, manifest, position):
+    """Yields the non-missing values of one numeric column as float64 arrays, a chunk at a time."""
+    for chunk in iter_dataset_chunks(store_id, manifest, [position]):
+        values = chunk.iloc[:, 0].to_numpy(dtype='float64', na_value=np.nan)
+        yield values[~np.isnan(values)]
+
+def _select_ranks(store_id, manifest, position, ranks, count, low, high):
+    """
+    Values at the given 0-based ranks of a column's `count` sorted non-missing values.
+    Each rank is tracked by a window [lo, hi) with `below` values under it;
+    one pass histograms every open window and narrows it to the bin holding
+    the rank, until a window holds few enough values to collect and sort.
+    """
+    count_limit = QUANTILE_COLLECT_VALUES
+    windows = {rank: (low, np.nextafter(high, np.inf), 0, count <= count_limit) for rank in ranks}
+    found = {}
+    while windows:
+        edges = {rank: np.linspace(lo, hi, QUANTILE_BINS + 1) for rank, (lo, hi, _, collect) in windows.items() if not collect}
+        parts = {rank: [] for rank in windows}
+        for values in _column_numbers(store_id, manifest, position):
+            for rank, (lo, hi, _, collect) in windows.items():
+                inside = values[(values >= lo) & (values < hi)]
+                if collect:
+                    parts[rank].append(inside)
+                else:
+                    bins = np.searchsorted(edges[rank], inside, side='right') - 1
+                    parts[rank].append(np.bincount(bins, minlength=QUANTILE_BINS))
+        for rank, (lo, hi, below, collect) in list(windows.items()):
+            del windows[rank]
+            if collect:
+                found[rank] = float(np.sort(np.concatenate(parts[rank]))[rank - below])
+                continue
+            cumulative = np.cumsum(np.sum(parts[rank], axis=0))
+            b = int(np.searchsorted(cumulative, rank - below, side='right'))
+            lo, hi = edges[rank][b], edges[rank][b + 1]
+            below += int(cumulative[b - 1]) if b else 0
+            if hi <= np.nextafter(lo, np.inf):
+                found[rank] = float(lo) # The bin holds a single representable value
+            else:
+                windows[rank] = (lo, hi, below, int(cumulative[b]) - (int(cumulative[b - 1]) if b else 0) <= count_limit)
+    return found
+
+def chunked_quantiles(store_id, manifest, position, quantiles):
+    """
+    (non-missing count, quantiles) of one numeric column, exact and linearly
+    interpolated like Series.quantile, without sorting the column in memory.
+    """
+    count, low, high = 0, np.inf, -np.inf
+    for values in _column_numbers(store_id, manifest, position):
+        if len(values):
+            count += len(values)
+            low, high = min(low, values.min()), max(high, values.max())
+    if not count:
+        return 0, [np.nan] * len(quantiles)
+    if not (np.isfinite(low) and np.isfinite(high)):
+        raise ChunkedExecutionUnsupported('the column holds infinite values')
+    targets = []
+    for quantile in quantiles:
+        exact = (count - 1) * quantile
+        lower = int(np.floor(exact))
+        targets.append((lower, min(lower + 1, count - 1), exact - lower))
+    found = _select_ranks(store_id, manifest, position, sorted({rank for t in targets for rank in t[:2]}), count, low, high)
+    results = []
+    for lower, upper, fraction in targets:
+        a, b = found[lower], found[upper]
+        # Same interpolation as numpy's 'linear' method, so results match to the last bit
+        results.append(b - (b - a) * (1 - fraction) if fraction >= 0.5 else a + (b - a) * fraction)
+    return count, results
+
+def _chunked_column_stat(store_id, manifest, position, method):
+    """(non-missing count, mean or median) of one numeric column."""
+    if method == 'median':
+        count, (median,) = chunked_quantiles(store_id, manifest, position, [0.5])
+        return count, median
+    count, total = 0, 0.0
+    for values in _column_numbers(store_id, manifest, position):
+        count += len(values)
+        total += float(values.sum())
+    return count, (total / count if count else np.nan)
+
+def _find_duplicate_rows(store_id, manifest, column_positions):
+    """
+    Marks the rows drop_duplicates(keep='first') would drop. Two independent
+    64-bit hashes of every row are spilled to bucket files on disk, then each
+    bucket is sorted on its own, so memory holds one bucket plus one bit per row.
+    """
+    total_rows = manifest['shape'][0]
+    entry = np.dtype([('h1', '<u8'), ('h2', '<u8'), ('row', '<i8')])
+    buckets = int(min(1024, total_rows * entry.itemsize // app.config['LARGE_DATASET_SPILL_BYTES'] + 1))
+    spill_dir = os.path.join(get_dataset_store_dir(store_id), 'spill', uuid.uuid4().hex)
+    os.makedirs(spill_dir)
+    try:
+        files = [open(os.path.join(spill_dir, f'{bucket}.bin'), 'wb') for bucket in range(buckets)]
+        try:
+            for chunk in iter_dataset_chunks(store_id, manifest, column_positions):
+                hashed = np.empty(len(chunk), dtype=entry)
+                hashed['h1'] = pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+                hashed['h2'] = pd.util.hash_pandas_object(chunk, index=False, hash_key=DUPLICATE_HASH_KEY).to_numpy()
+                hashed['row'] = chunk.index.to_numpy()
+                bucket_of = hashed['h1'] % buckets
+                order = np.argsort(bucket_of, kind='stable')
+                hashed = hashed[order]
+                bounds = np.searchsorted(bucket_of[order], np.arange(buckets + 1))
+                for bucket, f in enumerate(files):
+                    hashed[bounds[bucket]:bounds[bucket + 1]].tofile(f)
+        finally:
+            for f in files:
+                f.close()
+        duplicate = np.zeros(total_rows, dtype=bool)
+        for bucket in range(buckets):
+            hashed = np.fromfile(os.path.join(spill_dir, f'{bucket}.bin'), dtype=entry)
+            if len(hashed) < 2:
+                continue
+            hashed = hashed[np.lexsort((hashed['row'], hashed['h2'], hashed['h1']))]
+            repeat = (hashed['h1'][1:] == hashed['h1'][:-1]) & (hashed['h2'][1:] == hashed['h2'][:-1])
+            duplicate[hashed['row'][1:][repeat]] = True # All but the first row of each group
+        return duplicate
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+def _sort_order(store_id, manifest, columns, ascending):
+    """Row order of a stable multi-column sort (missing values last), computed by Arrow on the memory-mapped keys."""
+    names = manifest_columns_index(manifest)
+    ascending = ascending if isinstance(ascending, list) else [ascending] * len(columns)
+    keys, sort_keys = {}, []
+    for i, (column, column_ascending) in enumerate(zip(columns, ascending)):
+        positions = _column_positions(names, [column])
+        ref = manifest['columns'][positions[0]] if len(positions) == 1 else None
+        if ref is None or ref['storage'] != 'arrow' or ref['dtype'] == 'category':
+            raise ChunkedExecutionUnsupported(f"column {column!r} cannot be sorted by Arrow")
+        (table, rows, _), = _open_manifest_columns(store_id, manifest, positions)
+        keys[f'k{i}'] = table.column(0) if rows is None else table.column(0).take(rows)
+        sort_keys.append((f'k{i}', 'ascending' if column_ascending else 'descending'))
+    return pc.sort_indices(pa.table(keys), sort_keys=sort_keys).to_numpy() # Nulls sort last by default
+
+def _batches(positions, total_rows):
+    """Splits a row selection (boolean mask or positions) into chunk-sized int64 batches."""
+    chunk_rows = app.config['LARGE_DATASET_CHUNK_ROWS']
+    for start in range(0, total_rows, chunk_rows):
+        part = positions[start:start + chunk_rows]
+        yield np.flatnonzero(part) + start if part.dtype == bool else part.astype(np.int64, copy=False)
+
+def run_chunked_operation(store_id, manifest, operation, params):
+    """
+    Runs one /clean_operation step on a large version out of core and returns
+    (manifest of the result, message). Parameters are validated by the
+    in-memory step itself on the first row, so errors read the same. Raises
+    ChunkedExecutionUnsupported when the step needs the whole DataFrame.
+    """
+    method = params.get('method', 'value')
+    column = params.get('column')
+    row_wise = ('replace_text', 'change_case', 'remove_spaces', 'map_values')
+    supported = row_wise + ('remove_missing', 'filter_rows', 'remove_duplicates', 'sort_values',
+                            'remove_outliers_iqr', 'clip_outliers_iqr')
+    if operation not in supported and not (operation == 'fill_missing' and method in ('value', 'mean', 'median')):
+        raise ChunkedExecutionUnsupported(f"no chunked form of '{operation}'")
+    total_rows = manifest['shape'][0]
+    if not total_rows:
+        raise ChunkedExecutionUnsupported('the version has no rows')
+    header = read_dataset_window(store_id, manifest, 0, 1)
+    names = header.columns
+    try:
+        _, header_msg = apply_clean_operation(header, operation, params)
+    except CleaningOperationError:
+        raise
+    except Exception as e: # The in-memory step reports (or handles) it on the whole frame
+        raise ChunkedExecutionUnsupported(f"validation on the first row failed: {e}")
+    target = _column_positions(names, [column]) if column else list(range(len(names)))
+
+    if operation in row_wise or (operation == 'fill_missing' and method == 'value'):
+        # Messages of these steps do not depend on the values
+        step = lambda chunk: apply_clean_operation(chunk, operation, params)[0]
+        return _rewrite_columns(store_id, manifest, target, step), header_msg
+
+    if operation == 'remove_missing':
+        how, subset = params.get('how', 'any'), params.get('subset')
+        batches = (chunk.dropna(axis=0, how=how, subset=subset).index.to_numpy(dtype=np.int64)
+                   for chunk in iter_dataset_chunks(store_id, manifest, _column_positions(names, subset) if subset else None))
+        result = _select_rows(store_id, manifest, batches)
+        return result, f"Removed {total_rows - result['shape'][0]} row(s) containing missing values."
+
+    if operation == 'filter_rows':
+        condition, value_str = params.get('condition'), params.get('value')
+        keep = params.get('action', 'keep') == 'keep'
+        _, value_display = build_filter_mask(header, column, condition, value_str)
+        def batches():
+            for chunk in iter_dataset_chunks(store_id, manifest, target):
+                mask, _ = build_filter_mask(chunk, column, condition, value_str)
+                yield chunk[mask if keep else ~mask].index.to_numpy(dtype=np.int64)
+        result = _select_rows(store_id, manifest, batches())
+        count = result['shape'][0] if keep else total_rows - result['shape'][0]
+        return result, f"{'Kept' if keep else 'Removed'} {count} row(s) where '{column}' {condition} {value_display}."
+
+    if operation == 'remove_duplicates':
+        subset = params.get('subset')
+        positions = _column_positions(names, subset) if subset else list(range(len(names)))
+        if any(manifest['columns'][position]['storage'] != 'arrow' for position in positions):
+            raise ChunkedExecutionUnsupported('mixed-type columns hash by their text')
+        duplicate = _find_duplicate_rows(store_id, manifest, positions)
+        result = _select_rows(store_id, manifest, _batches(~duplicate, total_rows))
+        return result, f"Removed {int(duplicate.sum())} duplicate row(s)."
+
+    if operation == 'sort_values':
+        order = _sort_order(store_id, manifest, params.get('columns_to_sort_by'), params.get('ascending', True))
+        return _select_rows(store_id, manifest, _batches(order, total_rows)), header_msg
+
+    if operation == 'fill_missing': # mean or median
+        if len(target) != 1 and column:
+            raise ChunkedExecutionUnsupported('duplicate column name')
+        fills, filled_cols, skipped_cols = {}, [], []
+        for position in target:
+            if pd.api.types.is_numeric_dtype(header.iloc[:, position]):
+                count, stat = _chunked_column_stat(store_id, manifest, position, method)
+                if count:
+                    fills[position] = stat
+                    filled_cols.append(f"{names[position]} ({stat:.4g})")
+                    continue
+            skipped_cols.append(f"{names[position]} (not numeric/all null)")
+        if column:
+            action_msg = (f"Filled missing values in numeric column '{column}' with its {method} ({fills[target[0]]:.4g})." if fills
+                          else f"Skipped: Cannot calculate {method} for column '{column}' as all values are missing.")
+        elif filled_cols:
+            action_msg = f"Filled missing values in numeric columns with their respective {method}: {'; '.join(filled_cols)}."
+            if skipped_cols:
+                action_msg += f" Skipped: {', '.join(skipped_cols)}."
+        else:
+            action_msg = f"No numeric columns found/filled using {method} method."
+        if not fills:
+            return dict(manifest), action_msg
+        stats = list(fills.values())
+        step = lambda chunk: pd.concat([chunk.iloc[:, i].fillna(stat) for i, stat in enumerate(stats)], axis=1)
+        return _rewrite_columns(store_id, manifest, list(fills), step), action_msg
+
+    # IQR outlier steps
+    if len(target) != 1:
+        raise ChunkedExecutionUnsupported('duplicate column name')
+    factor = float(params.get('factor', 1.5))
+    count, (q1, q3) = chunked_quantiles(store_id, manifest, target[0], [0.25, 0.75])
+    if count < 4:
+        label = 'outlier removal' if operation == 'remove_outliers_iqr' else 'clipping'
+        return dict(manifest), f"Skipped IQR {label} for '{column}' (too few non-NA values)."
+    iqr = q3 - q1
+    lower_bound, upper_bound = q1 - factor * iqr, q3 + factor * iqr
+    bounds = f"Bounds: [{lower_bound:.2f}, {upper_bound:.2f}]."
+    if operation == 'remove_outliers_iqr':
+        def batches():
+            for chunk in iter_dataset_chunks(store_id, manifest, target):
+                values = chunk.iloc[:, 0]
+                keep = ((values >= lower_bound) & (values <= upper_bound)) | values.isnull()
+                yield chunk[keep].index.to_numpy(dtype=np.int64)
+        result = _select_rows(store_id, manifest, batches())
+        removed = total_rows - result['shape'][0]
+        return result, f"Removed {removed} row(s) with outliers from column '{column}' using IQR (factor={factor}). {bounds}"
+    clipped = 0
+    def clip(chunk):
+        nonlocal clipped
+        values = chunk.iloc[:, 0]
+        result = values.clip(lower=lower_bound, upper=upper_bound)
+        clipped += int((values != result).sum())
+        return result.to_frame()
+    result = _rewrite_columns(store_id, manifest, target, clip)
+    return result, f"Clipped {clipped} outlier(s) in column '{column}' using IQR (factor={factor}). {bounds}"
+
+def commit_large_version(store_id, manifest, step):
+    """Makes a manifest produced out of core the next version; the current one goes to undo."""
+    parent = get_current_dataset_version()
+    add_to_undo(parent)
+    state = load_dataset_state()
+    new_version = state['latest'] + 1
+    append_history_log(store_id, {'version': new_version, 'parent': parent, 'step': step, 'shape': manifest['shape']})
+    _write_json_atomic(get_dataset_version_path(store_id, new_version), manifest)
+    state['version'] = new_version
+    state['latest'] = new_version
+    save_dataset_state(state)
+    prune_dataset_versions(state)
+    return new_version
+
+def run_large_clean_operation(store_id, manifest):
+    """
+    /clean_operation on a large version: runs the step out of core and answers
+    like the in-memory path. Returns None when the step has to load the data.
+    """
+    request_data = request.get_json(silent=True)
+    if not isinstance(request_data, dict) or not request_data.get('operation'):
+        return None # The regular path reports malformed requests
+    operation, params = request_data['operation'], request_data.get('params', {})
+    started = time.perf_counter()
+    try:
+        new_manifest, action_msg = run_chunked_operation(store_id, manifest, operation, params)
+    except ChunkedExecutionUnsupported as e:
+        app.logger.info(f"Loading the large dataset to run '{operation}': {e}")
+        return None
+    except CleaningOperationError as e:
+        if e.status_code >= 500:
+            app.logger.error(f"Cleaning operation '{operation}' failed: {e.message}")
+        else:
+            app.logger.warning(f"Rejected cleaning operation '{operation}': {e.message}")
+        return jsonify({'error': e.message}), e.status_code
+    except Exception as e: # Nothing was committed; the current version is untouched
+        app.logger.error(f"Error during chunked cleaning operation '{operation}': {e}", exc_info=True)
+        return jsonify({'error': f'An internal server error occurred during the operation: {str(e)}'}), 500
+
+    commit_large_version(store_id, new_manifest, {'kind': 'clean_operation', 'operation': operation, 'params': params})
+    app.logger.info(f"Ran '{operation}' out of core on {manifest['shape'][0]} rows in {time.perf_counter() - started:.2f}s")
+    df = load_grid_frame()
+    grid = build_grid_payload(df)
+    return jsonify({
+        'message': action_msg,
+        'undo_redo_status': get_undo_redo_status(),
+        'dataset_version': get_current_dataset_version(),
+        'grid': grid,
+        'columns': grid_column_names(df),
+        'total_rows': grid['total_rows'],
+        'total_columns': grid['total_columns']
+    }), 200
+
+def load_grid_frame():
+    """
+    The current DataFrame for routes that only show grid pages, or None for a
+    large version shown without a view: its pages are read from the store.
+    """
+    if not get_view_spec() and get_large_dataset() is not None:
+        return None
+    return get_dataframe_from_session()
 
-    return table_html, total_rows, total_columns
+def grid_column_names(df):
+    """Column list sent with grid responses, for a loaded frame or a large version."""
+    if df is not None:
+        return df.columns.tolist()
+    large = get_large_dataset()
+    return manifest_columns_index(large[1]).tolist() if large else []
+
+def _large_grid_window(store_id, manifest, offset, limit):
+    """(rows of one grid page, grid metadata) for a large version."""
+    total_rows = manifest['shape'][0]
+    header = read_dataset_window(store_id, manifest, 0, 0)
+    offset, limit, meta = _grid_page_bounds(header, offset, limit, total_rows=total_rows)
+    return read_dataset_window(store_id, manifest, offset, offset + limit), meta
+
+def get_large_grid_page(store_id, manifest, offset=0, limit=None, include_rows=True):
+    """get_grid_page for a large version without a view; only the page's rows are read."""
+    window, page = _large_grid_window(store_id, manifest, offset, limit)
+    page['rows'] = format_grid_rows(window) if include_rows else []
+    return page
 
 def clear_session_data():
     """Clears all data related to the current cleaning session."""
-    session.pop('current_df_json', None)
+    handle = session.pop('dataset_handle', None)
+    if handle:
+        delete_dataset_store(handle['store_id'])
+    session.pop('current_df_json', None) # Legacy payload keys from older sessions
     session.pop('undo_history', None)
     session.pop('redo_history', None)
     session.pop('source_info', None)
@@ -554,6 +3441,16 @@ def update_status():
     """An endpoint for the frontend to poll for update info."""
     return jsonify(UPDATE_INFO)
 
+@app.route('/dataset_cache_stats')
+@login_required
+def dataset_cache_stats():
+    """Reports hit/miss counters and memory use of the in-memory DataFrame cache."""
+    stats = dataframe_cache.stats()
+    stats['preview_cache'] = preview_cache.stats()
+    stats['ingest_cache'] = ingest_cache.stats()
+    stats['history_timings'] = list(history_timings)
+    return jsonify(stats)
+
 @app.route('/shutdown', methods=['POST'])
 def shutdown():
     """Shuts down the application server."""
@@ -1371,64 +4268,137 @@ def index():
     # This part is for logged-in users, showing upload options, connect DB, and saved files.
     return render_template('index.html', saved_files_info=saved_files_display_info)
 
-def load_data_into_session(df, source_info):
-    """Helper to load df into session and redirect."""
-    if df is not None:
-        clear_session_data() # Start fresh
-        store_dataframe_in_session(df)
-        session['source_info'] = source_info
-        return redirect(url_for('clean_data_interface'))
+def _run_upload_ingest(job, upload, filename):
+    file_ext = split_upload_extension(filename)[0]
+    try:
+        if file_ext in COLUMNAR_EXTENSIONS | ARCHIVE_EXTENSIONS | {'xlsx'}:
+            stage_upload(job, upload, file_ext)
+            if file_ext == 'xlsx' and len(job.staged['members']) == 1:
+                return _run_workbook_ingest(job, [job.staged['members'][0]['name']], False)
+            return None # The user picks columns and row groups, files or sheets next
+        manifest = ingest_upload(job.store_id, upload, filename, job=job)
+    except Exception as e:
+        raise IngestError(f'Error processing file: {str(e)}')
+    if manifest['source'].get('cached'):
+        job.messages.append(('info', 'This file was loaded before, so its parsed data was reused.'))
+    if manifest.get('skipped_rows'):
+        job.messages.append(('warning', f"Skipped {manifest['skipped_rows']} malformed rows whose field count did not match the header."))
+    return manifest
+
+def _run_columnar_ingest(job, columns, row_groups):
+    try:
+        manifest = ingest_columnar_file(job.store_id, job.staged, columns, row_groups, job=job)
+    except Exception as e:
+        raise IngestError(f'Error processing file: {str(e)}')
+    finally:
+        discard_staged_upload(job)
+    if manifest['source'].get('cached'):
+        job.messages.append(('info', 'This file and selection were loaded before, so the data was reused.'))
+    return manifest
+
+def _run_archive_ingest(job, members, combine, save_others=False):
+    try:
+        manifest, saved = ingest_archive(job.store_id, job.staged, members, combine, job=job, save_others=save_others)
+    except Exception as e:
+        raise IngestError(f'Error processing file: {str(e)}')
+    finally:
+        discard_staged_upload(job)
+    if not combine:
+        job.source_info = f"{job.source_info} / {os.path.basename(members[0])}"
+    if saved:
+        job.messages.append(('info', f"Also saved {', '.join(saved)} as separate datasets; open them from the home page."))
+    if manifest.get('skipped_rows'):
+        job.messages.append(('warning', f"Skipped {manifest['skipped_rows']} malformed rows whose field count did not match the header."))
+    return manifest
+
+def _run_workbook_ingest(job, sheets, combine, save_others=False):
+    try:
+        manifest, saved = ingest_workbook(job.store_id, job.staged, sheets, combine, job=job, save_others=save_others)
+    except Exception as e:
+        raise IngestError(f'Error processing file: {str(e)}')
+    finally:
+        discard_staged_upload(job)
+    if len(job.staged['members']) > 1 and not combine:
+        job.source_info = f"{job.source_info} / {sheets[0]}"
+    if manifest['source'].get('cached'):
+        job.messages.append(('info', 'This file and selection were loaded before, so the data was reused.'))
+    if saved:
+        job.messages.append(('info', f"Also saved {', '.join(saved)} as separate datasets; open them from the home page."))
+    return manifest
+
+def _run_database_ingest(job, connection_string, query):
+    engine = None
+    try:
+        engine = create_engine(connection_string)
+        chunks = []
+        with engine.connect() as connection:
+            for chunk in pd.read_sql(text(query), connection, chunksize=app.config['INGEST_SQL_CHUNK_ROWS']):
+                chunks.append(chunk)
+                job.rows += len(chunk)
+    except ImportError as e:
+        raise IngestError(f"Database driver error: {e}. Make sure the required driver is installed.")
+    except exc.SQLAlchemyError as e:
+        raise IngestError(f"Database connection or query error: {e}")
+    finally:
+        if engine:
+            engine.dispose()
+    job.phase = 'Storing data'
+    if len(chunks) > 1:
+        # A chunk that is all NULL comes back as object; let types settle across
+        # chunks. infer_objects gives the same result under pandas' old and
+        # announced all-NA concat rules, so the deprecation notice is noise here.
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', FutureWarning)
+            df = pd.concat(chunks, ignore_index=True).infer_objects()
     else:
-        flash('Could not load data.', 'error')
-        return redirect(url_for('index'))
+        df = chunks[0] if chunks else pd.DataFrame()
+    manifest = write_ingested_version(job.store_id, df)
+    job.messages.append(('success', 'Query successful.'))
+    return manifest
+
+def load_store_into_session(store_id, source_info, version=1):
+    """Makes an already ingested dataset store the session's current dataset."""
+    clear_session_data() # Start fresh
+    session['dataset_handle'] = {'store_id': store_id}
+    state = _empty_dataset_state()
+    state['version'] = state['latest'] = version
+    save_dataset_state(state)
+    session['source_info'] = source_info
 
 @app.route('/upload', methods=['POST'])
 @login_required
 def upload_file():
-    """Handles file upload, loads data into session."""
-    # (Similar upload logic as before, but use load_data_into_session)
-    if 'file' not in request.files:
+    """
+    Handles file upload, parsing it into a new dataset store as it streams in.
+    Takes no dataset lock: the upload writes a store of its own, and the
+    session only switches to it when a status poll claims the finished job.
+    """
+    boundary = request.mimetype_params.get('boundary')
+    if request.mimetype != 'multipart/form-data' or not boundary:
+        flash('No file part', 'error')
+        return redirect(url_for('index'))
+    try:
+        upload = MultipartFileReader(request.stream, boundary.encode('latin-1'))
+    except ValueError as e: # Malformed multipart body
+        flash(f'Error processing file: {str(e)}', 'error')
+        return redirect(url_for('index'))
+    if upload.filename is None:
         flash('No file part', 'error')
         return redirect(url_for('index'))
-    file = request.files['file']
-    if file.filename == '':
+    if upload.filename == '':
         flash('No selected file', 'error')
         return redirect(url_for('index'))
 
-    if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        # Save temporarily, process, then potentially remove
-        # Or read directly from file stream if possible and safe
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        try:
-            file.save(filepath)
-            df = None
-            file_ext = filename.rsplit('.', 1)[1].lower()
-            if file_ext == 'csv':
-                 # Try detecting separator, fall back to comma
-                 try:
-                     df = pd.read_csv(filepath, sep=None, engine='python', on_bad_lines='warn')
-                     if df.shape[1] <= 1:
-                          df = pd.read_csv(filepath, on_bad_lines='warn')
-                 except Exception as read_err:
-                      flash(f'Could not automatically determine CSV separator, trying comma. Error: {read_err}', 'warning')
-                      df = pd.read_csv(filepath, on_bad_lines='warn')
-            elif file_ext == 'tsv':
-                df = pd.read_csv(filepath, sep='\t', on_bad_lines='warn')
-            elif file_ext == 'xlsx':
-                # Consider asking for sheet name if multiple sheets exist
-                df = pd.read_excel(filepath)
-
-            os.remove(filepath) # Clean up temporary file
-            return load_data_into_session(df, f"{filename}")
-
-        except Exception as e:
-            flash(f'Error processing file: {str(e)}', 'error')
-            if os.path.exists(filepath): # Clean up if error occurred after save
-                 try:
-                     os.remove(filepath)
-                 except OSError: pass # Ignore error if removal fails
-            return redirect(url_for('index'))
+    if allowed_file(upload.filename):
+        filename = secure_filename(upload.filename)
+        job = IngestJob(getattr(session, 'sid', None), f"{filename}", url_for('index'),
+                        bytes_total=request.content_length, stream=upload)
+        start_ingest_job(job, _run_upload_ingest, upload, filename)
+        # The body can only be read while this request is open; the rest of
+        # the load continues after the response.
+        while not (upload.done.is_set() or job.done.is_set()):
+            upload.done.wait(0.1)
+        return ingest_job_response(job)
     else:
         flash('Invalid file type.', 'error')
         return redirect(url_for('index'))
@@ -1442,9 +4412,9 @@ def database_form():
 
 @app.route('/database_query', methods=['POST'])
 @login_required
+@dataset_mutation
 def database_query():
-    """Connects to DB, loads data into session."""
-    # (Similar DB logic as before, but use load_data_into_session)
+    """Starts a background job that runs the query and loads the result."""
     db_type = request.form.get('db_type')
     db_host = request.form.get('db_host')
     db_port = request.form.get('db_port')
@@ -1458,65 +4428,165 @@ def database_query():
         return redirect(url_for('database_form'))
 
     connection_string = None
-    engine = None
     source_info = f"Database: {db_type}"
-    df = None
 
-    try:
-        # ... (Connection string logic same as before) ...
-        if db_type == 'sqlite':
-            connection_string = f"sqlite:///{db_name}"
-            source_info = f"SQLite: {db_name}"
-        elif db_type == 'postgresql':
-            connection_string = f"postgresql+psycopg2://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
-            source_info = f"PostgreSQL: {db_user}@{db_host}:{db_port}/{db_name}"
-        elif db_type == 'mysql':
-             connection_string = f"mysql+mysqlconnector://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
-             source_info = f"MySQL: {db_user}@{db_host}:{db_port}/{db_name}"
-        else: # Should have validation on form too
-             flash('Unsupported database type.', 'error')
-             return redirect(url_for('database_form'))
+    if db_type == 'sqlite':
+        connection_string = f"sqlite:///{db_name}"
+        source_info = f"SQLite: {db_name}"
+    elif db_type == 'postgresql':
+        connection_string = f"postgresql+psycopg2://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
+        source_info = f"PostgreSQL: {db_user}@{db_host}:{db_port}/{db_name}"
+    elif db_type == 'mysql':
+         connection_string = f"mysql+mysqlconnector://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
+         source_info = f"MySQL: {db_user}@{db_host}:{db_port}/{db_name}"
+    else: # Should have validation on form too
+         flash('Unsupported database type.', 'error')
+         return redirect(url_for('database_form'))
 
-        engine = create_engine(connection_string)
-        with engine.connect() as connection:
-            df = pd.read_sql(text(query), connection)
-        flash('Query successful.', 'success')
+    # Connecting and running the query happen on the job thread
+    job = IngestJob(getattr(session, 'sid', None), source_info + f" (Query: {query[:50]}...)", url_for('database_form'))
+    start_ingest_job(job, _run_database_ingest, connection_string, query)
+    return ingest_job_response(job)
 
-    except ImportError as e:
-         flash(f"Database driver error: {e}. Make sure the required driver is installed.", "error")
-         return redirect(url_for('database_form'))
-    except exc.SQLAlchemyError as e:
-        flash(f"Database connection or query error: {e}", "error")
-        return redirect(url_for('database_form'))
-    except Exception as e:
-        flash(f"An unexpected error occurred: {str(e)}", "error")
-        return redirect(url_for('database_form'))
-    finally:
-        if engine:
-            engine.dispose()
 
-    return load_data_into_session(df, source_info + f" (Query: {query[:50]}...)")
+@app.route('/ingest/<job_id>')
+@login_required
+def ingest_progress(job_id):
+    """Progress page shown while a dataset loads; opens /clean when done."""
+    job = get_ingest_job(job_id)
+    if job is None:
+        flash('That data load is no longer available.', 'warning')
+        return redirect(url_for('index'))
+    return render_template('ingest_progress.html', job=job.progress(), source_info=job.source_info)
+
+@app.route('/ingest_jobs/<job_id>', methods=['GET'])
+@login_required
+def ingest_job_status(job_id):
+    """
+    Reports bytes read, rows parsed and ETA of a load job. The first call
+    after it finished makes the new dataset current (or reports the error)
+    and returns where to go next. Polls only take the session's dataset lock
+    for that claim, so they never wait behind a running cleaning step.
+    """
+    job = get_ingest_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired load job.'}), 404
+    payload = job.progress()
+    if job.status == 'done':
+        if not job.claimed:
+            with get_dataset_lock():
+                if not job.claimed: # Another poll may have claimed it while this one waited
+                    job.claimed = True
+                    load_store_into_session(job.store_id, job.source_info)
+                    for category, message in job.messages:
+                        flash(message, category)
+        payload['redirect'] = url_for('clean_data_interface')
+    elif job.status == 'selecting':
+        payload['redirect'] = url_for('ingest_archive_files' if 'members' in job.staged else 'ingest_columns', job_id=job.id)
+    elif job.status == 'failed':
+        if not job.claimed:
+            with get_dataset_lock():
+                if not job.claimed:
+                    job.claimed = True
+                    flash(job.error, 'error')
+        payload['redirect'] = job.failure_url
+    return jsonify(payload)
+
+@app.route('/ingest/<job_id>/columns', methods=['GET', 'POST'])
+@login_required
+@dataset_mutation
+def ingest_columns(job_id):
+    """Schema preview of an uploaded Parquet/Arrow file; loads the columns and row groups picked on it."""
+    job = get_ingest_job(job_id)
+    if job is None or job.status != 'selecting' or 'schema' not in job.staged:
+        flash('That data load is no longer available.', 'warning')
+        return redirect(url_for('index'))
+    schema = job.staged['schema']
+    if request.method == 'GET':
+        return render_template('ingest_columns.html', job=job.progress(), source_info=job.source_info,
+                               schema=schema, file_bytes=job.staged['source']['bytes'])
+
+    columns = sorted({i for i in request.form.getlist('columns', type=int) if 0 <= i < len(schema['columns'])})
+    row_groups = sorted({i for i in request.form.getlist('row_groups', type=int) if 0 <= i < len(schema['row_groups'])})
+    if not columns or (schema['row_groups'] and not row_groups):
+        flash('Pick at least one column and one row group to load.', 'error')
+        return redirect(url_for('ingest_columns', job_id=job.id))
+    job.restart('Reading selected columns')
+    start_ingest_job(job, _run_columnar_ingest, columns, row_groups)
+    return ingest_job_response(job)
+
+@app.route('/ingest/<job_id>/files', methods=['GET', 'POST'])
+@login_required
+@dataset_mutation
+def ingest_archive_files(job_id):
+    """Lists the data files of an uploaded zip archive or the sheets of a workbook; loads the picked ones separately or combined."""
+    job = get_ingest_job(job_id)
+    if job is None or job.status != 'selecting' or 'members' not in job.staged:
+        flash('That data load is no longer available.', 'warning')
+        return redirect(url_for('index'))
+    files = job.staged['members']
+    if request.method == 'GET':
+        return render_template('ingest_archive.html', job=job.progress(), source_info=job.source_info,
+                               files=files, file_bytes=job.staged['source']['bytes'], workbook=job.staged['ext'] == 'xlsx')
+
+    picked = sorted({i for i in request.form.getlist('files', type=int) if 0 <= i < len(files)})
+    combine, save_others = request.form.get('mode') == 'combine', request.form.get('save_others') == '1'
+    if not picked:
+        flash('Pick at least one file to load.', 'error')
+        return redirect(url_for('ingest_archive_files', job_id=job.id))
+    if len(picked) > 1 and not combine and not save_others:
+        # Writing the other picks to the saved files is only done when asked for
+        flash('Separate datasets open only the first pick. Pick one, stack them into one dataset, '
+              'or tick the box to save the others to your saved files.', 'error')
+        return redirect(url_for('ingest_archive_files', job_id=job.id))
+    target = _run_workbook_ingest if job.staged['ext'] == 'xlsx' else _run_archive_ingest
+    job.restart('Reading sheets' if job.staged['ext'] == 'xlsx' else 'Reading archive')
+    start_ingest_job(job, target, [files[i]['name'] for i in picked], combine, save_others)
+    return ingest_job_response(job)
 
 
 @app.route('/clean')
 @login_required
 def clean_data_interface():
     """Displays the main data cleaning interface."""
-    df = get_dataframe_from_session()
-    if df is None:
-        flash("No data loaded. Please upload a file or connect to a database.", "warning")
-        return redirect(url_for('index'))
+    session.pop('active_search_criteria', None) # A fresh page load starts unfiltered, like the empty search box
+    session.pop('active_sort', None)
 
     # --- REPLACE THE OLD LOGIC BLOCK WITH THIS ---
     is_premium_user = check_premium_status(get_current_user_from_session())
     # --- END OF REPLACEMENT ---
-
-    table_html, total_rows, total_columns = render_table_html(df)
-    columns = df.columns.tolist() if df is not None else []
     source_info = session.get('source_info', 'Unknown Source')
     saved_filename = session.get('saved_filename') 
 
-    return render_template(
+    # The page only changes with the dataset version, the history stacks and a few
+    # session values; flashed messages are one-off, so those responses are never tagged.
+    etag = None
+    state = load_dataset_state()
+    key = get_preview_cache_key('page', len(state['undo']), len(state['redo']), source_info, saved_filename,
+                                is_premium_user, json.dumps(session.get('user'), sort_keys=True, default=str), __version__)
+    if key is not None and not session.get('_flashes'):
+        etag = preview_etag(key)
+        if etag in request.if_none_match:
+            return with_etag(app.response_class(), etag)
+
+    df = load_grid_frame()
+    large = get_large_dataset() if df is None else None
+    if df is None and large is None:
+        flash("No data loaded. Please upload a file or connect to a database.", "warning")
+        return redirect(url_for('index'))
+
+    # The first page is rendered server-side; the grid pages in the rest from /grid as the user scrolls
+    if large is not None: # Only the first page of a large version is read
+        table_html, _, total_columns = render_table_html(read_dataset_window(*large, 0, app.config['GRID_PAGE_SIZE']),
+                                                         max_rows=app.config['GRID_PAGE_SIZE'])
+        total_rows = large[1]['shape'][0]
+        grid_meta = get_large_grid_page(*large, include_rows=False)
+    else:
+        table_html, total_rows, total_columns = render_cached_table_html(df, max_rows=app.config['GRID_PAGE_SIZE'])
+        grid_meta = get_grid_page(df, include_rows=False)
+    columns = grid_column_names(df)
+
+    response = make_response(render_template(
         'clean_data.html',
         table_html=table_html,
         columns=columns,
@@ -1525,8 +4595,11 @@ def clean_data_interface():
         saved_filename=saved_filename,
         total_rows=total_rows,
         total_columns=total_columns,
+        dataset_version=get_current_dataset_version(),
+        grid_meta=grid_meta,
         is_premium_user=is_premium_user
-    )
+    ))
+    return with_etag(response, etag) if etag else response
 
 
 @app.route('/get_valid_columns_for_formula', methods=['GET'])
@@ -1623,6 +4696,9 @@ def apply_formula_route():
     if series_slice.empty and formula not in ['COUNT', 'COUNTUNIQUE', 'COUNTEMPTY', 'COUNTNONEMPTY', 'COUNT_TRUE', 'COUNT_FALSE']:
         return jsonify({'result': 'N/A (empty slice)'})
 
+    if pd.api.types.is_integer_dtype(series_slice.dtype):
+        series_slice = series_slice.astype(np.int64) # Loaded columns may be narrowed; aggregate at full width
+
     result = None
     try:
         is_num_col = pd.api.types.is_numeric_dtype(series_slice) and not pd.api.types.is_bool_dtype(series_slice)
@@ -1774,32 +4850,785 @@ def apply_formula_route():
         elif isinstance(result, (bool, np.bool_)): # Explicitly handle boolean results
             result_display = str(result)
         else:
-            result_display = str(result)
-        
-        if isinstance(result_display, str) and len(result_display) > 100 and formula == 'CONCAT_ROWS':
-            result_display = result_display[:100] + "..."
+            result_display = str(result)
+        
+        if isinstance(result_display, str) and len(result_display) > 100 and formula == 'CONCAT_ROWS':
+            result_display = result_display[:100] + "..."
+
+        return jsonify({'result': result_display})
+
+    except TypeError as te:
+        app.logger.warning(f"TypeError during formula '{formula}' on column '{column_name}' (slice type: {series_slice.dtype}): {te}", exc_info=True)
+        return jsonify({'error': f'Type error for {formula}. Check column type/slice. Error: {str(te)}'}), 400
+    except Exception as e_calc:
+        app.logger.error(f"Error applying formula '{formula}' on col '{column_name}': {e_calc}", exc_info=True)
+        return jsonify({'error': f'Calculation error: {str(e_calc)}'}), 500
+
+
+
+# --- AJAX Endpoints for Cleaning Operations ---
+
+class CleaningOperationError(Exception):
+    """Raised by cleaning functions for invalid parameters or failed steps."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+def validate_sort_params(df, columns_to_sort_by, ascending):
+    """Checks sort columns and order for the sort_values operation and the sorted grid view."""
+    if not columns_to_sort_by or not isinstance(columns_to_sort_by, list):
+         raise CleaningOperationError('Requires a list of columns to sort by.')
+    if not all(col in df.columns for col in columns_to_sort_by):
+         missing = [col for col in columns_to_sort_by if col not in df.columns]
+         raise CleaningOperationError(f'Columns not found: {missing}')
+
+    # Validate ascending parameter format if it's a list
+    if isinstance(ascending, list) and len(ascending) != len(columns_to_sort_by):
+        raise CleaningOperationError('If "ascending" is a list, its length must match the number of columns to sort by.')
+
+def _per_category(series, func):
+    """
+    Runs func, a function of an object Series, once over the categories of a
+    category column plus a trailing NaN for its missing values, instead of
+    once per row. Returns the results and the row codes indexing them (-1,
+    missing, picks the trailing NaN's result).
+    """
+    values = func(pd.Series(list(series.cat.categories) + [np.nan], dtype=object))
+    return np.asarray(values), series.cat.codes.to_numpy()
+
+def recode_categories(series, func):
+    """func applied to a category column's values, computed per category; the result stays a category column."""
+    values, codes = _per_category(series, func)
+    value_codes, uniques = pd.factorize(values) # Mapped categories may merge; NaN results become missing
+    return pd.Series(pd.Categorical.from_codes(value_codes[codes], uniques), index=series.index, name=series.name)
+
+def transform_text(series, func):
+    """
+    func(series.astype(str)) for a text column, func being a function of a
+    Series of str. Category columns are transformed per category and stay
+    category columns.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return recode_categories(series, lambda values: func(values.astype(str)))
+    return func(series.astype(str))
+
+def text_mask(series, func):
+    """func(series.astype(str)), a boolean Series, computed per category for category columns."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        values, codes = _per_category(series, lambda values: func(values.astype(str)))
+        return pd.Series(values.astype(bool)[codes], index=series.index)
+    return func(series.astype(str))
+
+def build_filter_mask(df, column, condition, value_str):
+    """
+    Boolean mask of the rows of df matching a filter_rows condition, plus the
+    value as shown in messages. The value is converted to the column's type.
+    """
+    valid_conditions = ['==', '!=', '>', '<', '>=', '<=', 'contains', 'startswith', 'endswith', 'isnull', 'notnull']
+    if condition not in valid_conditions:
+         raise CleaningOperationError(f'Invalid condition "{condition}". Valid conditions are: {valid_conditions}')
+
+    # Handle conditions that don't need a value
+    if condition in ['isnull', 'notnull']:
+        mask = df[column].isnull() if condition == 'isnull' else df[column].notnull()
+        value_display = "" # No value to display
+    else:
+        # Conditions requiring a value
+        if value_str is None: # Check if value was provided
+             raise CleaningOperationError(f'Value parameter is required for condition "{condition}".')
+
+        value_display = f"'{value_str}'" # For message
+        target_value = value_str # Default to string
+
+        # Attempt type conversion based on column dtype for comparison
+        series = df[column]
+        col_dtype = series.dtype
+        if isinstance(col_dtype, pd.CategoricalDtype):
+            col_dtype = col_dtype.categories.dtype # Compare with the type of the values
+            if not series.cat.ordered:
+                series = series.astype(object) # Unordered categories only support == and !=
+        try:
+             if pd.api.types.is_numeric_dtype(col_dtype):
+                  target_value = pd.to_numeric(value_str)
+                  value_display = str(target_value)
+             elif pd.api.types.is_datetime64_any_dtype(col_dtype):
+                  target_value = pd.to_datetime(value_str)
+                  value_display = str(target_value)
+             elif pd.api.types.is_bool_dtype(col_dtype):
+                   lowered_val = value_str.lower()
+                   if lowered_val in ['true', '1', 'yes']: target_value = True
+                   elif lowered_val in ['false', '0', 'no']: target_value = False
+                   else: raise ValueError("Invalid boolean value")
+                   value_display = str(target_value)
+             # Else: Keep as string (already assigned) for string operations
+        except (ValueError, TypeError) as conv_err:
+             # If conversion fails for numeric/datetime/bool, return error as comparison likely invalid
+              raise CleaningOperationError(f'Could not convert value "{value_str}" to match type of column "{column}". Error: {conv_err}')
+
+        # Build mask based on condition
+        if condition == '==': mask = (df[column] == target_value)
+        elif condition == '!=': mask = (df[column] != target_value)
+        elif condition == '>': mask = (series > target_value)
+        elif condition == '<': mask = (series < target_value)
+        elif condition == '>=': mask = (series >= target_value)
+        elif condition == '<=': mask = (series <= target_value)
+        # String conditions (apply only if target_value is string, maybe check col type too?)
+        # Missing cells never match, though their text ('nan', 'None') would
+        elif condition == 'contains':
+            if not isinstance(target_value, str): raise CleaningOperationError('Contains condition requires a string value.')
+            mask = text_mask(df[column], lambda values: values.str.contains(target_value, na=False)) & df[column].notna()
+        elif condition == 'startswith':
+            if not isinstance(target_value, str): raise CleaningOperationError('Startswith condition requires a string value.')
+            mask = text_mask(df[column], lambda values: values.str.startswith(target_value, na=False)) & df[column].notna()
+        elif condition == 'endswith':
+            if not isinstance(target_value, str): raise CleaningOperationError('Endswith condition requires a string value.')
+            mask = text_mask(df[column], lambda values: values.str.endswith(target_value, na=False)) & df[column].notna()
+
+    return mask, value_display
+
+def apply_clean_operation(df, operation, params):
+    """
+    Applies one /clean_operation step to df and returns (new_df, action_msg).
+    Kept free of request/session state so history can replay it.
+    """
+    original_shape = df.shape
+    action_msg = "" # To store the success message
+
+    # --- Apply the requested operation ---
+    if operation == 'remove_duplicates':
+        subset = params.get('subset') # Optional: list of columns, None means all
+        # Ensure subset columns exist if provided (basic check)
+        if subset and not all(col in df.columns for col in subset):
+             raise CleaningOperationError('One or more subset columns not found.')
+        df_new = df.drop_duplicates(subset=subset, keep='first')
+        removed_count = original_shape[0] - df_new.shape[0]
+        action_msg = f"Removed {removed_count} duplicate row(s)."
+        df = df_new # Assign the result back to df
+
+    elif operation == 'remove_missing':
+        how = params.get('how', 'any') # 'any' or 'all'
+        subset = params.get('subset') # Optional: list of columns
+        if how not in ['any', 'all']:
+             raise CleaningOperationError('Invalid value for "how". Must be "any" or "all".')
+        if subset and not all(col in df.columns for col in subset):
+             raise CleaningOperationError('One or more subset columns not found.')
+        df_new = df.dropna(axis=0, how=how, subset=subset) # axis=0 for rows
+        removed_count = original_shape[0] - df_new.shape[0]
+        action_msg = f"Removed {removed_count} row(s) containing missing values."
+        df = df_new
+
+    elif operation == 'fill_missing':
+        # Get parameters: method, column (optional), value (optional)
+        method = params.get('method', 'value') # 'value', 'mean', 'median', 'mode', 'ffill', 'bfill'
+        column = params.get('column') # Optional: specific column name
+        fill_value_str = params.get('value') # Value provided by user (only used if method='value')
+
+        allowed_methods = ['value', 'mean', 'median', 'mode', 'ffill', 'bfill']
+        if method not in allowed_methods:
+             raise CleaningOperationError(f'Invalid fill method "{method}". Allowed methods: {allowed_methods}')
+
+        # --- Method: Fill with a specific VALUE ---
+        if method == 'value':
+            if fill_value_str is None: # Value is required for this method
+                raise CleaningOperationError('A fill value must be provided when method is "value".')
+
+            if column: # Fill specific column with value
+                if column not in df.columns:
+                    raise CleaningOperationError(f'Column "{column}" not found')
+
+                # Attempt type conversion of fill_value_str to match column type
+                fill_value = fill_value_str # Default to string
+                warning_msg = ""
+                try:
+                    col_dtype = df[column].dtype
+                    if pd.api.types.is_numeric_dtype(col_dtype):
+                        fill_value = pd.to_numeric(fill_value_str) if fill_value_str != '' else pd.NA
+                    elif pd.api.types.is_datetime64_any_dtype(col_dtype):
+                        fill_value = pd.to_datetime(fill_value_str) if fill_value_str != '' else pd.NaT
+                    elif pd.api.types.is_bool_dtype(col_dtype):
+                          lowered_val = fill_value_str.lower()
+                          if lowered_val in ['true', '1', 'yes']: fill_value = True
+                          elif lowered_val in ['false', '0', 'no']: fill_value = False
+                          elif lowered_val == '': fill_value = pd.NA
+                          else: raise ValueError("Invalid boolean value")
+                    # else: keep as string
+                except (ValueError, TypeError) as conv_err:
+                     warning_msg = f" (Warning: Could not convert '{fill_value_str}' to column type, used as string)."
+                     fill_value = fill_value_str # Fallback to string
+
+                if isinstance(df[column].dtype, pd.CategoricalDtype) and not pd.isna(fill_value) and \
+                   fill_value not in df[column].cat.categories:
+                    df[column] = df[column].cat.add_categories([fill_value])
+                df[column] = df[column].fillna(fill_value)
+                action_msg = f"Filled missing values in column '{column}' with value '{fill_value_str}'." + warning_msg
+
+            else: # Fill ALL columns with the same value
+                # Simple approach: fill all with the same string value.
+                # A more complex approach could try type conversion per column, but adds complexity.
+                for position in np.flatnonzero(df.isna().any().to_numpy()):
+                    series = df.iloc[:, position]
+                    if isinstance(series.dtype, pd.CategoricalDtype):
+                        if fill_value_str not in series.cat.categories:
+                            df.isetitem(position, series.cat.add_categories([fill_value_str]))
+                    elif not pd.api.types.is_string_dtype(series.dtype):
+                        # Numeric and datetime columns cannot hold the text; make them object up front
+                        df.isetitem(position, series.astype(object))
+                df.fillna(fill_value_str, inplace=True)
+                action_msg = f"Filled missing values in all columns with value '{fill_value_str}'."
+
+        # --- Method: Fill with Mean, Median, or Mode ---
+        elif method in ['mean', 'median', 'mode']:
+            if column: # Fill specific column with statistic
+                if column not in df.columns:
+                    raise CleaningOperationError(f'Column "{column}" not found')
+                if not pd.api.types.is_numeric_dtype(df[column]):
+                     # Mode could potentially apply to non-numeric, but let's restrict for simplicity now
+                     raise CleaningOperationError(f'Method "{method}" can only be applied to numeric columns.')
+                if df[column].isnull().all(): # Cannot calculate statistic if all null
+                     action_msg = f"Skipped: Cannot calculate {method} for column '{column}' as all values are missing."
+                else:
+                    fill_stat = None
+                    if method == 'mean':
+                        fill_stat = df[column].mean()
+                    elif method == 'median':
+                        fill_stat = df[column].median()
+                    elif method == 'mode':
+                        mode_result = df[column].mode()
+                        if not mode_result.empty:
+                            fill_stat = mode_result[0] # Take the first mode if multiple exist
+                        else: # Should not happen if not all null, but safety check
+                             action_msg = f"Skipped: Could not determine mode for column '{column}'."
+                             fill_stat = None # Ensure fill doesn't happen
+
+                    if fill_stat is not None:
+                         df[column] = df[column].fillna(fill_stat)
+                         action_msg = f"Filled missing values in numeric column '{column}' with its {method} ({fill_stat:.4g})." # Format stat
+
+            else: # Fill ALL applicable (numeric) columns with their respective statistic
+                filled_cols = []
+                skipped_cols = []
+                for col_loop in df.columns:
+                    if pd.api.types.is_numeric_dtype(df[col_loop]) and not df[col_loop].isnull().all():
+                        fill_stat = None
+                        try:
+                            if method == 'mean': fill_stat = df[col_loop].mean()
+                            elif method == 'median': fill_stat = df[col_loop].median()
+                            elif method == 'mode':
+                                 mode_result = df[col_loop].mode()
+                                 if not mode_result.empty: fill_stat = mode_result[0]
+                        except Exception as e:
+                             app.logger.warning(f"Could not calculate {method} for {col_loop}: {e}")
+
+                        if fill_stat is not None:
+                             df[col_loop] = df[col_loop].fillna(fill_stat)
+                             filled_cols.append(f"{col_loop} ({fill_stat:.4g})")
+                        else:
+                             skipped_cols.append(col_loop + " (calc error)")
+                    else:
+                        skipped_cols.append(col_loop + " (not numeric/all null)")
+
+                if filled_cols:
+                     action_msg = f"Filled missing values in numeric columns with their respective {method}: {'; '.join(filled_cols)}."
+                     if skipped_cols:
+                         action_msg += f" Skipped: {', '.join(skipped_cols)}."
+                else:
+                     action_msg = f"No numeric columns found/filled using {method} method."
+
+        # --- Method: Forward Fill (ffill) or Backward Fill (bfill) ---
+        elif method in ['ffill', 'bfill']:
+            if column: # Fill specific column
+                if column not in df.columns:
+                    raise CleaningOperationError(f'Column "{column}" not found')
+                df[column] = df[column].ffill() if method == 'ffill' else df[column].bfill()
+                action_msg = f"Applied {method} (propagate last/next valid value) to column '{column}'."
+            else: # Fill ALL columns
+                df.fillna(method=method, inplace=True) # Fills across entire DataFrame
+                action_msg = f"Applied {method} (propagate last/next valid value) across all columns."
+        else:
+             # This case should be caught by the initial method validation
+             raise CleaningOperationError('Unknown fill method encountered.', 500)
+
+    elif operation == 'remove_spaces':
+         column = params.get('column')
+         if not column:
+              raise CleaningOperationError('Column parameter is required for removing spaces.')
+         if column not in df.columns:
+              raise CleaningOperationError(f'Column "{column}" not found')
+
+         # Only apply to object/string columns
+         if pd.api.types.is_object_dtype(df[column]) or pd.api.types.is_string_dtype(df[column]):
+             # Ensure column is treated as string, then strip
+             df[column] = transform_text(df[column], lambda values: values.str.strip())
+             action_msg = f"Removed leading/trailing spaces from column '{column}'."
+         else:
+              action_msg = f"Operation skipped: Remove spaces only applicable to text columns (column '{column}' is not text)."
+              # Don't return error, just inform user maybe? Or return 400?
+              # raise CleaningOperationError(f'Remove spaces only applicable to text columns (column "{column}" is not text)')
+
+
+    elif operation == 'fix_datetime':
+         column = params.get('column')
+         date_format = params.get('format') # Optional format string (e.g., '%Y-%m-%d')
+         if not column:
+              raise CleaningOperationError('Column parameter is required for fixing dates.')
+         if column not in df.columns:
+              raise CleaningOperationError(f'Column "{column}" not found')
+
+         # errors='coerce' will turn unparseable dates into NaT (Not a Time/Null)
+         original_nulls = df[column].isnull().sum()
+         df[column] = pd.to_datetime(df[column], format=date_format, errors='coerce')
+         new_nulls = df[column].isnull().sum()
+         coerced_count = new_nulls - original_nulls
+
+         action_msg = f"Converted column '{column}' to datetime type."
+         if coerced_count > 0:
+             action_msg += f" {coerced_count} value(s) could not be parsed and were set to null."
+    
+
+    # === Check IDs ===
+    elif operation == 'check_id_uniqueness':
+        df_modified = False # This operation doesn't change the DataFrame
+        column = params.get('column')
+        if not column:
+             raise CleaningOperationError('Column parameter is required.')
+        if column not in df.columns:
+             raise CleaningOperationError(f'Column "{column}" not found')
+
+        if df[column].is_unique:
+            action_msg = f"Column '{column}' contains unique values."
+        else:
+            duplicates = df[df[column].duplicated()][column].unique()
+            dup_count = df[column].duplicated().sum()
+            preview = duplicates[:5].tolist() # Show first 5 duplicates
+            action_msg = f"Column '{column}' contains {dup_count} duplicate value(s). Examples: {preview}"
+
+    elif operation == 'check_id_format':
+        df_modified = False # This operation doesn't change the DataFrame
+        column = params.get('column')
+        pattern = params.get('pattern')
+        if not column:
+             raise CleaningOperationError('Column parameter is required.')
+        if column not in df.columns:
+             raise CleaningOperationError(f'Column "{column}" not found')
+        if not pattern:
+             raise CleaningOperationError('Pattern parameter is required for format check.')
+
+        try:
+            # Attempt to compile regex to check validity early
+            re.compile(pattern)
+            # Use na=False to treat NaN as non-matching
+            matches = text_mask(df[column], lambda values: values.str.match(f'^{pattern}$', na=False)) # Anchor pattern
+            non_matching_count = (~matches).sum()
+            if non_matching_count == 0:
+                action_msg = f"All values in column '{column}' match the pattern."
+            else:
+                action_msg = f"Checked format for column '{column}'. {non_matching_count} value(s) did not match the pattern '{pattern}'."
+        except re.error as e:
+             raise CleaningOperationError(f'Invalid regex pattern provided: {e}')
+        except Exception as e:
+             raise CleaningOperationError(f'Error during format check: {e}', 500)
+
+
+    # === Correcting Numerical Outliers (Updated Section) ===
+    elif operation == 'remove_outliers_iqr':
+        column = params.get('column')
+        factor = params.get('factor', 1.5)
+        # --- Validation ---
+        if not column: raise CleaningOperationError('Column parameter is required.')
+        if column not in df.columns: raise CleaningOperationError(f'Column "{column}" not found.')
+        if not pd.api.types.is_numeric_dtype(df[column]): raise CleaningOperationError(f'Column "{column}" must be numeric for IQR.')
+        try:
+             factor = float(factor)
+             if factor <= 0: raise ValueError("Factor must be positive.")
+        except (ValueError, TypeError): raise CleaningOperationError('Invalid IQR factor.')
+
+        # --- Calculation & Removal ---
+        col_data_nonan = df[column].dropna()
+        if len(col_data_nonan) < 4: # Not enough data for meaningful IQR
+             action_msg = f"Skipped IQR outlier removal for '{column}' (too few non-NA values)."
+        else:
+            Q1 = col_data_nonan.quantile(0.25)
+            Q3 = col_data_nonan.quantile(0.75)
+            IQR = Q3 - Q1
+            if IQR >= 0: # Allow IQR to be 0
+                lower_bound = Q1 - factor * IQR
+                upper_bound = Q3 + factor * IQR
+                # Create a boolean mask for rows to keep (non-outliers)
+                # Important: Apply mask to original df's index to handle NaNs correctly if any
+                mask_to_keep = (df[column] >= lower_bound) & (df[column] <= upper_bound)
+                mask_to_keep = mask_to_keep | df[column].isnull() # Keep rows with NaNs in this column
+                
+                df_new = df[mask_to_keep].reset_index(drop=True) # This removes rows globally
+                removed_count = original_shape[0] - df_new.shape[0]
+                action_msg = f"Removed {removed_count} row(s) with outliers from column '{column}' using IQR (factor={factor}). Bounds: [{lower_bound:.2f}, {upper_bound:.2f}]."
+                df = df_new # Update the main DataFrame
+            else:
+                action_msg = f"Skipped IQR outlier removal for '{column}' (Invalid IQR calculation)."
+
+
+    elif operation == 'clip_outliers_iqr':
+        column = params.get('column')
+        factor = params.get('factor', 1.5)
+        # --- Validation (same as remove_outliers_iqr) ---
+        if not column: raise CleaningOperationError('Column required.')
+        if column not in df.columns: raise CleaningOperationError(f'Column "{column}" not found.')
+        if not pd.api.types.is_numeric_dtype(df[column]): raise CleaningOperationError(f'Column "{column}" must be numeric.')
+        try: factor = float(factor); assert factor > 0
+        except: raise CleaningOperationError('Invalid IQR factor.')
+
+        # --- Calculation & Clipping ---
+        col_data_nonan = df[column].dropna()
+        if len(col_data_nonan) < 4:
+            action_msg = f"Skipped IQR clipping for '{column}' (too few non-NA values)."
+        else:
+            Q1 = col_data_nonan.quantile(0.25)
+            Q3 = col_data_nonan.quantile(0.75)
+            IQR = Q3 - Q1
+            if IQR >= 0:
+                lower_bound = Q1 - factor * IQR
+                upper_bound = Q3 + factor * IQR
+                original_values = df[column].copy() # To count how many were clipped
+                # Clip operates on the Series and returns a new one
+                df[column] = df[column].clip(lower=lower_bound, upper=upper_bound)
+                df_modified_in_place = True # Mark that df was modified directly
+                clipped_count = (original_values != df[column]).sum() # Count where values changed
+                action_msg = f"Clipped {clipped_count} outlier(s) in column '{column}' using IQR (factor={factor}). Bounds: [{lower_bound:.2f}, {upper_bound:.2f}]."
+            else:
+                 action_msg = f"Skipped IQR clipping for '{column}' (Invalid IQR calculation)."
+
+    # ***** NEW: Z-score Based Outlier Handling *****
+    elif operation == 'remove_outliers_zscore':
+        column = params.get('column')
+        threshold = params.get('threshold', 3.0) # Default Z-score threshold
+        # --- Validation ---
+        if not column: raise CleaningOperationError('Column parameter is required.')
+        if column not in df.columns: raise CleaningOperationError(f'Column "{column}" not found.')
+        if not pd.api.types.is_numeric_dtype(df[column]): raise CleaningOperationError(f'Column "{column}" must be numeric for Z-score.')
+        try:
+             threshold = float(threshold)
+             if threshold <= 0: raise ValueError("Threshold must be positive.")
+        except (ValueError, TypeError): raise CleaningOperationError('Invalid Z-score threshold.')
+
+        # --- Calculation & Removal ---
+        col_data_nonan = df[column].dropna()
+        if len(col_data_nonan) < 2 or col_data_nonan.std(ddof=0) < 1e-9 : # Need std > 0 and at least 2 points
+            action_msg = f"Skipped Z-score outlier removal for '{column}' (std is zero or too few non-NA values)."
+        else:
+            # Calculate Z-scores only for non-NaN values
+            z_scores_nonan = np.abs((col_data_nonan - col_data_nonan.mean()) / col_data_nonan.std(ddof=0))
+            # Create a boolean mask for rows to keep (non-outliers based on Z-score)
+            # Start with all False, then mark non-outliers as True
+            mask_to_keep = pd.Series(False, index=df.index)
+            mask_to_keep.loc[col_data_nonan[z_scores_nonan <= threshold].index] = True
+            mask_to_keep = mask_to_keep | df[column].isnull() # Also keep rows that were originally NaN
+
+            df_new = df[mask_to_keep].reset_index(drop=True)
+            removed_count = original_shape[0] - df_new.shape[0]
+            action_msg = f"Removed {removed_count} row(s) with Z-score outliers from column '{column}' (threshold={threshold})."
+            df = df_new # Update the main DataFrame
+
+    elif operation == 'clip_outliers_zscore':
+        column = params.get('column')
+        threshold = params.get('threshold', 3.0)
+        # --- Validation (same as remove_outliers_zscore) ---
+        if not column: raise CleaningOperationError('Column required.')
+        if column not in df.columns: raise CleaningOperationError(f'Column "{column}" not found.')
+        if not pd.api.types.is_numeric_dtype(df[column]): raise CleaningOperationError(f'Column "{column}" must be numeric.')
+        try: threshold = float(threshold); assert threshold > 0
+        except: raise CleaningOperationError('Invalid Z-score threshold.')
+
+        # --- Calculation & Clipping ---
+        col_data_nonan = df[column].dropna()
+        if len(col_data_nonan) < 2 or col_data_nonan.std(ddof=0) < 1e-9:
+            action_msg = f"Skipped Z-score clipping for '{column}' (std is zero or too few non-NA values)."
+        else:
+            mean_val = col_data_nonan.mean() # Use non-NA mean for bounds
+            std_val = col_data_nonan.std(ddof=0)  # Use non-NA std for bounds
+            
+            lower_bound_z = mean_val - threshold * std_val
+            upper_bound_z = mean_val + threshold * std_val
+
+            original_values = df[column].copy()
+            df[column] = df[column].clip(lower=lower_bound_z, upper=upper_bound_z)
+            df_modified_in_place = True
+            clipped_count = (original_values != df[column]).sum()
+            action_msg = f"Clipped {clipped_count} outlier(s) in column '{column}' using Z-score (threshold={threshold}). Bounds: [{lower_bound_z:.2f}, {upper_bound_z:.2f}]."
+
+    # === Define Valid Output (Filtering) ===
+    elif operation == 'filter_rows':
+        column = params.get('column')
+        condition = params.get('condition')
+        value_str = params.get('value') # Value might not be needed for isnull/notnull
+        filter_action = params.get('action', 'keep') # 'keep' or 'remove'
+
+        if not column: raise CleaningOperationError('Column parameter is required.')
+        if column not in df.columns: raise CleaningOperationError(f'Column "{column}" not found')
+        if not condition: raise CleaningOperationError('Condition parameter is required.')
+        if filter_action not in ['keep', 'remove']: raise CleaningOperationError('Invalid action. Must be "keep" or "remove".')
+
+        mask, value_display = build_filter_mask(df, column, condition, value_str)
+
+        # Apply filter
+        if filter_action == 'keep':
+            df_new = df[mask].reset_index(drop=True)
+            kept_removed_count = df_new.shape[0]
+            action_word = "Kept"
+        else: # remove
+            df_new = df[~mask].reset_index(drop=True)
+            kept_removed_count = original_shape[0] - df_new.shape[0]
+            action_word = "Removed"
+
+        action_msg = f"{action_word} {kept_removed_count} row(s) where '{column}' {condition} {value_display}."
+        df = df_new
+
+
+    # === Transforming and Rearranging ===
+    elif operation == 'split_column':
+        column = params.get('column')
+        delimiter = params.get('delimiter')
+        new_column_names_str = params.get('new_column_names') # Expect comma-separated string from UI
+
+        if not column: raise CleaningOperationError('Column parameter is required.')
+        if column not in df.columns: raise CleaningOperationError(f'Column "{column}" not found')
+        if not delimiter: raise CleaningOperationError('Delimiter parameter is required.')
+        if not (pd.api.types.is_object_dtype(df[column]) or pd.api.types.is_string_dtype(df[column])):
+             raise CleaningOperationError('Split column operation only applicable to text columns.')
 
-        return jsonify({'result': result_display})
+        try:
+            # Perform the split
+            split_data = df[column].astype(str).str.split(delimiter, expand=True)
+            num_new_cols = split_data.shape[1]
+
+            # Determine new column names
+            if new_column_names_str:
+                new_names = [name.strip() for name in new_column_names_str.split(',') if name.strip()]
+                if len(new_names) != num_new_cols:
+                    raise CleaningOperationError(f'Provided {len(new_names)} new column names, but split resulted in {num_new_cols} columns.')
+            else:
+                # Generate default names
+                new_names = [f"{column}_split_{i+1}" for i in range(num_new_cols)]
+
+            # Check if new names conflict with existing ones (excluding original column)
+            existing_cols = set(df.columns) - {column}
+            conflicts = set(new_names) & existing_cols
+            if conflicts:
+                 raise CleaningOperationError(f'New column names conflict with existing columns: {list(conflicts)}')
+
+            # Add new columns to the DataFrame
+            df[new_names] = split_data
+            action_msg = f"Split column '{column}' into {num_new_cols} new column(s): {', '.join(new_names)}."
+            # Optional: Add parameter to drop original column `df = df.drop(columns=[column])`
+        except CleaningOperationError:
+            raise
+        except Exception as e:
+            raise CleaningOperationError(f'Error during split operation: {e}', 500)
+
+    elif operation == 'combine_columns':
+        columns_to_combine = params.get('columns_to_combine') # Expect list
+        new_column_name = params.get('new_column_name')
+        separator = params.get('separator', '') # Default to empty string
+
+        if not columns_to_combine or not isinstance(columns_to_combine, list) or len(columns_to_combine) < 2:
+             raise CleaningOperationError('Requires a list of at least two columns to combine.')
+        if not new_column_name:
+             raise CleaningOperationError('New column name parameter is required.')
+        if not all(col in df.columns for col in columns_to_combine):
+             missing = [col for col in columns_to_combine if col not in df.columns]
+             raise CleaningOperationError(f'Columns not found: {missing}')
+        if new_column_name in df.columns:
+             # Optional: Allow overwrite? For now, prevent it.
+             raise CleaningOperationError(f'New column name "{new_column_name}" already exists.')
 
-    except TypeError as te:
-        app.logger.warning(f"TypeError during formula '{formula}' on column '{column_name}' (slice type: {series_slice.dtype}): {te}", exc_info=True)
-        return jsonify({'error': f'Type error for {formula}. Check column type/slice. Error: {str(te)}'}), 400
-    except Exception as e_calc:
-        app.logger.error(f"Error applying formula '{formula}' on col '{column_name}': {e_calc}", exc_info=True)
-        return jsonify({'error': f'Calculation error: {str(e_calc)}'}), 500
+        try:
+            # Convert all columns to string and join
+            df[new_column_name] = df[columns_to_combine].astype(str).agg(separator.join, axis=1)
+            action_msg = f"Combined columns {columns_to_combine} into '{new_column_name}' using separator '{separator}'."
+            # Optional: Add parameter to drop original columns `df = df.drop(columns=columns_to_combine)`
+        except Exception as e:
+            raise CleaningOperationError(f'Error during combine operation: {e}', 500)
 
+    # === Other Common Operations ===
 
+    elif operation == 'change_dtype':
+        column = params.get('column')
+        target_type = params.get('target_type')
+        if not column: raise CleaningOperationError('Column parameter is required.')
+        if column not in df.columns: raise CleaningOperationError(f'Column "{column}" not found')
+        if not target_type: raise CleaningOperationError('Target type parameter is required.')
+
+        original_nulls = df[column].isnull().sum()
+        coerced_count = 0
+        try:
+            if target_type in ['int', 'integer']:
+                # Use Int64 for nullable integers
+                df[column] = pd.to_numeric(df[column], errors='coerce').astype('Int64')
+            elif target_type in ['float', 'double', 'number']:
+                df[column] = pd.to_numeric(df[column], errors='coerce').astype(float) # Standard float
+            elif target_type in ['str', 'string', 'text', 'object']:
+                df[column] = df[column].astype(str)
+            elif target_type in ['datetime', 'date']:
+                df[column] = pd.to_datetime(df[column], errors='coerce')
+            elif target_type in ['bool', 'boolean']:
+                 # pd.BooleanDtype() allows NA
+                 df[column] = df[column].astype(pd.BooleanDtype()) # This handles 'True','False','true','false',1,0, NAs well
+            elif target_type == 'category':
+                df[column] = df[column].astype('category')
+            else:
+                raise CleaningOperationError(f'Unsupported target type: {target_type}')
+
+            new_nulls = df[column].isnull().sum()
+            coerced_count = new_nulls - original_nulls
+            action_msg = f"Converted column '{column}' to type '{target_type}'."
+            if coerced_count > 0:
+                 action_msg += f" {coerced_count} value(s) set to null due to conversion errors."
+
+        except CleaningOperationError:
+            raise
+        except Exception as e:
+            # Revert if conversion fails? Less critical here as errors='coerce' handles most cases
+            raise CleaningOperationError(f'Error converting column "{column}" to {target_type}: {e}', 500)
+
+
+    elif operation == 'rename_column':
+        old_name = params.get('old_name')
+        new_name = params.get('new_name')
+        if not old_name: raise CleaningOperationError('Old column name parameter is required.')
+        if old_name not in df.columns: raise CleaningOperationError(f'Column "{old_name}" not found')
+        if not new_name: raise CleaningOperationError('New column name parameter is required.')
+        if new_name == old_name: return df, 'New name is the same as the old name. No change made.' # No change needed
+        if new_name in df.columns: raise CleaningOperationError(f'New column name "{new_name}" already exists.')
+
+        df.rename(columns={old_name: new_name}, inplace=True)
+        action_msg = f"Renamed column '{old_name}' to '{new_name}'."
+
+
+    elif operation == 'drop_columns':
+        columns_to_drop = params.get('columns_to_drop') # Expect list
+        if not columns_to_drop or not isinstance(columns_to_drop, list):
+             raise CleaningOperationError('Requires a list of columns to drop.')
+
+        actual_cols_to_drop = [col for col in columns_to_drop if col in df.columns]
+        if not actual_cols_to_drop:
+             raise CleaningOperationError('None of the specified columns found in the data.')
+
+        df = df.drop(columns=actual_cols_to_drop) # Assign back is safer than inplace
+        action_msg = f"Dropped columns: {', '.join(actual_cols_to_drop)}."
+        if len(actual_cols_to_drop) < len(columns_to_drop):
+             missing = [col for col in columns_to_drop if col not in actual_cols_to_drop]
+             action_msg += f" (Columns not found and ignored: {', '.join(missing)})"
+
+    elif operation == 'replace_text':
+         column = params.get('column')
+         text_to_find = params.get('text_to_find')
+         replace_with = params.get('replace_with', '') # Default to replace with empty string
+         use_regex = params.get('use_regex', False) # Default to literal replacement
+
+         if not column: raise CleaningOperationError('Column parameter is required.')
+         if column not in df.columns: raise CleaningOperationError(f'Column "{column}" not found')
+         if text_to_find is None: raise CleaningOperationError('Text to find parameter is required.') # Allow empty string
+         if not (pd.api.types.is_object_dtype(df[column]) or pd.api.types.is_string_dtype(df[column])):
+              raise CleaningOperationError('Replace text operation only applicable to text columns.')
+
+         try:
+             # Ensure string type for replacement
+             df[column] = transform_text(df[column], lambda values: values.str.replace(str(text_to_find), str(replace_with), regex=bool(use_regex)))
+             mode = "regex" if use_regex else "literal"
+             action_msg = f"Replaced text '{text_to_find}' with '{replace_with}' in column '{column}' (mode: {mode})."
+         except re.error as e:
+             if use_regex:
+                  raise CleaningOperationError(f'Invalid regex pattern provided: {e}')
+             else: # Should not happen in literal mode, but just in case
+                  raise CleaningOperationError(f'Error during text replacement: {e}', 500)
+         except Exception as e:
+              raise CleaningOperationError(f'Error during text replacement: {e}', 500)
+
+    elif operation == 'change_case':
+        column = params.get('column')
+        case_type = params.get('case_type') # 'lower', 'upper', 'title'
+        if not column: raise CleaningOperationError('Column parameter is required.')
+        if column not in df.columns: raise CleaningOperationError(f'Column "{column}" not found')
+        if not (pd.api.types.is_object_dtype(df[column]) or pd.api.types.is_string_dtype(df[column])):
+             raise CleaningOperationError('Change case operation only applicable to text columns.')
+        if case_type not in ['lower', 'upper', 'title']:
+             raise CleaningOperationError('Invalid case type. Must be "lower", "upper", or "title".')
+
+        if case_type == 'lower': df[column] = transform_text(df[column], lambda values: values.str.lower())
+        elif case_type == 'upper': df[column] = transform_text(df[column], lambda values: values.str.upper())
+        elif case_type == 'title': df[column] = transform_text(df[column], lambda values: values.str.title())
+        action_msg = f"Converted text in column '{column}' to {case_type} case."
+
+    elif operation == 'map_values':
+        column = params.get('column')
+        mapping_dict = params.get('mapping_dict') # Expect a dict/object
+        if not column: raise CleaningOperationError('Column parameter is required.')
+        if column not in df.columns: raise CleaningOperationError(f'Column "{column}" not found')
+        if not mapping_dict or not isinstance(mapping_dict, dict):
+             raise CleaningOperationError('Mapping dictionary parameter is required and must be an object/dictionary.')
+
+        try:
+             # Use replace which is generally more flexible than map for this purpose.
+             # Opting in to pandas 3 behaviour and inferring explicitly gives the same
+             # types as before without the downcasting FutureWarning.
+             def replace_values(values):
+                 with pd.option_context('future.no_silent_downcasting', True):
+                     return values.replace(mapping_dict).infer_objects(copy=False)
+             series = df[column]
+             if isinstance(series.dtype, pd.CategoricalDtype): # Mapped per category; merged values share one
+                 df[column] = recode_categories(series, replace_values)
+             else:
+                 df[column] = replace_values(series)
+             action_msg = f"Mapped values in column '{column}' using provided dictionary."
+        except Exception as e: # Handle potential type issues if dict keys/values mismatch column
+             raise CleaningOperationError(f'Error applying map/replace: {e}', 500)
+
+    elif operation == 'sort_values':
+        columns_to_sort_by = params.get('columns_to_sort_by') # Expect list
+        ascending = params.get('ascending', True) # Default True, can be bool or list
+
+        validate_sort_params(df, columns_to_sort_by, ascending)
+
+        try:
+             # Use ignore_index=True to reset the index after sorting
+             df = df.sort_values(by=columns_to_sort_by, ascending=ascending, ignore_index=True, kind='stable')
+             asc_desc = "ascending" if ascending is True else ("descending" if ascending is False else str(ascending))
+             action_msg = f"Sorted DataFrame by columns: {', '.join(columns_to_sort_by)} ({asc_desc})."
+        except Exception as e:
+             raise CleaningOperationError(f'Error during sorting: {e}', 500)
+
+
+    # --- Add more 'elif operation == ...' blocks here for other functions ---
+    # elif operation == 'remove_outliers_iqr':
+    #     # Get column, calculate Q1, Q3, IQR, filter df
+    #     action_msg = "Removed outliers using IQR method..."
+    # elif operation == 'rename_column':
+    #     # Get old_name, new_name, perform df.rename()
+    #     action_msg = "Renamed column..."
+
+    # --- Operation not found ---
+    else:
+        raise CleaningOperationError(f'Unknown cleaning operation: {operation}')
+
+    return df, action_msg
 
-# --- AJAX Endpoints for Cleaning Operations ---
 
 @app.route('/clean_operation', methods=['POST'])
 @login_required
+@dataset_mutation
 def handle_clean_operation():
     """
     Generic handler for cleaning operations triggered by AJAX.
     Retrieves data from session, performs operation, updates session,
     and returns JSON response for the frontend.
     """
+    # Large versions run supported steps out of core without loading them
+    large = get_large_dataset()
+    if large is not None:
+        response = run_large_clean_operation(*large)
+        if response is not None:
+            return response
+
     # 1. Get the current DataFrame from session
     df = get_dataframe_from_session()
     if df is None:
@@ -1820,689 +5649,32 @@ def handle_clean_operation():
         return jsonify({'error': f'Error parsing request: {str(e)}'}), 400
 
     # 3. Store current state for Undo BEFORE modifying the DataFrame
-    current_df_json = session.get('current_df_json') # Get the JSON string directly
-    # Ensure add_to_undo handles the case where current_df_json might be None initially,
+    current_version = get_current_dataset_version() # Only the version number goes to history
+    # Ensure add_to_undo handles the case where current_version might be None initially,
     # though we check for df existence earlier.
-    add_to_undo(current_df_json) # This helper should also clear the redo history
+    cleared_redo = add_to_undo(current_version) # Put back if the operation fails
 
     # 4. Perform the requested cleaning operation
     try:
-        original_shape = df.shape
-        action_msg = "" # To store the success message
-
-        # --- Apply the requested operation ---
-        if operation == 'remove_duplicates':
-            subset = params.get('subset') # Optional: list of columns, None means all
-            # Ensure subset columns exist if provided (basic check)
-            if subset and not all(col in df.columns for col in subset):
-                 return jsonify({'error': 'One or more subset columns not found.'}), 400
-            df_new = df.drop_duplicates(subset=subset, keep='first')
-            removed_count = original_shape[0] - df_new.shape[0]
-            action_msg = f"Removed {removed_count} duplicate row(s)."
-            df = df_new # Assign the result back to df
-
-        elif operation == 'remove_missing':
-            how = params.get('how', 'any') # 'any' or 'all'
-            subset = params.get('subset') # Optional: list of columns
-            if how not in ['any', 'all']:
-                 return jsonify({'error': 'Invalid value for "how". Must be "any" or "all".'}), 400
-            if subset and not all(col in df.columns for col in subset):
-                 return jsonify({'error': 'One or more subset columns not found.'}), 400
-            df_new = df.dropna(axis=0, how=how, subset=subset) # axis=0 for rows
-            removed_count = original_shape[0] - df_new.shape[0]
-            action_msg = f"Removed {removed_count} row(s) containing missing values."
-            df = df_new
-
-        elif operation == 'fill_missing':
-            # Get parameters: method, column (optional), value (optional)
-            method = params.get('method', 'value') # 'value', 'mean', 'median', 'mode', 'ffill', 'bfill'
-            column = params.get('column') # Optional: specific column name
-            fill_value_str = params.get('value') # Value provided by user (only used if method='value')
-
-            allowed_methods = ['value', 'mean', 'median', 'mode', 'ffill', 'bfill']
-            if method not in allowed_methods:
-                 return jsonify({'error': f'Invalid fill method "{method}". Allowed methods: {allowed_methods}'}), 400
-
-            # --- Method: Fill with a specific VALUE ---
-            if method == 'value':
-                if fill_value_str is None: # Value is required for this method
-                    return jsonify({'error': 'A fill value must be provided when method is "value".'}), 400
-
-                if column: # Fill specific column with value
-                    if column not in df.columns:
-                        return jsonify({'error': f'Column "{column}" not found'}), 400
-
-                    # Attempt type conversion of fill_value_str to match column type
-                    fill_value = fill_value_str # Default to string
-                    warning_msg = ""
-                    try:
-                        col_dtype = df[column].dtype
-                        if pd.api.types.is_numeric_dtype(col_dtype):
-                            fill_value = pd.to_numeric(fill_value_str) if fill_value_str != '' else pd.NA
-                        elif pd.api.types.is_datetime64_any_dtype(col_dtype):
-                            fill_value = pd.to_datetime(fill_value_str) if fill_value_str != '' else pd.NaT
-                        elif pd.api.types.is_bool_dtype(col_dtype):
-                              lowered_val = fill_value_str.lower()
-                              if lowered_val in ['true', '1', 'yes']: fill_value = True
-                              elif lowered_val in ['false', '0', 'no']: fill_value = False
-                              elif lowered_val == '': fill_value = pd.NA
-                              else: raise ValueError("Invalid boolean value")
-                        # else: keep as string
-                    except (ValueError, TypeError) as conv_err:
-                         warning_msg = f" (Warning: Could not convert '{fill_value_str}' to column type, used as string)."
-                         fill_value = fill_value_str # Fallback to string
-
-                    df[column].fillna(fill_value, inplace=True) # Use inplace for single column efficiency
-                    action_msg = f"Filled missing values in column '{column}' with value '{fill_value_str}'." + warning_msg
-
-                else: # Fill ALL columns with the same value
-                    # Simple approach: fill all with the same string value.
-                    # A more complex approach could try type conversion per column, but adds complexity.
-                    df.fillna(fill_value_str, inplace=True)
-                    action_msg = f"Filled missing values in all columns with value '{fill_value_str}'."
-
-            # --- Method: Fill with Mean, Median, or Mode ---
-            elif method in ['mean', 'median', 'mode']:
-                if column: # Fill specific column with statistic
-                    if column not in df.columns:
-                        return jsonify({'error': f'Column "{column}" not found'}), 400
-                    if not pd.api.types.is_numeric_dtype(df[column]):
-                         # Mode could potentially apply to non-numeric, but let's restrict for simplicity now
-                         return jsonify({'error': f'Method "{method}" can only be applied to numeric columns.'}), 400
-                    if df[column].isnull().all(): # Cannot calculate statistic if all null
-                         action_msg = f"Skipped: Cannot calculate {method} for column '{column}' as all values are missing."
-                    else:
-                        fill_stat = None
-                        if method == 'mean':
-                            fill_stat = df[column].mean()
-                        elif method == 'median':
-                            fill_stat = df[column].median()
-                        elif method == 'mode':
-                            mode_result = df[column].mode()
-                            if not mode_result.empty:
-                                fill_stat = mode_result[0] # Take the first mode if multiple exist
-                            else: # Should not happen if not all null, but safety check
-                                 action_msg = f"Skipped: Could not determine mode for column '{column}'."
-                                 fill_stat = None # Ensure fill doesn't happen
-
-                        if fill_stat is not None:
-                             df[column].fillna(fill_stat, inplace=True)
-                             action_msg = f"Filled missing values in numeric column '{column}' with its {method} ({fill_stat:.4g})." # Format stat
-
-                else: # Fill ALL applicable (numeric) columns with their respective statistic
-                    filled_cols = []
-                    skipped_cols = []
-                    for col_loop in df.columns:
-                        if pd.api.types.is_numeric_dtype(df[col_loop]) and not df[col_loop].isnull().all():
-                            fill_stat = None
-                            try:
-                                if method == 'mean': fill_stat = df[col_loop].mean()
-                                elif method == 'median': fill_stat = df[col_loop].median()
-                                elif method == 'mode':
-                                     mode_result = df[col_loop].mode()
-                                     if not mode_result.empty: fill_stat = mode_result[0]
-                            except Exception as e:
-                                 app.logger.warning(f"Could not calculate {method} for {col_loop}: {e}")
-
-                            if fill_stat is not None:
-                                 df[col_loop].fillna(fill_stat, inplace=True)
-                                 filled_cols.append(f"{col_loop} ({fill_stat:.4g})")
-                            else:
-                                 skipped_cols.append(col_loop + " (calc error)")
-                        else:
-                            skipped_cols.append(col_loop + " (not numeric/all null)")
-
-                    if filled_cols:
-                         action_msg = f"Filled missing values in numeric columns with their respective {method}: {'; '.join(filled_cols)}."
-                         if skipped_cols:
-                             action_msg += f" Skipped: {', '.join(skipped_cols)}."
-                    else:
-                         action_msg = f"No numeric columns found/filled using {method} method."
-
-            # --- Method: Forward Fill (ffill) or Backward Fill (bfill) ---
-            elif method in ['ffill', 'bfill']:
-                if column: # Fill specific column
-                    if column not in df.columns:
-                        return jsonify({'error': f'Column "{column}" not found'}), 400
-                    df[column].fillna(method=method, inplace=True)
-                    action_msg = f"Applied {method} (propagate last/next valid value) to column '{column}'."
-                else: # Fill ALL columns
-                    df.fillna(method=method, inplace=True) # Fills across entire DataFrame
-                    action_msg = f"Applied {method} (propagate last/next valid value) across all columns."
-            else:
-                 # This case should be caught by the initial method validation
-                 return jsonify({'error': 'Unknown fill method encountered.'}), 500
-
-        elif operation == 'remove_spaces':
-             column = params.get('column')
-             if not column:
-                  return jsonify({'error': 'Column parameter is required for removing spaces.'}), 400
-             if column not in df.columns:
-                  return jsonify({'error': f'Column "{column}" not found'}), 400
-
-             # Only apply to object/string columns
-             if pd.api.types.is_object_dtype(df[column]) or pd.api.types.is_string_dtype(df[column]):
-                 # Ensure column is treated as string, then strip
-                 df[column] = df[column].astype(str).str.strip()
-                 action_msg = f"Removed leading/trailing spaces from column '{column}'."
-             else:
-                  action_msg = f"Operation skipped: Remove spaces only applicable to text columns (column '{column}' is not text)."
-                  # Don't return error, just inform user maybe? Or return 400?
-                  # return jsonify({'error': f'Remove spaces only applicable to text columns (column "{column}" is not text)'}), 400
-
-
-        elif operation == 'fix_datetime':
-             column = params.get('column')
-             date_format = params.get('format') # Optional format string (e.g., '%Y-%m-%d')
-             if not column:
-                  return jsonify({'error': 'Column parameter is required for fixing dates.'}), 400
-             if column not in df.columns:
-                  return jsonify({'error': f'Column "{column}" not found'}), 400
-
-             # errors='coerce' will turn unparseable dates into NaT (Not a Time/Null)
-             original_nulls = df[column].isnull().sum()
-             df[column] = pd.to_datetime(df[column], format=date_format, errors='coerce')
-             new_nulls = df[column].isnull().sum()
-             coerced_count = new_nulls - original_nulls
-
-             action_msg = f"Converted column '{column}' to datetime type."
-             if coerced_count > 0:
-                 action_msg += f" {coerced_count} value(s) could not be parsed and were set to null."
-        
-
-        # === Check IDs ===
-        elif operation == 'check_id_uniqueness':
-            df_modified = False # This operation doesn't change the DataFrame
-            column = params.get('column')
-            if not column:
-                 return jsonify({'error': 'Column parameter is required.'}), 400
-            if column not in df.columns:
-                 return jsonify({'error': f'Column "{column}" not found'}), 400
-
-            if df[column].is_unique:
-                action_msg = f"Column '{column}' contains unique values."
-            else:
-                duplicates = df[df[column].duplicated()][column].unique()
-                dup_count = df[column].duplicated().sum()
-                preview = duplicates[:5].tolist() # Show first 5 duplicates
-                action_msg = f"Column '{column}' contains {dup_count} duplicate value(s). Examples: {preview}"
-
-        elif operation == 'check_id_format':
-            df_modified = False # This operation doesn't change the DataFrame
-            column = params.get('column')
-            pattern = params.get('pattern')
-            if not column:
-                 return jsonify({'error': 'Column parameter is required.'}), 400
-            if column not in df.columns:
-                 return jsonify({'error': f'Column "{column}" not found'}), 400
-            if not pattern:
-                 return jsonify({'error': 'Pattern parameter is required for format check.'}), 400
-
-            try:
-                # Attempt to compile regex to check validity early
-                re.compile(pattern)
-                # Use na=False to treat NaN as non-matching
-                matches = df[column].astype(str).str.match(f'^{pattern}$', na=False) # Anchor pattern
-                non_matching_count = (~matches).sum()
-                if non_matching_count == 0:
-                    action_msg = f"All values in column '{column}' match the pattern."
-                else:
-                    action_msg = f"Checked format for column '{column}'. {non_matching_count} value(s) did not match the pattern '{pattern}'."
-            except re.error as e:
-                 return jsonify({'error': f'Invalid regex pattern provided: {e}'}), 400
-            except Exception as e:
-                 return jsonify({'error': f'Error during format check: {e}'}), 500
-
-
-        # === Correcting Numerical Outliers (Updated Section) ===
-        elif operation == 'remove_outliers_iqr':
-            column = params.get('column')
-            factor = params.get('factor', 1.5)
-            # --- Validation ---
-            if not column: return jsonify({'error': 'Column parameter is required.'}), 400
-            if column not in df.columns: return jsonify({'error': f'Column "{column}" not found.'}), 400
-            if not pd.api.types.is_numeric_dtype(df[column]): return jsonify({'error': f'Column "{column}" must be numeric for IQR.'}), 400
-            try:
-                 factor = float(factor)
-                 if factor <= 0: raise ValueError("Factor must be positive.")
-            except (ValueError, TypeError): return jsonify({'error': 'Invalid IQR factor.'}), 400
-
-            # --- Calculation & Removal ---
-            col_data_nonan = df[column].dropna()
-            if len(col_data_nonan) < 4: # Not enough data for meaningful IQR
-                 action_msg = f"Skipped IQR outlier removal for '{column}' (too few non-NA values)."
-            else:
-                Q1 = col_data_nonan.quantile(0.25)
-                Q3 = col_data_nonan.quantile(0.75)
-                IQR = Q3 - Q1
-                if IQR >= 0: # Allow IQR to be 0
-                    lower_bound = Q1 - factor * IQR
-                    upper_bound = Q3 + factor * IQR
-                    # Create a boolean mask for rows to keep (non-outliers)
-                    # Important: Apply mask to original df's index to handle NaNs correctly if any
-                    mask_to_keep = (df[column] >= lower_bound) & (df[column] <= upper_bound)
-                    mask_to_keep = mask_to_keep | df[column].isnull() # Keep rows with NaNs in this column
-                    
-                    df_new = df[mask_to_keep].reset_index(drop=True) # This removes rows globally
-                    removed_count = original_shape[0] - df_new.shape[0]
-                    action_msg = f"Removed {removed_count} row(s) with outliers from column '{column}' using IQR (factor={factor}). Bounds: [{lower_bound:.2f}, {upper_bound:.2f}]."
-                    df = df_new # Update the main DataFrame
-                else:
-                    action_msg = f"Skipped IQR outlier removal for '{column}' (Invalid IQR calculation)."
-
-
-        elif operation == 'clip_outliers_iqr':
-            column = params.get('column')
-            factor = params.get('factor', 1.5)
-            # --- Validation (same as remove_outliers_iqr) ---
-            if not column: return jsonify({'error': 'Column required.'}), 400
-            if column not in df.columns: return jsonify({'error': f'Column "{column}" not found.'}), 400
-            if not pd.api.types.is_numeric_dtype(df[column]): return jsonify({'error': f'Column "{column}" must be numeric.'}), 400
-            try: factor = float(factor); assert factor > 0
-            except: return jsonify({'error': 'Invalid IQR factor.'}), 400
-
-            # --- Calculation & Clipping ---
-            col_data_nonan = df[column].dropna()
-            if len(col_data_nonan) < 4:
-                action_msg = f"Skipped IQR clipping for '{column}' (too few non-NA values)."
-            else:
-                Q1 = col_data_nonan.quantile(0.25)
-                Q3 = col_data_nonan.quantile(0.75)
-                IQR = Q3 - Q1
-                if IQR >= 0:
-                    lower_bound = Q1 - factor * IQR
-                    upper_bound = Q3 + factor * IQR
-                    original_values = df[column].copy() # To count how many were clipped
-                    # Clip operates on the Series and returns a new one
-                    df[column] = df[column].clip(lower=lower_bound, upper=upper_bound)
-                    df_modified_in_place = True # Mark that df was modified directly
-                    clipped_count = (original_values != df[column]).sum() # Count where values changed
-                    action_msg = f"Clipped {clipped_count} outlier(s) in column '{column}' using IQR (factor={factor}). Bounds: [{lower_bound:.2f}, {upper_bound:.2f}]."
-                else:
-                     action_msg = f"Skipped IQR clipping for '{column}' (Invalid IQR calculation)."
-
-        # ***** NEW: Z-score Based Outlier Handling *****
-        elif operation == 'remove_outliers_zscore':
-            column = params.get('column')
-            threshold = params.get('threshold', 3.0) # Default Z-score threshold
-            # --- Validation ---
-            if not column: return jsonify({'error': 'Column parameter is required.'}), 400
-            if column not in df.columns: return jsonify({'error': f'Column "{column}" not found.'}), 400
-            if not pd.api.types.is_numeric_dtype(df[column]): return jsonify({'error': f'Column "{column}" must be numeric for Z-score.'}), 400
-            try:
-                 threshold = float(threshold)
-                 if threshold <= 0: raise ValueError("Threshold must be positive.")
-            except (ValueError, TypeError): return jsonify({'error': 'Invalid Z-score threshold.'}), 400
-
-            # --- Calculation & Removal ---
-            col_data_nonan = df[column].dropna()
-            if len(col_data_nonan) < 2 or col_data_nonan.std(ddof=0) < 1e-9 : # Need std > 0 and at least 2 points
-                action_msg = f"Skipped Z-score outlier removal for '{column}' (std is zero or too few non-NA values)."
-            else:
-                # Calculate Z-scores only for non-NaN values
-                z_scores_nonan = np.abs((col_data_nonan - col_data_nonan.mean()) / col_data_nonan.std(ddof=0))
-                # Create a boolean mask for rows to keep (non-outliers based on Z-score)
-                # Start with all False, then mark non-outliers as True
-                mask_to_keep = pd.Series(False, index=df.index)
-                mask_to_keep.loc[col_data_nonan[z_scores_nonan <= threshold].index] = True
-                mask_to_keep = mask_to_keep | df[column].isnull() # Also keep rows that were originally NaN
-
-                df_new = df[mask_to_keep].reset_index(drop=True)
-                removed_count = original_shape[0] - df_new.shape[0]
-                action_msg = f"Removed {removed_count} row(s) with Z-score outliers from column '{column}' (threshold={threshold})."
-                df = df_new # Update the main DataFrame
-
-        elif operation == 'clip_outliers_zscore':
-            column = params.get('column')
-            threshold = params.get('threshold', 3.0)
-            # --- Validation (same as remove_outliers_zscore) ---
-            if not column: return jsonify({'error': 'Column required.'}), 400
-            if column not in df.columns: return jsonify({'error': f'Column "{column}" not found.'}), 400
-            if not pd.api.types.is_numeric_dtype(df[column]): return jsonify({'error': f'Column "{column}" must be numeric.'}), 400
-            try: threshold = float(threshold); assert threshold > 0
-            except: return jsonify({'error': 'Invalid Z-score threshold.'}), 400
-
-            # --- Calculation & Clipping ---
-            col_data_nonan = df[column].dropna()
-            if len(col_data_nonan) < 2 or col_data_nonan.std(ddof=0) < 1e-9:
-                action_msg = f"Skipped Z-score clipping for '{column}' (std is zero or too few non-NA values)."
-            else:
-                mean_val = col_data_nonan.mean() # Use non-NA mean for bounds
-                std_val = col_data_nonan.std(ddof=0)  # Use non-NA std for bounds
-                
-                lower_bound_z = mean_val - threshold * std_val
-                upper_bound_z = mean_val + threshold * std_val
-
-                original_values = df[column].copy()
-                df[column] = df[column].clip(lower=lower_bound_z, upper=upper_bound_z)
-                df_modified_in_place = True
-                clipped_count = (original_values != df[column]).sum()
-                action_msg = f"Clipped {clipped_count} outlier(s) in column '{column}' using Z-score (threshold={threshold}). Bounds: [{lower_bound_z:.2f}, {upper_bound_z:.2f}]."
-
-        # === Define Valid Output (Filtering) ===
-        elif operation == 'filter_rows':
-            column = params.get('column')
-            condition = params.get('condition')
-            value_str = params.get('value') # Value might not be needed for isnull/notnull
-            filter_action = params.get('action', 'keep') # 'keep' or 'remove'
-
-            if not column: return jsonify({'error': 'Column parameter is required.'}), 400
-            if column not in df.columns: return jsonify({'error': f'Column "{column}" not found'}), 400
-            if not condition: return jsonify({'error': 'Condition parameter is required.'}), 400
-            if filter_action not in ['keep', 'remove']: return jsonify({'error': 'Invalid action. Must be "keep" or "remove".'}), 400
-
-            valid_conditions = ['==', '!=', '>', '<', '>=', '<=', 'contains', 'startswith', 'endswith', 'isnull', 'notnull']
-            if condition not in valid_conditions:
-                 return jsonify({'error': f'Invalid condition "{condition}". Valid conditions are: {valid_conditions}'}), 400
-
-            # Handle conditions that don't need a value
-            if condition in ['isnull', 'notnull']:
-                mask = df[column].isnull() if condition == 'isnull' else df[column].notnull()
-                value_display = "" # No value to display
+        try:
+            df, action_msg = apply_clean_operation(df, operation, params)
+        except CleaningOperationError as e:
+            if e.status_code >= 500:
+                app.logger.error(f"Cleaning operation '{operation}' failed: {e.message}")
             else:
-                # Conditions requiring a value
-                if value_str is None: # Check if value was provided
-                     return jsonify({'error': f'Value parameter is required for condition "{condition}".'}), 400
-
-                value_display = f"'{value_str}'" # For message
-                target_value = value_str # Default to string
-
-                # Attempt type conversion based on column dtype for comparison
-                col_dtype = df[column].dtype
-                try:
-                     if pd.api.types.is_numeric_dtype(col_dtype):
-                          target_value = pd.to_numeric(value_str)
-                          value_display = str(target_value)
-                     elif pd.api.types.is_datetime64_any_dtype(col_dtype):
-                          target_value = pd.to_datetime(value_str)
-                          value_display = str(target_value)
-                     elif pd.api.types.is_bool_dtype(col_dtype):
-                           lowered_val = value_str.lower()
-                           if lowered_val in ['true', '1', 'yes']: target_value = True
-                           elif lowered_val in ['false', '0', 'no']: target_value = False
-                           else: raise ValueError("Invalid boolean value")
-                           value_display = str(target_value)
-                     # Else: Keep as string (already assigned) for string operations
-                except (ValueError, TypeError) as conv_err:
-                     # If conversion fails for numeric/datetime/bool, return error as comparison likely invalid
-                      return jsonify({'error': f'Could not convert value "{value_str}" to match type of column "{column}". Error: {conv_err}'}), 400
-
-                # Build mask based on condition
-                if condition == '==': mask = (df[column] == target_value)
-                elif condition == '!=': mask = (df[column] != target_value)
-                elif condition == '>': mask = (df[column] > target_value)
-                elif condition == '<': mask = (df[column] < target_value)
-                elif condition == '>=': mask = (df[column] >= target_value)
-                elif condition == '<=': mask = (df[column] <= target_value)
-                # String conditions (apply only if target_value is string, maybe check col type too?)
-                elif condition == 'contains':
-                    if not isinstance(target_value, str): return jsonify({'error': 'Contains condition requires a string value.'}), 400
-                    mask = df[column].astype(str).str.contains(target_value, na=False)
-                elif condition == 'startswith':
-                    if not isinstance(target_value, str): return jsonify({'error': 'Startswith condition requires a string value.'}), 400
-                    mask = df[column].astype(str).str.startswith(target_value, na=False)
-                elif condition == 'endswith':
-                    if not isinstance(target_value, str): return jsonify({'error': 'Endswith condition requires a string value.'}), 400
-                    mask = df[column].astype(str).str.endswith(target_value, na=False)
-
-            # Apply filter
-            if filter_action == 'keep':
-                df_new = df[mask].reset_index(drop=True)
-                kept_removed_count = df_new.shape[0]
-                action_word = "Kept"
-            else: # remove
-                df_new = df[~mask].reset_index(drop=True)
-                kept_removed_count = original_shape[0] - df_new.shape[0]
-                action_word = "Removed"
-
-            action_msg = f"{action_word} {kept_removed_count} row(s) where '{column}' {condition} {value_display}."
-            df = df_new
-
-
-        # === Transforming and Rearranging ===
-        elif operation == 'split_column':
-            column = params.get('column')
-            delimiter = params.get('delimiter')
-            new_column_names_str = params.get('new_column_names') # Expect comma-separated string from UI
-
-            if not column: return jsonify({'error': 'Column parameter is required.'}), 400
-            if column not in df.columns: return jsonify({'error': f'Column "{column}" not found'}), 400
-            if not delimiter: return jsonify({'error': 'Delimiter parameter is required.'}), 400
-            if not (pd.api.types.is_object_dtype(df[column]) or pd.api.types.is_string_dtype(df[column])):
-                 return jsonify({'error': 'Split column operation only applicable to text columns.'}), 400
-
-            try:
-                # Perform the split
-                split_data = df[column].astype(str).str.split(delimiter, expand=True)
-                num_new_cols = split_data.shape[1]
-
-                # Determine new column names
-                if new_column_names_str:
-                    new_names = [name.strip() for name in new_column_names_str.split(',') if name.strip()]
-                    if len(new_names) != num_new_cols:
-                        return jsonify({'error': f'Provided {len(new_names)} new column names, but split resulted in {num_new_cols} columns.'}), 400
-                else:
-                    # Generate default names
-                    new_names = [f"{column}_split_{i+1}" for i in range(num_new_cols)]
-
-                # Check if new names conflict with existing ones (excluding original column)
-                existing_cols = set(df.columns) - {column}
-                conflicts = set(new_names) & existing_cols
-                if conflicts:
-                     return jsonify({'error': f'New column names conflict with existing columns: {list(conflicts)}'}), 400
-
-                # Add new columns to the DataFrame
-                df[new_names] = split_data
-                action_msg = f"Split column '{column}' into {num_new_cols} new column(s): {', '.join(new_names)}."
-                # Optional: Add parameter to drop original column `df = df.drop(columns=[column])`
-            except Exception as e:
-                return jsonify({'error': f'Error during split operation: {e}'}), 500
-
-        elif operation == 'combine_columns':
-            columns_to_combine = params.get('columns_to_combine') # Expect list
-            new_column_name = params.get('new_column_name')
-            separator = params.get('separator', '') # Default to empty string
-
-            if not columns_to_combine or not isinstance(columns_to_combine, list) or len(columns_to_combine) < 2:
-                 return jsonify({'error': 'Requires a list of at least two columns to combine.'}), 400
-            if not new_column_name:
-                 return jsonify({'error': 'New column name parameter is required.'}), 400
-            if not all(col in df.columns for col in columns_to_combine):
-                 missing = [col for col in columns_to_combine if col not in df.columns]
-                 return jsonify({'error': f'Columns not found: {missing}'}), 400
-            if new_column_name in df.columns:
-                 # Optional: Allow overwrite? For now, prevent it.
-                 return jsonify({'error': f'New column name "{new_column_name}" already exists.'}), 400
-
-            try:
-                # Convert all columns to string and join
-                df[new_column_name] = df[columns_to_combine].astype(str).agg(separator.join, axis=1)
-                action_msg = f"Combined columns {columns_to_combine} into '{new_column_name}' using separator '{separator}'."
-                # Optional: Add parameter to drop original columns `df = df.drop(columns=columns_to_combine)`
-            except Exception as e:
-                return jsonify({'error': f'Error during combine operation: {e}'}), 500
-
-        # === Other Common Operations ===
-
-        elif operation == 'change_dtype':
-            column = params.get('column')
-            target_type = params.get('target_type')
-            if not column: return jsonify({'error': 'Column parameter is required.'}), 400
-            if column not in df.columns: return jsonify({'error': f'Column "{column}" not found'}), 400
-            if not target_type: return jsonify({'error': 'Target type parameter is required.'}), 400
-
-            original_nulls = df[column].isnull().sum()
-            coerced_count = 0
-            try:
-                if target_type in ['int', 'integer']:
-                    # Use Int64 for nullable integers
-                    df[column] = pd.to_numeric(df[column], errors='coerce').astype('Int64')
-                elif target_type in ['float', 'double', 'number']:
-                    df[column] = pd.to_numeric(df[column], errors='coerce').astype(float) # Standard float
-                elif target_type in ['str', 'string', 'text', 'object']:
-                    df[column] = df[column].astype(str)
-                elif target_type in ['datetime', 'date']:
-                    df[column] = pd.to_datetime(df[column], errors='coerce')
-                elif target_type in ['bool', 'boolean']:
-                     # pd.BooleanDtype() allows NA
-                     df[column] = df[column].astype(pd.BooleanDtype()) # This handles 'True','False','true','false',1,0, NAs well
-                elif target_type == 'category':
-                    df[column] = df[column].astype('category')
-                else:
-                    return jsonify({'error': f'Unsupported target type: {target_type}'}), 400
-
-                new_nulls = df[column].isnull().sum()
-                coerced_count = new_nulls - original_nulls
-                action_msg = f"Converted column '{column}' to type '{target_type}'."
-                if coerced_count > 0:
-                     action_msg += f" {coerced_count} value(s) set to null due to conversion errors."
-
-            except Exception as e:
-                # Revert if conversion fails? Less critical here as errors='coerce' handles most cases
-                return jsonify({'error': f'Error converting column "{column}" to {target_type}: {e}'}), 500
-
-
-        elif operation == 'rename_column':
-            old_name = params.get('old_name')
-            new_name = params.get('new_name')
-            if not old_name: return jsonify({'error': 'Old column name parameter is required.'}), 400
-            if old_name not in df.columns: return jsonify({'error': f'Column "{old_name}" not found'}), 400
-            if not new_name: return jsonify({'error': 'New column name parameter is required.'}), 400
-            if new_name == old_name: return jsonify({'message': 'New name is the same as the old name. No change made.', 'df_modified': False }), 200 # No change needed
-            if new_name in df.columns: return jsonify({'error': f'New column name "{new_name}" already exists.'}), 400
-
-            df.rename(columns={old_name: new_name}, inplace=True)
-            action_msg = f"Renamed column '{old_name}' to '{new_name}'."
-
-
-        elif operation == 'drop_columns':
-            columns_to_drop = params.get('columns_to_drop') # Expect list
-            if not columns_to_drop or not isinstance(columns_to_drop, list):
-                 return jsonify({'error': 'Requires a list of columns to drop.'}), 400
-
-            actual_cols_to_drop = [col for col in columns_to_drop if col in df.columns]
-            if not actual_cols_to_drop:
-                 return jsonify({'error': 'None of the specified columns found in the data.'}), 400
-
-            df = df.drop(columns=actual_cols_to_drop) # Assign back is safer than inplace
-            action_msg = f"Dropped columns: {', '.join(actual_cols_to_drop)}."
-            if len(actual_cols_to_drop) < len(columns_to_drop):
-                 missing = [col for col in columns_to_drop if col not in actual_cols_to_drop]
-                 action_msg += f" (Columns not found and ignored: {', '.join(missing)})"
-
-        elif operation == 'replace_text':
-             column = params.get('column')
-             text_to_find = params.get('text_to_find')
-             replace_with = params.get('replace_with', '') # Default to replace with empty string
-             use_regex = params.get('use_regex', False) # Default to literal replacement
-
-             if not column: return jsonify({'error': 'Column parameter is required.'}), 400
-             if column not in df.columns: return jsonify({'error': f'Column "{column}" not found'}), 400
-             if text_to_find is None: return jsonify({'error': 'Text to find parameter is required.'}), 400 # Allow empty string
-             if not (pd.api.types.is_object_dtype(df[column]) or pd.api.types.is_string_dtype(df[column])):
-                  return jsonify({'error': 'Replace text operation only applicable to text columns.'}), 400
-
-             try:
-                 # Ensure string type for replacement
-                 df[column] = df[column].astype(str).str.replace(str(text_to_find), str(replace_with), regex=bool(use_regex))
-                 mode = "regex" if use_regex else "literal"
-                 action_msg = f"Replaced text '{text_to_find}' with '{replace_with}' in column '{column}' (mode: {mode})."
-             except re.error as e:
-                 if use_regex:
-                      return jsonify({'error': f'Invalid regex pattern provided: {e}'}), 400
-                 else: # Should not happen in literal mode, but just in case
-                      return jsonify({'error': f'Error during text replacement: {e}'}), 500
-             except Exception as e:
-                  return jsonify({'error': f'Error during text replacement: {e}'}), 500
-
-        elif operation == 'change_case':
-            column = params.get('column')
-            case_type = params.get('case_type') # 'lower', 'upper', 'title'
-            if not column: return jsonify({'error': 'Column parameter is required.'}), 400
-            if column not in df.columns: return jsonify({'error': f'Column "{column}" not found'}), 400
-            if not (pd.api.types.is_object_dtype(df[column]) or pd.api.types.is_string_dtype(df[column])):
-                 return jsonify({'error': 'Change case operation only applicable to text columns.'}), 400
-            if case_type not in ['lower', 'upper', 'title']:
-                 return jsonify({'error': 'Invalid case type. Must be "lower", "upper", or "title".'}), 400
-
-            if case_type == 'lower': df[column] = df[column].astype(str).str.lower()
-            elif case_type == 'upper': df[column] = df[column].astype(str).str.upper()
-            elif case_type == 'title': df[column] = df[column].astype(str).str.title()
-            action_msg = f"Converted text in column '{column}' to {case_type} case."
-
-        elif operation == 'map_values':
-            column = params.get('column')
-            mapping_dict = params.get('mapping_dict') # Expect a dict/object
-            if not column: return jsonify({'error': 'Column parameter is required.'}), 400
-            if column not in df.columns: return jsonify({'error': f'Column "{column}" not found'}), 400
-            if not mapping_dict or not isinstance(mapping_dict, dict):
-                 return jsonify({'error': 'Mapping dictionary parameter is required and must be an object/dictionary.'}), 400
-
-            try:
-                 # Use replace which is generally more flexible than map for this purpose
-                 df[column] = df[column].replace(mapping_dict)
-                 action_msg = f"Mapped values in column '{column}' using provided dictionary."
-            except Exception as e: # Handle potential type issues if dict keys/values mismatch column
-                 return jsonify({'error': f'Error applying map/replace: {e}'}), 500
-
-        elif operation == 'sort_values':
-            columns_to_sort_by = params.get('columns_to_sort_by') # Expect list
-            ascending = params.get('ascending', True) # Default True, can be bool or list
-
-            if not columns_to_sort_by or not isinstance(columns_to_sort_by, list):
-                 return jsonify({'error': 'Requires a list of columns to sort by.'}), 400
-            if not all(col in df.columns for col in columns_to_sort_by):
-                 missing = [col for col in columns_to_sort_by if col not in df.columns]
-                 return jsonify({'error': f'Columns not found: {missing}'}), 400
-
-            # Validate ascending parameter format if it's a list
-            if isinstance(ascending, list) and len(ascending) != len(columns_to_sort_by):
-                return jsonify({'error': 'If "ascending" is a list, its length must match the number of columns to sort by.'}), 400
-
-            try:
-                 # Use ignore_index=True to reset the index after sorting
-                 df = df.sort_values(by=columns_to_sort_by, ascending=ascending, ignore_index=True)
-                 asc_desc = "ascending" if ascending is True else ("descending" if ascending is False else str(ascending))
-                 action_msg = f"Sorted DataFrame by columns: {', '.join(columns_to_sort_by)} ({asc_desc})."
-            except Exception as e:
-                 return jsonify({'error': f'Error during sorting: {e}'}), 500
-
-
-        # --- Add more 'elif operation == ...' blocks here for other functions ---
-        # elif operation == 'remove_outliers_iqr':
-        #     # Get column, calculate Q1, Q3, IQR, filter df
-        #     action_msg = "Removed outliers using IQR method..."
-        # elif operation == 'rename_column':
-        #     # Get old_name, new_name, perform df.rename()
-        #     action_msg = "Renamed column..."
-
-        # --- Operation not found ---
-        else:
-            # If operation isn't recognized, we shouldn't have added to undo.
-            # This part is tricky because undo was already potentially modified.
-            # Best practice: Validate operation *before* modifying undo history.
-            # Quick Fix: Log it, maybe try to pop from undo? (Risky)
-            app.logger.warning(f"Unknown cleaning operation received: {operation}")
-            # Attempt to revert undo (may not be perfectly safe depending on add_to_undo logic)
-            undo_history = session.get('undo_history', [])
-            if undo_history:
-                 session['undo_history'] = undo_history[:-1] # Remove the last added state
-
-            return jsonify({'error': f'Unknown cleaning operation: {operation}'}), 400
+                app.logger.warning(f"Rejected cleaning operation '{operation}': {e.message}")
+            rollback_last_undo_entry(restore=False, redo=cleared_redo) # Nothing changed; drop the undo entry added above
+            return jsonify({'error': e.message}), e.status_code
 
         # 5. Store the MODIFIED DataFrame back into the session
-        store_dataframe_in_session(df) # Use the helper function
-
-        table_html, total_rows, total_columns = render_table_html(df)
+        store_dataframe_in_session(df, step={'kind': 'clean_operation', 'operation': operation, 'params': params})
 
         # 6. Prepare successful JSON response
         response_data = {
             'message': action_msg,
-            'table_html': render_table_html(df), # Use helper to generate HTML
-            'columns': df.columns.tolist(),       # Send updated column list
             'undo_redo_status': get_undo_redo_status(), # Send button states
-            'total_rows': total_rows,
-            'total_columns': total_columns
+            'dataset_version': get_current_dataset_version(),
+            **build_grid_update(df) # Grid patch (or first page), totals and, if changed, the column list
         }
         return jsonify(response_data), 200
 
@@ -2512,14 +5684,9 @@ def handle_clean_operation():
 
         # Attempt to rollback state by restoring the last known good state from undo history
         # This prevents the session from holding a potentially corrupted intermediate state
-        undo_history = session.get('undo_history', [])
-        if undo_history:
-             # The last item in undo_history is the state *before* the failed operation
-             last_good_state_json = undo_history.pop() # Remove it as it represents the current state now
-             session['current_df_json'] = last_good_state_json
-             session['undo_history'] = undo_history # Save the shortened undo history
-             # Don't clear redo; the failed action didn't succeed, so redo might still be valid.
-        else:
+        # The last undo entry is the state *before* the failed operation.
+        # Don't clear redo; the failed action didn't succeed, so redo might still be valid.
+        if not rollback_last_undo_entry(redo=cleared_redo):
              # If no undo history, we might be in trouble. Clear the current DF?
              clear_session_data() # Or handle differently
 
@@ -2647,37 +5814,32 @@ def perform_search():
     data = request.get_json()
     column_name = data.get('column')
     search_term_raw = data.get('term', '') # Keep original case for potential display/session storage
-    search_term_lower = search_term_raw.lower()
 
     if not column_name or column_name not in df_original.columns:
         return jsonify({'error': 'Invalid column specified for search.'}), 400
 
     if not search_term_raw: # If search term is empty, effectively clear search
         session.pop('active_search_criteria', None)
-        table_html, total_rows, total_columns = render_table_html(df_original)
+        grid = build_grid_payload(df_original)
         return jsonify({
-            'table_html': table_html,
-            'total_rows': total_rows,
-            'total_columns': total_columns,
+            'grid': grid,
+            'total_rows': grid['total_rows'],
+            'total_columns': grid['total_columns'],
             'search_cleared': True,
             'columns': df_original.columns.tolist()
         })
 
     try:
-        mask = df_original[column_name].astype(str).str.lower().str.contains(search_term_lower, na=False)
-        df_filtered = df_original[mask]
-        
-        # Store raw term for display consistency if needed later
+        # Store raw term for display consistency; /grid applies it to every page it serves
         session['active_search_criteria'] = {'column': column_name, 'term_raw': search_term_raw}
-
-        table_html, total_rows_filtered, total_cols_filtered = render_table_html(df_filtered)
+        grid = build_grid_payload(df_original) # Matching rows are a cached view, not a filtered copy
         
         return jsonify({
-            'table_html': table_html,
-            'total_rows': total_rows_filtered, # This is filtered row count
-            'total_columns': total_cols_filtered, # Should be same as original
+            'grid': grid,
+            'total_rows': grid['total_rows'], # This is filtered row count
+            'total_columns': grid['total_columns'], # Should be same as original
             'search_applied': True,
-            'filtered_row_count': len(df_filtered),
+            'filtered_row_count': grid['total_rows'],
             'original_row_count': len(df_original),
             'search_term_applied': search_term_raw, # The term that was applied
             'search_column_applied': column_name,
@@ -2698,17 +5860,74 @@ def clear_search_filter_route(): # Renamed to avoid conflict with helper functio
     
     session.pop('active_search_criteria', None)
 
-    table_html, total_rows, total_columns = render_table_html(df)
+    grid = build_grid_payload(df)
     return jsonify({
         'message': 'Search filter cleared.',
-        'table_html': table_html,
+        'grid': grid,
         'columns': df.columns.tolist(),
-        'total_rows': total_rows,
-        'total_columns': total_columns,
+        'total_rows': grid['total_rows'],
+        'total_columns': grid['total_columns'],
         'search_cleared': True
     })
 
 
+@app.route('/sort_view', methods=['POST'])
+@login_required
+def sort_view():
+    """Sorts the grid's rows without reordering the data: no copy and no history entry."""
+    df = get_dataframe_from_session()
+    if df is None:
+        return jsonify({'error': 'No data loaded.'}), 400
+
+    data = request.get_json() or {}
+    columns_to_sort_by = data.get('columns_to_sort_by')
+    ascending = data.get('ascending', True)
+    if not columns_to_sort_by:
+        session.pop('active_sort', None)
+        message = 'Sort cleared. Rows are shown in data order.'
+    else:
+        try:
+            validate_sort_params(df, columns_to_sort_by, ascending)
+        except CleaningOperationError as e:
+            return jsonify({'error': e.message}), e.status_code
+        session['active_sort'] = {'columns': columns_to_sort_by, 'ascending': ascending}
+        asc_desc = "ascending" if ascending is True else ("descending" if ascending is False else str(ascending))
+        message = f"Sorted view by columns: {', '.join(map(str, columns_to_sort_by))} ({asc_desc})."
+
+    try:
+        grid = build_grid_payload(df)
+    except Exception as e: # e.g. a column mixing types that cannot be compared
+        app.logger.error(f"Error sorting view by {columns_to_sort_by}: {e}", exc_info=True)
+        session.pop('active_sort', None)
+        return jsonify({'error': f'Could not sort: {str(e)}'}), 400
+    return jsonify({
+        'message': message,
+        'grid': grid,
+        'total_rows': grid['total_rows'],
+        'total_columns': grid['total_columns'],
+        'sort_applied': bool(columns_to_sort_by),
+        'sort_columns_applied': columns_to_sort_by or []
+    })
+
+
+@app.route('/grid', methods=['GET'])
+@login_required
+def get_grid():
+    """Serves one page of rows for the virtualized data grid, honoring the active search."""
+    offset = request.args.get('offset', 0, type=int)
+    limit = request.args.get('limit', app.config['GRID_PAGE_SIZE'], type=int)
+    key = get_preview_cache_key('grid', offset, limit)
+    if key is None:
+        return jsonify({'error': 'No data loaded.'}), 400
+    etag = preview_etag(key)
+    if etag in request.if_none_match: # Same version, view and page: skip loading the data entirely
+        return with_etag(app.response_class(), etag)
+
+    df = load_grid_frame() # None for a large version: only the page is read
+    if df is None and get_large_dataset() is None:
+        return jsonify({'error': 'No data loaded.'}), 400
+    return with_etag(jsonify(get_cached_grid_page(df, offset=offset, limit=limit)), etag)
+
 
 # --- New Route for Auto Cleaning ---
  
@@ -2816,34 +6035,15 @@ def save_auto_clean_config():
         app.logger.error(f"Error saving auto_clean_config: {e}", exc_info=True)
         return jsonify({'error': f'An internal server error occurred while saving configuration: {str(e)}'}), 500
 
-@app.route('/auto_clean', methods=['POST'])
-@login_required
-def auto_clean_data():
+def apply_auto_clean(df, config):
     """
-    Applies a predefined set of non-destructive cleaning steps, including:
-    - Trims whitespace from string columns.
-    - Attempts conversion of object columns to numeric/datetime (errors='coerce').
-    - Clips outliers in numeric columns using IQR method (factor=1.5).
-    - Fills missing values based on type (median for numeric, ffill/bfill for others).
-    - Converts low-cardinality strings to Category.
-    - Converts string/category columns to lowercase.
+    Runs the configured Auto Clean steps on a copy of df and returns
+    (cleaned_df, actions_performed). Kept free of request/session state so
+    history can replay it.
     """
-    # 1. Get DataFrame and add to undo
-    df = get_dataframe_from_session()
-    if df is None:
-        return jsonify({'error': 'No data loaded.'}), 400
-
-    current_df_json = session.get('current_df_json')
-    add_to_undo(current_df_json) # Save state before cleaning
-
     actions_performed = [] # Keep track of what was done per column
     df_cleaned = df.copy() # Work on a copy
 
-    # --- Get Configurations ---
-    # Get from session, or use defaults if not set by the user
-    # If sending via POST request body: config = request.json.get('config', {})
-    config = session.get('auto_clean_config', {})
-
     # --- Configuration Options ---
     # Outliers
     outlier_handling = config.get('outlier_handling', 'none') # 'none', 'clip_iqr', 'clip_zscore', 'remove_iqr', 'remove_zscore'
@@ -2869,207 +6069,237 @@ def auto_clean_data():
     # --- NEW: Set to collect indices of rows to drop globally ---
     indices_to_drop_for_outliers = set()
 
-    try:
-        # --- Iterate through columns to apply cleaning steps ---
-        for col in df_cleaned.columns:
-            original_dtype_str = str(df_cleaned[col].dtype)
-            col_actions = []
-            series_to_process = df_cleaned[col] # Work on the current state of the column
-
-            # --- 1. Trim Whitespace (Toggleable) ---
-            if trim_whitespace and (pd.api.types.is_object_dtype(original_dtype_str) or pd.api.types.is_string_dtype(original_dtype_str)):
-                try:
-                    mask = series_to_process.notna()
-                    if mask.any():
-                        original_values = series_to_process[mask].astype(str)
-                        stripped_values = original_values.str.strip()
-                        if not original_values.equals(stripped_values):
-                            # Create a copy to modify, then assign back to df_cleaned[col]
-                            series_copy = series_to_process.copy()
-                            series_copy.loc[mask] = stripped_values
-                            df_cleaned[col] = series_copy
-                            series_to_process = df_cleaned[col] # Update for next steps
-                            col_actions.append("Trimmed whitespace")
-                except Exception as e: app.logger.warning(f"AutoClean Error (Whitespace {col}): {e}")
-
-
-            # --- 2. Numeric/Datetime Conversion (Toggleable) ---
-            current_dtype_after_strip = str(series_to_process.dtype)
-            if pd.api.types.is_object_dtype(current_dtype_after_strip):
-                temp_series = series_to_process.copy() # Work on a temporary series for conversion attempts
-                if convert_numeric:
-                    try:
-                        converted_numeric = pd.to_numeric(temp_series, errors='coerce')
-                        if pd.api.types.is_numeric_dtype(converted_numeric.dtype) and \
-                           converted_numeric.dtype != current_dtype_after_strip and \
-                           converted_numeric.notna().any():
-                            if (converted_numeric.dropna() % 1 == 0).all():
-                                temp_series = converted_numeric.astype(pd.Int64Dtype())
-                                col_actions.append("Converted to Integer")
-                            else:
-                                temp_series = converted_numeric.astype(float)
-                                col_actions.append("Converted to Float")
-                            series_to_process = temp_series # Update if conversion successful
-                    except Exception as e: app.logger.warning(f"AutoClean Error (Numeric Conv {col}): {e}")
-
-                if convert_datetime and pd.api.types.is_object_dtype(temp_series.dtype): # Check again
-                     try:
-                         converted_datetime = pd.to_datetime(temp_series, errors='coerce', infer_datetime_format=True)
-                         if pd.api.types.is_datetime64_any_dtype(converted_datetime.dtype) and \
-                            converted_datetime.dtype != current_dtype_after_strip and \
-                            converted_datetime.notna().any():
-                              temp_series = converted_datetime
-                              col_actions.append("Converted to Datetime")
-                              series_to_process = temp_series # Update if conversion successful
-                     except Exception as e: app.logger.warning(f"AutoClean Error (Datetime Conv {col}): {e}")
-                df_cleaned[col] = series_to_process # Assign final converted series back to DataFrame
-
-
-            # --- 3. Outlier Handling (Configurable) ---
-            current_dtype_after_conv = str(df_cleaned[col].dtype) # Use df_cleaned[col] for current dtype
-            if outlier_handling != 'none' and pd.api.types.is_numeric_dtype(current_dtype_after_conv) and not pd.api.types.is_bool_dtype(current_dtype_after_conv):
+    # --- Iterate through columns to apply cleaning steps ---
+    for col in df_cleaned.columns:
+        original_dtype_str = str(df_cleaned[col].dtype)
+        col_actions = []
+        series_to_process = df_cleaned[col] # Work on the current state of the column
+
+        # --- 1. Trim Whitespace (Toggleable) ---
+        if trim_whitespace and (pd.api.types.is_object_dtype(original_dtype_str) or pd.api.types.is_string_dtype(original_dtype_str)):
+            try:
+                mask = series_to_process.notna()
+                if mask.any():
+                    original_values = series_to_process[mask].astype(str)
+                    stripped_values = original_values.str.strip()
+                    if not original_values.equals(stripped_values):
+                        # Create a copy to modify, then assign back to df_cleaned[col]
+                        series_copy = series_to_process.copy()
+                        series_copy.loc[mask] = stripped_values
+                        df_cleaned[col] = series_copy
+                        series_to_process = df_cleaned[col] # Update for next steps
+                        col_actions.append("Trimmed whitespace")
+            except Exception as e: app.logger.warning(f"AutoClean Error (Whitespace {col}): {e}")
+
+
+        # --- 2. Numeric/Datetime Conversion (Toggleable) ---
+        current_dtype_after_strip = str(series_to_process.dtype)
+        if pd.api.types.is_object_dtype(current_dtype_after_strip):
+            temp_series = series_to_process.copy() # Work on a temporary series for conversion attempts
+            if convert_numeric:
                 try:
-                    col_data_for_outliers = df_cleaned[col]
-                    col_data_nonan = col_data_for_outliers.dropna()
-                    n_nonan = len(col_data_nonan)
-
-                    if n_nonan >= 2: # Need at least 2 points for std dev, more for IQR
-                        outlier_mask = pd.Series(False, index=df_cleaned.index)
-                        outliers_count = 0
-
-                        if outlier_handling == 'clip_iqr' or outlier_handling == 'remove_iqr':
-                            Q1 = col_data_nonan.quantile(0.25)
-                            Q3 = col_data_nonan.quantile(0.75)
-                            IQR = Q3 - Q1
-                            if IQR >= 0:
-                                lower_bound = Q1 - outlier_iqr_factor * IQR
-                                upper_bound = Q3 + outlier_iqr_factor * IQR
-                                # Identify outliers on the original column's non-NA values to get correct indices
-                                current_col_values = df_cleaned[col]
-                                outlier_mask = (current_col_values < lower_bound) | (current_col_values > upper_bound)
-                                outliers_count = outlier_mask.sum()
-
-                                if outliers_count > 0:
-                                    if outlier_handling == 'clip_iqr':
-                                        # Create a copy, clip, then assign back
+                    converted_numeric = pd.to_numeric(temp_series, errors='coerce')
+                    if pd.api.types.is_numeric_dtype(converted_numeric.dtype) and \
+                       converted_numeric.dtype != current_dtype_after_strip and \
+                       converted_numeric.notna().any():
+                        if (converted_numeric.dropna() % 1 == 0).all():
+                            temp_series = converted_numeric.astype(pd.Int64Dtype())
+                            col_actions.append("Converted to Integer")
+                        else:
+                            temp_series = converted_numeric.astype(float)
+                            col_actions.append("Converted to Float")
+                        series_to_process = temp_series # Update if conversion successful
+                except Exception as e: app.logger.warning(f"AutoClean Error (Numeric Conv {col}): {e}")
+
+            if convert_datetime and pd.api.types.is_object_dtype(temp_series.dtype): # Check again
+                 try:
+                     converted_datetime = pd.to_datetime(temp_series, errors='coerce', infer_datetime_format=True)
+                     if pd.api.types.is_datetime64_any_dtype(converted_datetime.dtype) and \
+                        converted_datetime.dtype != current_dtype_after_strip and \
+                        converted_datetime.notna().any():
+                          temp_series = converted_datetime
+                          col_actions.append("Converted to Datetime")
+                          series_to_process = temp_series # Update if conversion successful
+                 except Exception as e: app.logger.warning(f"AutoClean Error (Datetime Conv {col}): {e}")
+            df_cleaned[col] = series_to_process # Assign final converted series back to DataFrame
+
+
+        # --- 3. Outlier Handling (Configurable) ---
+        current_dtype_after_conv = str(df_cleaned[col].dtype) # Use df_cleaned[col] for current dtype
+        if outlier_handling != 'none' and pd.api.types.is_numeric_dtype(current_dtype_after_conv) and not pd.api.types.is_bool_dtype(current_dtype_after_conv):
+            try:
+                col_data_for_outliers = df_cleaned[col]
+                col_data_nonan = col_data_for_outliers.dropna()
+                n_nonan = len(col_data_nonan)
+
+                if n_nonan >= 2: # Need at least 2 points for std dev, more for IQR
+                    outlier_mask = pd.Series(False, index=df_cleaned.index)
+                    outliers_count = 0
+
+                    if outlier_handling == 'clip_iqr' or outlier_handling == 'remove_iqr':
+                        Q1 = col_data_nonan.quantile(0.25)
+                        Q3 = col_data_nonan.quantile(0.75)
+                        IQR = Q3 - Q1
+                        if IQR >= 0:
+                            lower_bound = Q1 - outlier_iqr_factor * IQR
+                            upper_bound = Q3 + outlier_iqr_factor * IQR
+                            # Identify outliers on the original column's non-NA values to get correct indices
+                            current_col_values = df_cleaned[col]
+                            outlier_mask = (current_col_values < lower_bound) | (current_col_values > upper_bound)
+                            outliers_count = outlier_mask.sum()
+
+                            if outliers_count > 0:
+                                if outlier_handling == 'clip_iqr':
+                                    # Create a copy, clip, then assign back
+                                    series_copy = df_cleaned[col].copy()
+                                    series_copy = series_copy.clip(lower=lower_bound, upper=upper_bound)
+                                    df_cleaned[col] = series_copy
+                                    col_actions.append(f"Clipped {outliers_count} outliers (IQR Factor: {outlier_iqr_factor})")
+                                elif outlier_handling == 'remove_iqr':
+                                    indices_to_drop_for_outliers.update(df_cleaned[outlier_mask].index)
+                                    col_actions.append(f"Flagged {outliers_count} IQR outliers for row removal")
+
+                    elif outlier_handling == 'clip_zscore' or outlier_handling == 'remove_zscore':
+                        if n_nonan > 1 and col_data_nonan.std() > 0: # Z-score needs std > 0
+                            z_scores = np.abs(scipy_stats.zscore(col_data_nonan)) # Use scipy for robust zscore on non-NaN
+                            # Map z_scores back to original series to get correct indices for outlier_mask
+                            temp_z_series = pd.Series(index=col_data_nonan.index, data=z_scores)
+                            full_z_series = temp_z_series.reindex(df_cleaned.index).fillna(0)
+
+                            outlier_mask = full_z_series > outlier_zscore_threshold
+                            outliers_count = outlier_mask.sum()
+
+                            if outliers_count > 0:
+                                if outlier_handling == 'clip_zscore':
+                                    # Calculate bounds based on original series' mean and std for clipping
+                                    mean_val = df_cleaned[col].mean() # Use mean of the whole column (could be mean of col_data_nonan)
+                                    std_val = df_cleaned[col].std()   # Use std of the whole column
+                                    if std_val > 0:
+                                        lower_bound_z = mean_val - outlier_zscore_threshold * std_val
+                                        upper_bound_z = mean_val + outlier_zscore_threshold * std_val
                                         series_copy = df_cleaned[col].copy()
-                                        series_copy = series_copy.clip(lower=lower_bound, upper=upper_bound)
+                                        series_copy = series_copy.clip(lower=lower_bound_z, upper=upper_bound_z)
                                         df_cleaned[col] = series_copy
-                                        col_actions.append(f"Clipped {outliers_count} outliers (IQR Factor: {outlier_iqr_factor})")
-                                    elif outlier_handling == 'remove_iqr':
-                                        indices_to_drop_for_outliers.update(df_cleaned[outlier_mask].index)
-                                        col_actions.append(f"Flagged {outliers_count} IQR outliers for row removal")
-
-                        elif outlier_handling == 'clip_zscore' or outlier_handling == 'remove_zscore':
-                            if n_nonan > 1 and col_data_nonan.std() > 0: # Z-score needs std > 0
-                                z_scores = np.abs(scipy_stats.zscore(col_data_nonan)) # Use scipy for robust zscore on non-NaN
-                                # Map z_scores back to original series to get correct indices for outlier_mask
-                                temp_z_series = pd.Series(index=col_data_nonan.index, data=z_scores)
-                                full_z_series = temp_z_series.reindex(df_cleaned.index).fillna(0)
-
-                                outlier_mask = full_z_series > outlier_zscore_threshold
-                                outliers_count = outlier_mask.sum()
-
-                                if outliers_count > 0:
-                                    if outlier_handling == 'clip_zscore':
-                                        # Calculate bounds based on original series' mean and std for clipping
-                                        mean_val = df_cleaned[col].mean() # Use mean of the whole column (could be mean of col_data_nonan)
-                                        std_val = df_cleaned[col].std()   # Use std of the whole column
-                                        if std_val > 0:
-                                            lower_bound_z = mean_val - outlier_zscore_threshold * std_val
-                                            upper_bound_z = mean_val + outlier_zscore_threshold * std_val
-                                            series_copy = df_cleaned[col].copy()
-                                            series_copy = series_copy.clip(lower=lower_bound_z, upper=upper_bound_z)
-                                            df_cleaned[col] = series_copy
-                                            col_actions.append(f"Clipped {outliers_count} outliers (Z-score > {outlier_zscore_threshold})")
-                                    elif outlier_handling == 'remove_zscore':
-                                        indices_to_drop_for_outliers.update(df_cleaned[outlier_mask].index)
-                                        col_actions.append(f"Flagged {outliers_count} Z-score outliers for row removal")
-                            else:
-                                col_actions.append(f"Z-score outlier detection skipped (std=0 or too few values)")
-                except Exception as e: app.logger.warning(f"AutoClean Error (Outliers {col}): {e}")
+                                        col_actions.append(f"Clipped {outliers_count} outliers (Z-score > {outlier_zscore_threshold})")
+                                elif outlier_handling == 'remove_zscore':
+                                    indices_to_drop_for_outliers.update(df_cleaned[outlier_mask].index)
+                                    col_actions.append(f"Flagged {outliers_count} Z-score outliers for row removal")
+                        else:
+                            col_actions.append(f"Z-score outlier detection skipped (std=0 or too few values)")
+            except Exception as e: app.logger.warning(f"AutoClean Error (Outliers {col}): {e}")
 
-            # --- 4. Fill Missing Values (Configurable) ---
-            series_to_process = df_cleaned[col] # Get latest state of the column
-            current_dtype_after_outlier = str(series_to_process.dtype)
-            if series_to_process.isnull().any():
-                try:
-                    # Ensure to use series_to_process and assign back to df_cleaned[col]
-                    if pd.api.types.is_numeric_dtype(current_dtype_after_outlier) and not pd.api.types.is_bool_dtype(current_dtype_after_outlier):
-                        filled_series = series_to_process.copy()
-                        if missing_numeric_method == 'median':
-                            median_val = filled_series.median()
-                            if not pd.isna(median_val): filled_series.fillna(median_val, inplace=True); col_actions.append(f"Filled NA with Median ({median_val:.4g})")
-                        elif missing_numeric_method == 'mean':
-                            mean_val = filled_series.mean()
-                            if not pd.isna(mean_val): filled_series.fillna(mean_val, inplace=True); col_actions.append(f"Filled NA with Mean ({mean_val:.4g})")
-                        df_cleaned[col] = filled_series
-                    elif missing_other_method == 'ffill_bfill':
-                        filled_series = series_to_process.copy()
-                        original_nulls = filled_series.isnull().sum()
-                        filled_series.fillna(method='ffill', inplace=True)
-                        filled_series.fillna(method='bfill', inplace=True)
-                        if filled_series.isnull().sum() < original_nulls: col_actions.append("Filled NA (ffill/bfill)")
-                        df_cleaned[col] = filled_series
-                except Exception as e: app.logger.warning(f"AutoClean Error (Missing Fill {col}): {e}")
-
-
-            # --- 5. Convert Low-Cardinality Strings to Category (Toggleable) ---
-            dtype_after_fill = str(df_cleaned[col].dtype)
-            if convert_category and (pd.api.types.is_object_dtype(dtype_after_fill) or pd.api.types.is_string_dtype(dtype_after_fill)) and \
-               not pd.api.types.is_categorical_dtype(dtype_after_fill):
-                try:
-                     n_unique = df_cleaned[col].nunique()
-                     # Using fixed thresholds from features page for consistency
-                     if n_unique / len(df_cleaned) < 0.02 or n_unique <= 10: # Example heuristic
-                         df_cleaned[col] = df_cleaned[col].astype('category')
-                         col_actions.append(f"Converted to Category ({n_unique} unique)")
-                except Exception as e: app.logger.warning(f"AutoClean Error (Category Conv {col}): {e}")
-
-
-            # --- 6. Change Case (Configurable) ---
-            dtype_after_cat = str(df_cleaned[col].dtype)
-            if case_change_method != 'none' and \
-               (pd.api.types.is_object_dtype(dtype_after_cat) or pd.api.types.is_string_dtype(dtype_after_cat) or pd.api.types.is_categorical_dtype(dtype_after_cat)):
-                try:
-                    mask = df_cleaned[col].notna()
-                    if mask.any():
-                        changed = False
-                        if case_change_method == 'lower':
-                            if (df_cleaned.loc[mask, col].astype(str) != df_cleaned.loc[mask, col].astype(str).str.lower()).any():
-                                if pd.api.types.is_categorical_dtype(dtype_after_cat): df_cleaned[col].cat.rename_categories(str.lower, inplace=True)
-                                else: df_cleaned.loc[mask, col] = df_cleaned.loc[mask, col].astype(str).str.lower()
-                                changed = True
-                        elif case_change_method == 'upper':
-                            if (df_cleaned.loc[mask, col].astype(str) != df_cleaned.loc[mask, col].astype(str).str.upper()).any():
-                                if pd.api.types.is_categorical_dtype(dtype_after_cat): df_cleaned[col].cat.rename_categories(str.upper, inplace=True)
-                                else: df_cleaned.loc[mask, col] = df_cleaned.loc[mask, col].astype(str).str.upper()
-                                changed = True
-                        elif case_change_method == 'title':
-                            if (df_cleaned.loc[mask, col].astype(str) != df_cleaned.loc[mask, col].astype(str).str.title()).any():
-                                if pd.api.types.is_categorical_dtype(dtype_after_cat): df_cleaned[col].cat.rename_categories(str.title, inplace=True)
-                                else: df_cleaned.loc[mask, col] = df_cleaned.loc[mask, col].astype(str).str.title()
-                                changed = True
-                        if changed: col_actions.append(f"Converted to {case_change_method}case")
-                except Exception as e: app.logger.warning(f"AutoClean Error (Case Change {col}): {e}")
-
-            if col_actions:
-                actions_performed.append(f"Column '{col}' ({original_dtype_str} -> {str(df_cleaned[col].dtype)}): {'; '.join(col_actions)}")
-
-        # --- Global Row Removal for Outliers (Applied ONCE after loop) ---
-        if indices_to_drop_for_outliers:
-            original_row_count = len(df_cleaned)
-            # Ensure indices are valid and sorted to avoid issues with some backends if not unique
-            valid_indices_to_drop = sorted(list(set(indices_to_drop_for_outliers).intersection(df_cleaned.index)))
-            if valid_indices_to_drop:
-                df_cleaned.drop(index=valid_indices_to_drop, inplace=True)
-                rows_removed = original_row_count - len(df_cleaned)
-                if rows_removed > 0:
-                    actions_performed.append(f"Globally removed {rows_removed} row(s) containing identified outliers.")
-            else:
-                app.logger.info("No valid outlier indices found to drop after loop.")
+        # --- 4. Fill Missing Values (Configurable) ---
+        series_to_process = df_cleaned[col] # Get latest state of the column
+        current_dtype_after_outlier = str(series_to_process.dtype)
+        if series_to_process.isnull().any():
+            try:
+                # Ensure to use series_to_process and assign back to df_cleaned[col]
+                if pd.api.types.is_numeric_dtype(current_dtype_after_outlier) and not pd.api.types.is_bool_dtype(current_dtype_after_outlier):
+                    filled_series = series_to_process.copy()
+                    if missing_numeric_method == 'median':
+                        median_val = filled_series.median()
+                        if not pd.isna(median_val): filled_series.fillna(median_val, inplace=True); col_actions.append(f"Filled NA with Median ({median_val:.4g})")
+                    elif missing_numeric_method == 'mean':
+                        mean_val = filled_series.mean()
+                        if not pd.isna(mean_val): filled_series.fillna(mean_val, inplace=True); col_actions.append(f"Filled NA with Mean ({mean_val:.4g})")
+                    df_cleaned[col] = filled_series
+                elif missing_other_method == 'ffill_bfill':
+                    filled_series = series_to_process.copy()
+                    original_nulls = filled_series.isnull().sum()
+                    filled_series.fillna(method='ffill', inplace=True)
+                    filled_series.fillna(method='bfill', inplace=True)
+                    if filled_series.isnull().sum() < original_nulls: col_actions.append("Filled NA (ffill/bfill)")
+                    df_cleaned[col] = filled_series
+            except Exception as e: app.logger.warning(f"AutoClean Error (Missing Fill {col}): {e}")
+
+
+        # --- 5. Convert Low-Cardinality Strings to Category (Toggleable) ---
+        dtype_after_fill = str(df_cleaned[col].dtype)
+        if convert_category and (pd.api.types.is_object_dtype(dtype_after_fill) or pd.api.types.is_string_dtype(dtype_after_fill)) and \
+           not pd.api.types.is_categorical_dtype(dtype_after_fill):
+            try:
+                 n_unique = df_cleaned[col].nunique()
+                 # Using fixed thresholds from features page for consistency
+                 if n_unique / len(df_cleaned) < 0.02 or n_unique <= 10: # Example heuristic
+                     df_cleaned[col] = df_cleaned[col].astype('category')
+                     col_actions.append(f"Converted to Category ({n_unique} unique)")
+            except Exception as e: app.logger.warning(f"AutoClean Error (Category Conv {col}): {e}")
+
+
+        # --- 6. Change Case (Configurable) ---
+        dtype_after_cat = str(df_cleaned[col].dtype)
+        if case_change_method != 'none' and \
+           (pd.api.types.is_object_dtype(dtype_after_cat) or pd.api.types.is_string_dtype(dtype_after_cat) or pd.api.types.is_categorical_dtype(dtype_after_cat)):
+            try:
+                mask = df_cleaned[col].notna()
+                if mask.any():
+                    changed = False
+                    if case_change_method == 'lower':
+                        if (df_cleaned.loc[mask, col].astype(str) != df_cleaned.loc[mask, col].astype(str).str.lower()).any():
+                            if pd.api.types.is_categorical_dtype(dtype_after_cat): df_cleaned[col] = df_cleaned[col].cat.rename_categories(str.lower)
+                            else: df_cleaned.loc[mask, col] = df_cleaned.loc[mask, col].astype(str).str.lower()
+                            changed = True
+                    elif case_change_method == 'upper':
+                        if (df_cleaned.loc[mask, col].astype(str) != df_cleaned.loc[mask, col].astype(str).str.upper()).any():
+                            if pd.api.types.is_categorical_dtype(dtype_after_cat): df_cleaned[col] = df_cleaned[col].cat.rename_categories(str.upper)
+                            else: df_cleaned.loc[mask, col] = df_cleaned.loc[mask, col].astype(str).str.upper()
+                            changed = True
+                    elif case_change_method == 'title':
+                        if (df_cleaned.loc[mask, col].astype(str) != df_cleaned.loc[mask, col].astype(str).str.title()).any():
+                            if pd.api.types.is_categorical_dtype(dtype_after_cat): df_cleaned[col] = df_cleaned[col].cat.rename_categories(str.title)
+                            else: df_cleaned.loc[mask, col] = df_cleaned.loc[mask, col].astype(str).str.title()
+                            changed = True
+                    if changed: col_actions.append(f"Converted to {case_change_method}case")
+            except Exception as e: app.logger.warning(f"AutoClean Error (Case Change {col}): {e}")
+
+        if col_actions:
+            actions_performed.append(f"Column '{col}' ({original_dtype_str} -> {str(df_cleaned[col].dtype)}): {'; '.join(col_actions)}")
+
+    # --- Global Row Removal for Outliers (Applied ONCE after loop) ---
+    if indices_to_drop_for_outliers:
+        original_row_count = len(df_cleaned)
+        # Ensure indices are valid and sorted to avoid issues with some backends if not unique
+        valid_indices_to_drop = sorted(list(set(indices_to_drop_for_outliers).intersection(df_cleaned.index)))
+        if valid_indices_to_drop:
+            df_cleaned.drop(index=valid_indices_to_drop, inplace=True)
+            rows_removed = original_row_count - len(df_cleaned)
+            if rows_removed > 0:
+                actions_performed.append(f"Globally removed {rows_removed} row(s) containing identified outliers.")
+        else:
+            app.logger.info("No valid outlier indices found to drop after loop.")
+
+    return df_cleaned, actions_performed
+
+
+@app.route('/auto_clean', methods=['POST'])
+@login_required
+@dataset_mutation
+def auto_clean_data():
+    """
+    Applies a predefined set of non-destructive cleaning steps, including:
+    - Trims whitespace from string columns.
+    - Attempts conversion of object columns to numeric/datetime (errors='coerce').
+    - Clips outliers in numeric columns using IQR method (factor=1.5).
+    - Fills missing values based on type (median for numeric, ffill/bfill for others).
+    - Converts low-cardinality strings to Category.
+    - Converts string/category columns to lowercase.
+    """
+    # 1. Get DataFrame and add to undo
+    df = get_dataframe_from_session()
+    if df is None:
+        return jsonify({'error': 'No data loaded.'}), 400
+
+    cleared_redo = add_to_undo(get_current_dataset_version()) # Save state before cleaning
+
+    # --- Get Configurations ---
+    # Get from session, or use defaults if not set by the user
+    # If sending via POST request body: config = request.json.get('config', {})
+    config = session.get('auto_clean_config', {})
+
+    try:
+        df_cleaned, actions_performed = apply_auto_clean(df, config)
 
-        store_dataframe_in_session(df_cleaned)
+        store_dataframe_in_session(df_cleaned, step={'kind': 'auto_clean', 'config': config})
         summary_message = "Auto Clean with custom configuration complete."
         if actions_performed:
              actions_html = "<ul>" + "".join(f"<li>{action}</li>" for action in actions_performed) + "</ul>"
@@ -3077,22 +6307,17 @@ def auto_clean_data():
         else:
              summary_message += " No specific cleaning actions were applied based on the configuration."
 
-        table_html, total_rows, total_columns = render_table_html(df_cleaned)
         response_data = {
-            'message': summary_message, 'table_html': table_html,
-            'columns': df_cleaned.columns.tolist(), 'undo_redo_status': get_undo_redo_status(),
-            'total_rows': total_rows, 'total_columns': total_columns
+            'message': summary_message, 'undo_redo_status': get_undo_redo_status(),
+            'dataset_version': get_current_dataset_version(),
+            **build_grid_update(df_cleaned)
         }
         return jsonify(response_data), 200
 
     except Exception as e:
         app.logger.error(f"Error during Auto Clean: {e}", exc_info=True)
         # Attempt rollback (keep existing rollback logic)
-        undo_history = session.get('undo_history', [])
-        if undo_history:
-             last_good_state_json = undo_history.pop()
-             session['current_df_json'] = last_good_state_json
-             session['undo_history'] = undo_history
+        rollback_last_undo_entry(redo=cleared_redo)
         return jsonify({'error': f'An internal server error occurred during Auto Clean: {str(e)}'}), 500
     
 
@@ -3162,13 +6387,7 @@ def get_column_stats(column_name):
         stats['Unique Values (Excl. NaN)'] = unique_count_no_nan
 
         try:
-            mem_usage_bytes = selected_col.memory_usage(deep=True)
-            if mem_usage_bytes < 1024:
-                 stats['Memory Usage'] = f"{mem_usage_bytes} B"
-            elif mem_usage_bytes < 1024**2:
-                 stats['Memory Usage'] = f"{mem_usage_bytes/1024:.2f} KB"
-            else:
-                 stats['Memory Usage'] = f"{mem_usage_bytes/(1024**2):.2f} MB"
+            stats['Memory Usage'] = format_memory_size(selected_col.memory_usage(deep=True))
         except Exception:
              stats['Memory Usage'] = "N/A"
 
@@ -3294,8 +6513,42 @@ def get_column_stats(column_name):
         return jsonify({'error': f'Error calculating stats: {str(e)}'}), 500
 
 
+def apply_optimize_categories(df):
+    """
+    Converts low-cardinality text columns of a copy of df to 'category' and
+    returns (optimized_df, actions_performed).
+    """
+    actions_performed = []
+    df_optimized = df.copy() # Work on a copy
+
+    # Define thresholds (these could potentially be parameters later)
+    unique_fraction_threshold = 0.5 # e.g., less than 50% unique values
+    absolute_unique_threshold = 1000 # e.g., less than 1000 unique values absolute max
+
+    for col in df_optimized.columns:
+        dtype = df_optimized[col].dtype
+
+        # Check if it's a candidate type (object, string) and NOT already category
+        if (pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype)) and \
+           not pd.api.types.is_categorical_dtype(dtype):
+
+            n_unique = df_optimized[col].nunique()
+            fraction_unique = n_unique / len(df_optimized) if len(df_optimized) > 0 else 0
+
+            # Apply heuristic: low absolute unique count OR low fraction unique
+            if n_unique < absolute_unique_threshold and fraction_unique < unique_fraction_threshold:
+                try:
+                    df_optimized[col] = df_optimized[col].astype('category')
+                    actions_performed.append(f"Column '{col}' ({n_unique} unique)")
+                except Exception as e:
+                    app.logger.warning(f"Could not convert column '{col}' to category: {e}")
+
+    return df_optimized, actions_performed
+
+
 @app.route('/optimize_categories', methods=['POST'])
 @login_required
+@dataset_mutation
 def optimize_categories():
     """
     Converts string/object columns with low cardinality to 'category' dtype
@@ -3306,37 +6559,13 @@ def optimize_categories():
     if df is None:
         return jsonify({'error': 'No data loaded.'}), 400
 
-    current_df_json = session.get('current_df_json')
-    add_to_undo(current_df_json) # Save state before optimizing
-
-    actions_performed = []
-    df_optimized = df.copy() # Work on a copy
-
-    # Define thresholds (these could potentially be parameters later)
-    unique_fraction_threshold = 0.5 # e.g., less than 50% unique values
-    absolute_unique_threshold = 1000 # e.g., less than 1000 unique values absolute max
+    cleared_redo = add_to_undo(get_current_dataset_version()) # Save state before optimizing
 
     try:
-        for col in df_optimized.columns:
-            dtype = df_optimized[col].dtype
-
-            # Check if it's a candidate type (object, string) and NOT already category
-            if (pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype)) and \
-               not pd.api.types.is_categorical_dtype(dtype):
-
-                n_unique = df_optimized[col].nunique()
-                fraction_unique = n_unique / len(df_optimized) if len(df_optimized) > 0 else 0
-
-                # Apply heuristic: low absolute unique count OR low fraction unique
-                if n_unique < absolute_unique_threshold and fraction_unique < unique_fraction_threshold:
-                    try:
-                        df_optimized[col] = df_optimized[col].astype('category')
-                        actions_performed.append(f"Column '{col}' ({n_unique} unique)")
-                    except Exception as e:
-                        app.logger.warning(f"Could not convert column '{col}' to category: {e}")
+        df_optimized, actions_performed = apply_optimize_categories(df)
 
         # 4. Store modified DataFrame and prepare response
-        store_dataframe_in_session(df_optimized)
+        store_dataframe_in_session(df_optimized, step={'kind': 'optimize_categories'})
 
         if actions_performed:
             summary_message = f"Optimized Categories complete. Converted columns: {', '.join(actions_performed)}."
@@ -3345,20 +6574,16 @@ def optimize_categories():
 
         response_data = {
             'message': summary_message,
-            'table_html': render_table_html(df_optimized),
-            'columns': df_optimized.columns.tolist(), # Columns don't change, but type does
-            'undo_redo_status': get_undo_redo_status()
+            'undo_redo_status': get_undo_redo_status(),
+            'dataset_version': get_current_dataset_version(),
+            **build_grid_update(df_optimized) # Columns don't change, but type does
         }
         return jsonify(response_data), 200
 
     except Exception as e:
         app.logger.error(f"Error during Optimize Categories: {e}", exc_info=True)
         # Attempt rollback
-        undo_history = session.get('undo_history', [])
-        if undo_history:
-             last_good_state_json = undo_history.pop()
-             session['current_df_json'] = last_good_state_json
-             session['undo_history'] = undo_history
+        rollback_last_undo_entry(redo=cleared_redo)
         return jsonify({'error': f'An internal server error occurred during Optimize Categories: {str(e)}'}), 500
 
 
@@ -3366,77 +6591,141 @@ def optimize_categories():
 
 @app.route('/undo', methods=['POST'])
 @login_required
+@dataset_mutation
 def undo():
     """Reverts to the previous state."""
-    current_df_json = session.get('current_df_json')
-    undo_history = session.get('undo_history', [])
-    redo_history = session.get('redo_history', [])
+    started = time.perf_counter()
+    state = load_dataset_state()
 
-    if not undo_history:
+    if not state['undo']:
         return jsonify({'error': 'Nothing to undo'}), 400
 
     # Move current state to redo
-    if current_df_json:
-        redo_history.insert(0, current_df_json) # Add to beginning of redo list
+    if state['version'] is not None:
+        state['redo'].insert(0, state['version']) # Add to beginning of redo list
 
     # Get last state from undo
-    last_state_json = undo_history.pop()
-
-    # Update session
-    session['current_df_json'] = last_state_json
-    session['undo_history'] = undo_history
-    session['redo_history'] = redo_history[-10:] # Limit redo history size
+    state['version'] = state['undo'].pop()
+    state['redo'] = state['redo'][:app.config['HISTORY_MAX_STEPS']] # Limit redo history size (newest first)
+    save_dataset_state(state)
 
     # Load DF and prepare response
-    df = get_dataframe_from_session()
+    df = load_grid_frame()
+    record_history_timing('undo', state['version'], started)
+    prune_dataset_versions(state) # Keep the hot window around the new position
 
-    table_html, total_rows, total_columns = render_table_html(df)
+    grid = build_grid_payload(df)
 
     response_data = {
         'message': 'Undo successful.',
-        'table_html': render_table_html(df),
-        'columns': df.columns.tolist() if df is not None else [],
+        'grid': grid,
+        'columns': grid_column_names(df),
         'undo_redo_status': get_undo_redo_status(),
-        'total_rows': total_rows,
-        'total_columns': total_columns
+        'dataset_version': get_current_dataset_version(),
+        'total_rows': grid['total_rows'],
+        'total_columns': grid['total_columns']
     }
     return jsonify(response_data)
 
 @app.route('/redo', methods=['POST'])
 @login_required
+@dataset_mutation
 def redo():
     """Re-applies a previously undone state."""
-    current_df_json = session.get('current_df_json')
-    undo_history = session.get('undo_history', [])
-    redo_history = session.get('redo_history', [])
+    started = time.perf_counter()
+    state = load_dataset_state()
 
-    if not redo_history:
+    if not state['redo']:
         return jsonify({'error': 'Nothing to redo'}), 400
 
     # Move current state to undo
-    if current_df_json:
-        undo_history.append(current_df_json)
+    if state['version'] is not None:
+        state['undo'].append(state['version'])
 
     # Get first state from redo
-    next_state_json = redo_history.pop(0) # Get from beginning
-
-    # Update session
-    session['current_df_json'] = next_state_json
-    session['undo_history'] = undo_history[-10:] # Limit undo history size
-    session['redo_history'] = redo_history
+    state['version'] = state['redo'].pop(0) # Get from beginning
+    state['undo'] = state['undo'][-app.config['HISTORY_MAX_STEPS']:] # Limit undo history size
+    save_dataset_state(state)
 
     # Load DF and prepare response
-    df = get_dataframe_from_session()
+    df = load_grid_frame()
+    record_history_timing('redo', state['version'], started)
+    prune_dataset_versions(state) # Drops a trimmed undo entry and keeps the hot window current
 
-    table_html, total_rows, total_columns = render_table_html(df)
+    grid = build_grid_payload(df)
 
     response_data = {
         'message': 'Redo successful.',
-        'table_html': render_table_html(df),
-        'columns': df.columns.tolist() if df is not None else [],
+        'grid': grid,
+        'columns': grid_column_names(df),
         'undo_redo_status': get_undo_redo_status(),
-        'total_rows': total_rows,
-        'total_columns': total_columns
+        'dataset_version': get_current_dataset_version(),
+        'total_rows': grid['total_rows'],
+        'total_columns': grid['total_columns']
+    }
+    return jsonify(response_data)
+
+@app.route('/history', methods=['GET'])
+@login_required
+def get_history():
+    """Lists the versions reachable through undo/redo, oldest first."""
+    handle = get_dataset_handle()
+    state = load_dataset_state()
+    if not handle or state['version'] is None:
+        return jsonify({'versions': []})
+    timeline = state['undo'] + [state['version']] + state['redo']
+    log = read_history_log(handle['store_id'])
+    versions = []
+    for version in timeline:
+        entry = log.get(version) or {}
+        manifest = read_dataset_manifest(handle['store_id'], version) or {}
+        rows, cols = manifest.get('shape') or entry.get('shape') or [None, None]
+        step = entry.get('step') or {}
+        versions.append({
+            'version': version, 'rows': rows, 'columns': cols,
+            'operation': step.get('operation', step.get('kind')),
+            'checkpoint': bool(manifest),
+            'current': version == state['version']
+        })
+    return jsonify({'versions': versions})
+
+@app.route('/jump_to_version', methods=['POST'])
+@login_required
+@dataset_mutation
+def jump_to_version():
+    """Makes any version in the undo/redo timeline current in one step."""
+    started = time.perf_counter()
+    try:
+        target = int((request.get_json() or {}).get('version'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'A numeric "version" is required.'}), 400
+
+    state = load_dataset_state()
+    timeline = state['undo'] + [state['version']] + state['redo']
+    if state['version'] is None or target not in timeline:
+        return jsonify({'error': f'Version {target} is not in the history.'}), 400
+
+    # Only the pointers move; versions share their column files, so nothing is copied
+    position = timeline.index(target)
+    state['undo'] = timeline[:position]
+    state['version'] = target
+    state['redo'] = timeline[position + 1:]
+    save_dataset_state(state)
+
+    df = load_grid_frame()
+    record_history_timing('jump', target, started)
+    prune_dataset_versions(state)
+
+    grid = build_grid_payload(df)
+
+    response_data = {
+        'message': f'Jumped to version {target}.',
+        'grid': grid,
+        'columns': grid_column_names(df),
+        'undo_redo_status': get_undo_redo_status(),
+        'dataset_version': get_current_dataset_version(),
+        'total_rows': grid['total_rows'],
+        'total_columns': grid['total_columns']
     }
     return jsonify(response_data)
 
@@ -3446,7 +6735,7 @@ def redo():
 @app.route('/download/<filetype>')
 @login_required
 def download_file(filetype):
-    """Downloads the current DataFrame as CSV or XLSX."""
+    """Downloads the current DataFrame as CSV, XLSX or an Arrow IPC stream (optionally a row slice)."""
     df = get_dataframe_from_session()
     if df is None:
         flash("No data to download.", "error")
@@ -3465,6 +6754,14 @@ def download_file(filetype):
             df.to_excel(buffer, index=False, engine='openpyxl')
             mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
             filename += '.xlsx'
+        elif filetype == 'arrow':
+            # Typed columns in record batches; ?offset=&limit= exports just a slice
+            offset = max(0, request.args.get('offset', 0, type=int))
+            limit = request.args.get('limit', type=int)
+            table = dataframe_to_arrow(df.iloc[offset:offset + limit if limit else None])
+            buffer.write(arrow_ipc_stream(table, max_chunksize=64 * 1024))
+            mimetype = ARROW_STREAM_MIMETYPE
+            filename += '.arrows'
         else:
             flash("Invalid file type for download.", "error")
             return redirect(url_for('clean_data_interface'))
@@ -3515,6 +6812,7 @@ def save_session():
 # In open_saved_session function:
 @app.route('/open_saved/<filename>')
 @login_required
+@dataset_mutation
 def open_saved_session(filename):
     """Loads a previously saved DataFrame session from a Parquet file.""" # Docstring updated
     safe_filename = secure_filename(filename)
@@ -3529,7 +6827,7 @@ def open_saved_session(filename):
         return redirect(url_for('index'))
 
     try:
-        df = pd.read_parquet(filepath) # CHANGED from read_pickle
+        df = arrow_table_to_pandas(pq.read_table(filepath, memory_map=True)) # CHANGED from read_pickle
         clear_session_data()
         store_dataframe_in_session(df)
         base_name, _ = os.path.splitext(safe_filename)
@@ -4756,6 +8054,8 @@ def open_browser():
     webbrowser.open_new(url)
 
 if __name__ == '__main__':
+    # Workbook sheets are read in worker processes; needed when running as a frozen executable
+    multiprocessing.freeze_support()
     from waitress import serve
 
     # Configure the standard Python logger to show messages in the console
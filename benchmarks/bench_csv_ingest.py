@@ -0,0 +1,97 @@
+"""
+CSV ingest: the original parse (pd.read_csv with sep=None and the python
+engine) against ingest_delimited_stream (dialect sniffed from a sample, one
+pass of Arrow's multi-threaded CSV reader, column files written). Each run
+happens in its own process so peak memory is per parser. The old parser is
+skipped for files above --baseline-max-mb, as it needs several times the
+file size in memory.
+
+    python benchmarks/bench_csv_ingest.py --size-mb 100 1024
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from common import format_bytes, import_app
+
+
+def write_csv(path, size_mb):
+    """Writes a 6-column mixed-type CSV of about size_mb megabytes."""
+    rng = np.random.default_rng(0)
+    target, chunk_rows, start = size_mb * 1024 * 1024, 500_000, 0
+    with open(path, 'w', newline='') as f:
+        while f.tell() < target:
+            pd.DataFrame({
+                'id': np.arange(start, start + chunk_rows),
+                'amount': np.round(rng.random(chunk_rows) * 10_000, 2),
+                'city': rng.choice(['Paris', 'Berlin', 'Rome', 'New York, NY'], chunk_rows),
+                'name': rng.choice(['alice', 'bob', 'carol', 'dave', ''], chunk_rows),
+                'when': pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.integers(0, 10**8, chunk_rows), unit='s'),
+                'flag': rng.random(chunk_rows) < 0.5,
+            }).to_csv(f, index=False, header=start == 0)
+            start += chunk_rows
+
+
+def run_old(path):
+    df = pd.read_csv(path, sep=None, engine='python')
+    if df.shape[1] == 1: # The old upload_file retried with the C engine
+        df = pd.read_csv(path)
+    return df.shape
+
+
+def run_new(path):
+    app = import_app()
+    store_id = f"bench-{uuid.uuid4().hex[:8]}"
+    with app.app.app_context(), open(path, 'rb') as f:
+        manifest = app.ingest_delimited_stream(store_id, f)
+    app.delete_dataset_store(store_id)
+    return tuple(manifest['shape'])
+
+
+def measure(parser, path):
+    """Runs one parser in a child process; returns (seconds, peak RSS bytes, shape)."""
+    output = subprocess.run([sys.executable, __file__, '--child', parser, path],
+                            check=True, capture_output=True, text=True).stdout.split()
+    return float(output[-4]), int(output[-3]), (int(output[-2]), int(output[-1]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size-mb', type=int, nargs='+', default=[100, 1024])
+    parser.add_argument('--baseline-max-mb', type=int, default=256)
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        which, path = args.child
+        started = time.perf_counter()
+        shape = (run_old if which == 'old' else run_new)(path)
+        elapsed = time.perf_counter() - started
+        print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, *shape)
+        return
+
+    print(f"{os.cpu_count()} CPU(s)")
+    print(f"{'file':>10} {'rows':>12} {'parser':>7} {'time':>9} {'MB/s':>7} {'peak RSS':>10}")
+    for size_mb in args.size_mb:
+        with tempfile.TemporaryDirectory(prefix='datawarp-bench-csv-') as folder:
+            path = os.path.join(folder, 'data.csv')
+            write_csv(path, size_mb)
+            file_mb = os.path.getsize(path) / 1024 / 1024
+            for which in ('old', 'new'):
+                if which == 'old' and size_mb > args.baseline_max_mb:
+                    print(f"{file_mb:8.0f}MB {'':>12} {which:>7} {'skipped':>9}")
+                    continue
+                seconds, peak, (rows, _) = measure(which, path)
+                print(f"{file_mb:8.0f}MB {rows:12,} {which:>7} {seconds:8.2f}s {file_mb / seconds:7.1f} {format_bytes(peak):>10}")
+
+
+if __name__ == '__main__':
+    main()
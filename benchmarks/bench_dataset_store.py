@@ -0,0 +1,78 @@
+"""
+Dataset persistence: the original JSON round trip (to_json/read_json with
+orient='split') against the Arrow dataset store, on a frame holding the
+dtypes cleaning steps produce. Reports write and load time, bytes on disk,
+memory of the loaded frame and how many column dtypes survived.
+
+    python benchmarks/bench_dataset_store.py --rows 1000000
+"""
+import argparse
+import io
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from common import best_of, folder_bytes, format_bytes, import_app
+
+
+def make_frame(rows):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        'id': np.arange(rows, dtype=np.int64),
+        'amount': rng.random(rows) * 1000,
+        'qty': pd.array(rng.integers(0, 50, rows), dtype='Int64'),
+        'flag': pd.array(rng.random(rows) < 0.5, dtype='boolean'),
+        'city': pd.Categorical(rng.choice(['Paris', 'Berlin', 'Rome', 'Madrid'], rows)),
+        'name': rng.choice(['alice', 'bob', 'carol', 'dave', 'erin'], rows).astype(object),
+        'when': pd.date_range('2020-01-01', periods=rows, freq='min', tz='UTC'),
+    })
+
+
+def json_write(df):
+    return df.to_json(orient='split', date_format='iso', default_handler=str)
+
+
+def json_load(payload):
+    return pd.read_json(io.StringIO(payload), orient='split')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    app = import_app()
+    df = make_frame(args.rows)
+    memory = int(df.memory_usage(deep=True).sum())
+    print(f"{args.rows:,} rows, {df.shape[1]} columns, {format_bytes(memory)} in memory")
+
+    json_write_s, payload = best_of(args.repeat, json_write, df)
+    json_load_s, from_json = best_of(args.repeat, json_load, payload)
+    json_dtypes = sum(str(a) == str(b) for a, b in zip(from_json.dtypes, df.dtypes))
+
+    store_id = f"bench-{uuid.uuid4().hex[:8]}"
+    def store_write():
+        app.delete_dataset_store(store_id)
+        return app.write_dataset_version(store_id, 1, df)
+    def store_load():
+        app.dataframe_cache.discard_store(store_id) # Measure the read, not the cache
+        return app.load_dataset_version(store_id, 1)
+    store_write_s, _ = best_of(args.repeat, store_write)
+    store_load_s, from_store = best_of(args.repeat, store_load)
+    store_dtypes = sum(str(a) == str(b) for a, b in zip(from_store.dtypes, df.dtypes))
+    store_bytes = folder_bytes(app.get_dataset_store_dir(store_id))
+
+    print(f"{'':8} {'write':>9} {'load':>9} {'on disk':>11} {'loaded':>11} dtypes kept")
+    for label, write_s, load_s, disk, loaded, kept in (
+        ('json', json_write_s, json_load_s, len(payload.encode()), from_json, json_dtypes),
+        ('store', store_write_s, store_load_s, store_bytes, from_store, store_dtypes),
+    ):
+        loaded_bytes = int(loaded.memory_usage(deep=True).sum())
+        print(f"{label:8} {write_s:8.3f}s {load_s:8.3f}s {format_bytes(disk):>11} {format_bytes(loaded_bytes):>11} {kept}/{df.shape[1]}")
+    app.delete_dataset_store(store_id)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Bytes on the wire and server CPU time for one grid page: the original
+to_html table and the JSON grid page, plus the typed Arrow export of the
+same rows (/download/arrow).
+
+    python benchmarks/bench_grid_transport.py --rows 10000 --columns 20
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from common import format_bytes, import_app
+
+
+def make_frame(rows, columns):
+    rng = np.random.default_rng(0)
+    makers = [
+        lambda: rng.integers(0, 1_000_000, rows),
+        lambda: rng.random(rows) * 1000,
+        lambda: rng.choice(['alpha', 'beta', 'gamma', 'delta', None], rows),
+        lambda: pd.Categorical(rng.choice(['Paris', 'Berlin', 'Rome'], rows)),
+        lambda: pd.date_range('2020-01-01', periods=rows, freq='min', tz='UTC'),
+    ]
+    return pd.DataFrame({f'col{i}': makers[i % len(makers)]() for i in range(columns)})
+
+
+def cpu_best_of(repeat, func):
+    """(fastest CPU time in seconds, result of the last call)."""
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        started = time.process_time()
+        result = func()
+        best = min(best, time.process_time() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=10_000)
+    parser.add_argument('--columns', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app = import_app()
+    df = make_frame(args.rows, args.columns)
+    print(f"{args.rows:,}-row page, {args.columns} columns")
+    formats = {
+        'to_html': lambda: df.to_html(index=False, na_rep='').encode(),
+        'JSON grid page': lambda: json.dumps(app.get_grid_page(df, offset=0, limit=args.rows)).encode(),
+        'Arrow export (typed)': lambda: app.arrow_ipc_stream(app.dataframe_to_arrow(df)),
+    }
+    app.app.config['GRID_MAX_PAGE_SIZE'] = max(app.app.config['GRID_MAX_PAGE_SIZE'], args.rows)
+    print(f"{'':22} {'bytes':>10} {'CPU':>9}")
+    with app.app.test_request_context(): # Grid pages read the session's view settings
+        for label, render in formats.items():
+            cpu, body = cpu_best_of(args.repeat, render)
+            print(f"{label:22} {format_bytes(len(body)):>10} {cpu:8.3f}s")
+
+
+if __name__ == '__main__':
+    main()
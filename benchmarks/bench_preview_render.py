@@ -0,0 +1,53 @@
+"""
+Table preview rendering: the original path (head().copy(), an inserted '#'
+column and DataFrame.to_html) against render_table_html's column-wise
+renderer, on the preview's 999 rows. Checks that both produce the same markup.
+
+    python benchmarks/bench_preview_render.py --columns 100
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from common import best_of, import_app
+
+
+def make_frame(rows, columns, kinds):
+    rng = np.random.default_rng(0)
+    makers = {
+        'float': lambda: np.where(rng.random(rows) < 0.05, np.nan, rng.random(rows) * 1000),
+        'int': lambda: rng.integers(-1000, 1_000_000, rows),
+        'text': lambda: rng.choice(['alpha', 'beta & co', '<gamma>', 'delta', None], rows),
+        'datetime': lambda: pd.date_range('2020-01-01', periods=rows, freq='min'),
+        'category': lambda: pd.Categorical(rng.choice(['Paris', 'Berlin', 'Rome'], rows)),
+    }
+    return pd.DataFrame({f'col{i}': makers[kinds[i % len(kinds)]]() for i in range(columns)})
+
+
+def to_html_preview(app, df, max_rows=999):
+    """render_table_html as it was before the column-wise renderer."""
+    display_df = df.head(max_rows).copy()
+    display_df.insert(0, '#', range(1, len(display_df) + 1), allow_duplicates=True)
+    return display_df.to_html(classes=app.PREVIEW_TABLE_CLASSES, index=False, border=0, escape=True, na_rep='')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=999)
+    parser.add_argument('--columns', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    app = import_app()
+    print(f"{args.rows} rows x {args.columns} columns")
+    print(f"{'columns':32} {'to_html':>9} {'renderer':>9} {'speedup':>8} same markup")
+    for kinds in (['float', 'int', 'text'], ['float'], ['int', 'text'], ['float', 'int', 'text', 'datetime', 'category']):
+        df = make_frame(args.rows, args.columns, kinds)
+        old_s, old_html = best_of(args.repeat, to_html_preview, app, df)
+        new_s, (new_html, _, _) = best_of(args.repeat, app.render_table_html, df)
+        print(f"{'/'.join(kinds):32} {old_s:8.3f}s {new_s:8.3f}s {old_s / new_s:7.1f}x {new_html == old_html}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Latency of requests that never touch the data (status polling, config
+lookups, login checks) as the loaded dataset grows. The dataset lives in the
+dataset store and the session only holds a reference, so these should stay
+flat. For comparison, the same requests are timed with the old layout's
+payload (the frame as JSON plus one undo copy) carried in the session file.
+
+    python benchmarks/bench_session_routes.py --rows 10000 100000 1000000
+"""
+import argparse
+import statistics
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from common import import_app, logged_in_client
+
+ROUTES = ['/update-status', '/get_auto_clean_config', '/dataset_cache_stats']
+
+
+def make_frame(rows):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        'id': np.arange(rows),
+        'amount': rng.random(rows) * 1000,
+        'city': rng.choice(['Paris', 'Berlin', 'Rome', 'Madrid'], rows),
+        'name': rng.choice(['alice', 'bob', 'carol', 'dave'], rows),
+        'when': pd.date_range('2020-01-01', periods=rows, freq='min'),
+    })
+
+
+def load_into_session(app, client, df, legacy_payload):
+    store_id = f"bench-{uuid.uuid4().hex[:8]}"
+    app.write_dataset_version(store_id, 1, df)
+    app._write_json_atomic(app.get_dataset_state_path(store_id), {'version': 1, 'latest': 1, 'undo': [], 'redo': []})
+    with client.session_transaction() as sess:
+        sess['dataset_handle'] = {'store_id': store_id}
+        if legacy_payload:
+            payload = df.to_json(orient='split', date_format='iso', default_handler=str)
+            sess['legacy_payload'] = [payload, payload] # Current frame plus one undo copy
+    return store_id
+
+
+def median_ms(client, route, requests):
+    timings = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = client.get(route)
+        timings.append(time.perf_counter() - started)
+        assert response.status_code == 200, (route, response.status_code)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--requests', type=int, default=50)
+    args = parser.parse_args()
+
+    app = import_app()
+    print(f"median of {args.requests} requests, ms")
+    print(f"{'rows':>10} {'session':>8} " + ' '.join(f"{route:>24}" for route in ROUTES))
+    for rows in args.rows:
+        df = make_frame(rows)
+        for label, legacy in (('store', False), ('legacy', True)):
+            client = logged_in_client(app)
+            store_id = load_into_session(app, client, df, legacy)
+            timings = [median_ms(client, route, args.requests) for route in ROUTES]
+            print(f"{rows:>10,} {label:>8} " + ' '.join(f"{ms:24.2f}" for ms in timings))
+            app.delete_dataset_store(store_id)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+XLSX ingest: the original upload (pd.read_excel on the whole file, first
+sheet only, sheet list unknown) against the staged path. The staged path
+lists the sheets and their row counts from workbook metadata
+(describe_workbook), then reads the picked sheets in worker processes
+(read_workbook_sheets). Reading every sheet in one process with
+read_excel(sheet_name=None) is shown for comparison.
+
+    python benchmarks/bench_workbook_ingest.py --size-mb 50 --sheets 4
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+from common import import_app
+
+
+def write_workbook(path, sheets, rows):
+    """Writes `sheets` sheets of `rows` mixed-type rows each, streamed with openpyxl's write-only mode."""
+    rng = np.random.default_rng(0)
+    workbook = openpyxl.Workbook(write_only=True)
+    cities = ['Paris', 'Berlin', 'Rome', 'New York']
+    for s in range(sheets):
+        sheet = workbook.create_sheet(f'Sheet{s + 1}')
+        sheet.append(['id', 'amount', 'city', 'qty', 'ratio', 'code'])
+        amounts, qtys, ratios = np.round(rng.random(rows) * 10_000, 2), rng.integers(0, 1000, rows), rng.random(rows)
+        picks = rng.integers(0, len(cities), rows)
+        for i in range(rows):
+            sheet.append([i, float(amounts[i]), cities[picks[i]], int(qtys[i]), float(ratios[i]), f'C{i % 9973:05d}'])
+    workbook.save(path)
+    add_dimensions(path, f'A1:F{rows + 1}')
+
+
+def add_dimensions(path, ref):
+    """Adds the <dimension> element Excel writes (openpyxl's write-only mode leaves it out) to every sheet."""
+    patched = path + '.tmp'
+    with zipfile.ZipFile(path) as source, zipfile.ZipFile(patched, 'w', zipfile.ZIP_DEFLATED) as target:
+        for item in source.infolist():
+            with source.open(item) as src, target.open(item.filename, 'w', force_zip64=True) as dst:
+                if item.filename.startswith('xl/worksheets/'):
+                    head = src.read(4096)
+                    dst.write(head.replace(b'</sheetPr>', f'</sheetPr><dimension ref="{ref}"/>'.encode(), 1))
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+    os.replace(patched, path)
+
+
+def timed(func, *args, **kwargs):
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size-mb', type=float, default=50)
+    parser.add_argument('--sheets', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=4, help='also read all sheets with this many workers')
+    args = parser.parse_args()
+
+    app = import_app()
+    with tempfile.TemporaryDirectory(prefix='datawarp-bench-xlsx-') as folder:
+        # Size the workbook from a small one
+        probe = os.path.join(folder, 'probe.xlsx')
+        write_workbook(probe, 1, 20_000)
+        rows = int(20_000 * args.size_mb * 1024 * 1024 / os.path.getsize(probe) / args.sheets)
+        path = os.path.join(folder, 'book.xlsx')
+        write_workbook(path, args.sheets, rows)
+        print(f"{os.path.getsize(path) / 1024 / 1024:.1f} MB workbook, {args.sheets} sheets x {rows:,} rows, "
+              f"{os.cpu_count()} CPU(s), engine {app.XLSX_ENGINE}")
+
+        seconds, df = timed(pd.read_excel, path)
+        print(f"{'old: read_excel, first sheet':44} {seconds:8.2f}s  {len(df):,} rows")
+        seconds, sheets = timed(app.describe_workbook, path)
+        print(f"{'new: list sheets (describe_workbook)':44} {seconds:8.3f}s  "
+              f"{', '.join(str(s['rows']) for s in sheets)} rows")
+        seconds, (df,) = timed(app.read_workbook_sheets, path, [sheets[0]['name']])
+        print(f"{'new: read the first sheet':44} {seconds:8.2f}s  {len(df):,} rows")
+        names = [s['name'] for s in sheets]
+        seconds, frames = timed(pd.read_excel, path, sheet_name=None)
+        print(f"{'read_excel(sheet_name=None), all sheets':44} {seconds:8.2f}s  {sum(map(len, frames.values())):,} rows")
+        for workers in sorted({app.app.config['XLSX_SHEET_WORKERS'], args.workers}):
+            app.app.config['XLSX_SHEET_WORKERS'] = workers
+            seconds, frames = timed(app.read_workbook_sheets, path, names)
+            label = f"new: read all sheets, {workers} worker(s)"
+            print(f"{label:44} {seconds:8.2f}s  {sum(map(len, frames)):,} rows")
+
+
+if __name__ == '__main__':
+    main()
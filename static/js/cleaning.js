@@ -18,6 +18,11 @@ document.addEventListener('DOMContentLoaded', () => {
     const autoCleanBtn = document.getElementById('auto-clean-btn');
     const optimizeCategoriesBtn = document.getElementById('optimize-categories-btn');
 
+    // Version of the dataset this page is showing; sent with every action so the
+    // server can reject changes made against data another tab has since replaced.
+    let datasetVersion = tableContainer && tableContainer.dataset.datasetVersion !== ''
+        ? Number(tableContainer.dataset.datasetVersion) : null;
+
     const outlierColumnSelect = document.getElementById('outlier-column');
     const outlierMethodSelect = document.getElementById('outlier-method-select');
     const outlierIqrControls = document.getElementById('outlier-iqr-controls');
@@ -91,6 +96,8 @@ document.addEventListener('DOMContentLoaded', () => {
     const searchSuggestionsDatalist = document.getElementById('search-suggestions');
     const clearSearchBtn = document.getElementById('clear-search-btn');
     const searchStatusMessage = document.getElementById('search-status-message');
+    const sortStatusMessage = document.getElementById('sort-status-message');
+    const clearSortBtn = document.getElementById('clear-sort-btn');
 
     // --- Formula Bar DOM Elements ---
     const formulaSelect = document.getElementById('formula-select');
@@ -179,19 +186,239 @@ document.addEventListener('DOMContentLoaded', () => {
         displayToast(errorMsg, 'error');
     }
 
-    function updateTableAndStatus(data, modalToHide = null) {
-        if (data.table_html && tableContainer) {
-            if (Array.isArray(data.table_html) && data.table_html.length > 0) {
-                 tableContainer.innerHTML = data.table_html[0];
-                 if (rowCountSpan && data.table_html.length > 1) {
-                     rowCountSpan.textContent = `Rows: ${data.table_html[1]}`;
-                 }
-                 if (colCountSpan && data.table_html.length > 2) {
-                     colCountSpan.textContent = `Columns: ${data.table_html[2]}`;
-                 }
-            } else if (typeof data.table_html === 'string') {
-                tableContainer.innerHTML = data.table_html;
+    // ==================================================
+    // --- Virtualized Data Grid ---
+    // ==================================================
+    // Only the rows in view (plus some overscan) exist in the DOM. Rows come from
+    // /grid one page at a time and are cached by row number; operation responses
+    // either replace the grid or patch the cached rows in place.
+    const GRID_OVERSCAN_ROWS = 20;
+    const GRID_MAX_CACHED_ROWS = 10000;
+    const grid = {
+        columns: [], totalRows: 0, pageSize: 200, version: null,
+        rows: new Map(), pending: new Set(), rowHeight: 0,
+        tbody: null, headHeight: 0, generation: 0, renderQueued: false
+    };
+
+    function escapeHtml(value) {
+        return String(value)
+            .replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;')
+            .replace(/"/g, '&quot;').replace(/'/g, '&#39;');
+    }
+
+    function cacheGridRows(offset, rows) {
+        rows.forEach((cells, k) => {
+            grid.rows.delete(offset + k); // Re-insert so the row counts as recently used
+            grid.rows.set(offset + k, cells);
+        });
+        while (grid.rows.size > GRID_MAX_CACHED_ROWS) {
+            grid.rows.delete(grid.rows.keys().next().value);
+        }
+    }
+
+    function loadGrid(meta, adoptRenderedRows = false) {
+        if (!tableContainer || !meta) return;
+        grid.columns = meta.columns || [];
+        grid.totalRows = meta.total_rows || 0;
+        grid.pageSize = meta.page_size || grid.pageSize;
+        grid.version = meta.version;
+        grid.rows = new Map();
+        grid.pending = new Set();
+        grid.generation += 1; // Responses for an older dataset/search are dropped
+
+        if (adoptRenderedRows) {
+            // The server already rendered the first page; reuse it instead of fetching it again
+            const renderedRows = Array.from(tableContainer.querySelectorAll('tbody > tr'))
+                .map(tr => Array.from(tr.cells).slice(1).map(td => td.textContent));
+            cacheGridRows(0, renderedRows);
+        } else if (meta.rows && meta.rows.length) {
+            cacheGridRows(meta.offset || 0, meta.rows);
+        }
+        buildGridTable();
+    }
+
+    async function reloadGrid() {
+        grid.generation += 1;
+        try {
+            const response = await fetch(`/grid?offset=0&limit=${grid.pageSize}`, { headers: { 'Accept': 'application/json' } });
+            const data = await response.json();
+            if (!response.ok) throw { errorData: data, status: response.status };
+            loadGrid(data);
+        } catch (errorInfo) {
+            handleError(errorInfo.errorData || errorInfo, errorInfo.status);
+        }
+    }
+
+    function buildGridTable() {
+        if (!grid.totalRows || !grid.columns.length) {
+            grid.tbody = null;
+            tableContainer.innerHTML = "<p class='text-center text-muted p-4'>No data to display or data is empty.</p>";
+            return;
+        }
+        const headerCells = ['#'].concat(grid.columns).map(col => `<th>${escapeHtml(col)}</th>`).join('');
+        tableContainer.innerHTML = `<table class="dataframe table table-bordered table-hover table-sm">` +
+            `<thead><tr style="text-align: right;">${headerCells}</tr></thead><tbody></tbody></table>`;
+        activeColumnHeader = null;
+        grid.tbody = tableContainer.querySelector('tbody');
+        grid.headHeight = tableContainer.querySelector('thead').offsetHeight;
+        renderGridRows();
+    }
+
+    function gridWindow() {
+        const rowHeight = grid.rowHeight || 29;
+        const scrollTop = Math.max(0, tableContainer.scrollTop - grid.headHeight);
+        const first = Math.max(0, Math.floor(scrollTop / rowHeight) - GRID_OVERSCAN_ROWS);
+        const last = Math.min(grid.totalRows, Math.ceil((scrollTop + tableContainer.clientHeight) / rowHeight) + GRID_OVERSCAN_ROWS);
+        return [first, Math.max(first, last)];
+    }
+
+    function spacerRow(height) {
+        return `<tr class="grid-spacer"><td colspan="${grid.columns.length + 1}" style="height: ${height}px;"></td></tr>`;
+    }
+
+    function renderGridRows() {
+        grid.renderQueued = false;
+        if (!grid.tbody) return;
+        const rowHeight = grid.rowHeight || 29;
+        const [first, last] = gridWindow();
+
+        const html = [spacerRow(first * rowHeight)];
+        for (let i = first; i < last; i++) {
+            const cells = grid.rows.get(i);
+            if (!cells || cells.includes(undefined)) fetchGridPage(Math.floor(i / grid.pageSize));
+            html.push(`<tr><td>${i + 1}</td>`);
+            for (let c = 0; c < grid.columns.length; c++) {
+                html.push(`<td>${cells && cells[c] !== undefined ? escapeHtml(cells[c]) : ''}</td>`);
+            }
+            html.push('</tr>');
+        }
+        html.push(spacerRow((grid.totalRows - last) * rowHeight));
+        grid.tbody.innerHTML = html.join('');
+
+        if (!grid.rowHeight && last > first) {
+            // Measure once with real content, then lay out again with the true height
+            const sample = grid.tbody.rows[1];
+            if (sample && sample.offsetHeight) {
+                grid.rowHeight = sample.offsetHeight;
+                if (grid.rowHeight !== rowHeight) renderGridRows();
+            }
+        }
+    }
+
+    function scheduleGridRender() {
+        if (grid.renderQueued) return;
+        grid.renderQueued = true;
+        requestAnimationFrame(renderGridRows);
+    }
+
+    async function fetchGridPage(page) {
+        if (grid.pending.has(page)) return;
+        grid.pending.add(page);
+        const generation = grid.generation;
+        try {
+            const response = await fetch(`/grid?offset=${page * grid.pageSize}&limit=${grid.pageSize}`, {
+                headers: { 'Accept': 'application/json' }
+            });
+            const data = await response.json();
+            if (!response.ok) throw { errorData: data, status: response.status };
+            if (generation !== grid.generation) return;
+            if (data.version !== grid.version) {
+                loadGrid(data); // Dataset moved on (e.g. another tab); start over from the new version
+                return;
             }
+            cacheGridRows(data.offset, data.rows);
+            scheduleGridRender();
+        } catch (errorInfo) {
+            handleError(errorInfo.errorData || errorInfo, errorInfo.status);
+        } finally {
+            if (generation === grid.generation) grid.pending.delete(page);
+        }
+    }
+
+    function applyGridPatch(patch) {
+        // Patches are relative to a version; anything else needs a fresh grid
+        if (!grid.tbody || patch.base_version !== grid.version) return false;
+
+        if (patch.removed_rows.length) {
+            // Drop cached rows inside removed ranges and shift the rest up
+            const shifted = new Map();
+            const indexes = Array.from(grid.rows.keys()).sort((a, b) => a - b);
+            let range = 0, removedBefore = 0;
+            for (const index of indexes) {
+                while (range < patch.removed_rows.length && patch.removed_rows[range][1] <= index) {
+                    removedBefore += patch.removed_rows[range][1] - patch.removed_rows[range][0];
+                    range++;
+                }
+                if (range < patch.removed_rows.length && patch.removed_rows[range][0] <= index) continue;
+                shifted.set(index - removedBefore, grid.rows.get(index));
+            }
+            grid.rows = shifted;
+        }
+
+        // Rebuild each cached row from kept/renamed parent columns; new columns start unknown
+        const remap = (cells, newValue) => {
+            const out = [];
+            for (const part of patch.layout) {
+                if (part.keep) {
+                    for (let j = part.keep[0]; j < part.keep[1]; j++) out.push(cells[j]);
+                } else if (part.rename) {
+                    out.push(newValue ? part.rename[1] : cells[part.rename[0]]);
+                } else {
+                    out.push(newValue ? part.new : undefined);
+                }
+            }
+            return out;
+        };
+        const previousColumns = grid.columns;
+        grid.columns = remap(previousColumns, true);
+        for (const [index, cells] of grid.rows) grid.rows.set(index, remap(cells, false));
+
+        // The patch carries the new columns' cells for the rows that were in view
+        const { offset, columns, rows } = patch.cells;
+        rows.forEach((values, k) => {
+            const cells = grid.rows.get(offset + k);
+            if (cells) columns.forEach((col, c) => { cells[col] = values[c]; });
+        });
+
+        grid.totalRows = patch.total_rows;
+        grid.version = patch.version;
+        grid.pending = new Set();
+        grid.generation += 1;
+        const headerChanged = previousColumns.length !== grid.columns.length ||
+            previousColumns.some((name, i) => name !== grid.columns[i]);
+        if (headerChanged || !grid.totalRows) {
+            buildGridTable();
+        } else {
+            renderGridRows();
+        }
+        return true;
+    }
+
+    if (tableContainer) {
+        tableContainer.addEventListener('scroll', scheduleGridRender, { passive: true });
+        window.addEventListener('resize', scheduleGridRender);
+    }
+
+    function updateSortStatus(view) {
+        const sort = view && view.sort;
+        if (sortStatusMessage) {
+            sortStatusMessage.textContent = sort ? `Sorted view: ${sort.columns.join(', ')} (${sort.ascending === false ? 'descending' : 'ascending'})` : '';
+            sortStatusMessage.style.display = sort ? 'inline' : 'none';
+        }
+        if (clearSortBtn) clearSortBtn.style.display = sort ? 'inline-block' : 'none';
+    }
+
+    function updateTableAndStatus(data, modalToHide = null) {
+        if (data.grid) {
+            loadGrid(data.grid);
+            if (rowCountSpan) rowCountSpan.textContent = `Rows: ${data.grid.total_rows}`;
+            if (colCountSpan) colCountSpan.textContent = `Columns: ${data.grid.total_columns}`;
+        }
+        if (data.grid_patch && !applyGridPatch(data.grid_patch)) {
+            reloadGrid();
+        }
+        if (data.grid) {
+            updateSortStatus(data.grid.view);
         }
         if (data.total_rows !== undefined && rowCountSpan) {
             rowCountSpan.textContent = `Rows: ${data.total_rows}`;
@@ -208,6 +435,10 @@ document.addEventListener('DOMContentLoaded', () => {
         if (data.undo_redo_status) {
             updateUndoRedoButtons(data.undo_redo_status);
         }
+        if (data.dataset_version !== undefined && data.dataset_version !== null) {
+            datasetVersion = data.dataset_version;
+            if (tableContainer) tableContainer.dataset.datasetVersion = datasetVersion;
+        }
         if (data.message) {
             const dfNotModified = data.df_modified === false;
             if (!dfNotModified) {
@@ -820,6 +1051,12 @@ document.addEventListener('DOMContentLoaded', () => {
         let responseData = {};
 
         try {
+            if (method === 'POST') {
+                const extras = {};
+                if (datasetVersion !== null) extras.expected_version = datasetVersion;
+                if (grid.tbody) extras.grid_window = gridWindow(); // Lets a patch carry the cells in view
+                body = { ...(body || {}), ...extras };
+            }
             const fetchOptions = {
                 method: method,
                 headers: {
@@ -850,6 +1087,10 @@ document.addEventListener('DOMContentLoaded', () => {
 
         } catch (errorInfo) {
             handleError(errorInfo.errorData || errorInfo, errorInfo.status);
+            if (errorInfo.status === 409) {
+                // Another tab or request changed the data; show the latest version
+                setTimeout(() => window.location.reload(), 1500);
+            }
         } finally {
             showLoading(false);
         }
@@ -1414,7 +1655,24 @@ document.addEventListener('DOMContentLoaded', () => {
 
 
     addModalApplyListener(applyFilterBtn, filterModal, filterModalEl, 'filter_rows', getFilterParams);
-    addModalApplyListener(applySortBtn, sortModal, sortModalEl, 'sort_values', getSortParams);
+    if (applySortBtn && sortModal && sortModalEl) {
+        applySortBtn.addEventListener('click', () => {
+            const { params, valid, msg } = getSortParams(sortModalEl);
+            if (!valid) {
+                if (msg) displayToast(msg, 'warning');
+                return;
+            }
+            const reorderData = sortModalEl.querySelector('#modal-sort-reorder-data');
+            if (reorderData && reorderData.checked) {
+                performAction('/clean_operation', 'POST', { operation: 'sort_values', params: params }, sortModal);
+            } else {
+                performAction('/sort_view', 'POST', params, sortModal); // Display order only: no copy, no undo step
+            }
+        });
+    }
+    if (clearSortBtn) {
+        clearSortBtn.addEventListener('click', () => performAction('/sort_view', 'POST', {}));
+    }
     addModalApplyListener(applySplitBtn, splitModal, splitModalEl, 'split_column', getSplitParams);
     addModalApplyListener(applyCombineBtn, combineModal, combineModalEl, 'combine_columns', getCombineParams);
     addModalApplyListener(applyRenameBtn, renameModal, renameModalEl, 'rename_column', getRenameParams);
@@ -1491,6 +1749,10 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     updateInitialCounts();
+    const gridMetaElement = document.getElementById('grid-meta');
+    if (gridMetaElement) {
+        loadGrid(JSON.parse(gridMetaElement.textContent), true);
+    }
     toggleFillValueInput();
     toggleOutlierMethodControls();
     loadAutoCleanConfigToForm();
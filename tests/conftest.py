@@ -0,0 +1,94 @@
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# app.py creates its upload/session/store folders relative to the working directory and
+# resolves templates through resource_path, so run it from a scratch folder.
+os.environ['SUPABASE_URL'] = ''
+os.environ['SUPABASE_KEY'] = ''
+sys._MEIPASS = REPO_ROOT
+os.chdir(tempfile.mkdtemp(prefix='datawarp-tests-'))
+sys.path.insert(0, REPO_ROOT)
+
+import app as datawarp  # noqa: E402
+
+datawarp.app.config['TESTING'] = True
+
+TEST_USER = {
+    'id': 'test-user',
+    'email': 'tester@example.com',
+    'user_metadata': {'subscription_tier': 'pro', 'subscription_valid_till': '2099-01-01'},
+}
+
+
+@pytest.fixture
+def app_module():
+    return datawarp
+
+
+@pytest.fixture
+def client():
+    """A test client with a logged-in pro user."""
+    test_client = datawarp.app.test_client()
+    with test_client.session_transaction() as sess:
+        sess['user'] = TEST_USER
+        sess['sb_access_token'] = 'test-token'
+    return test_client
+
+
+def upload(client, content, filename='data.csv'):
+    return client.post('/upload', data={'file': (io.BytesIO(content), filename)},
+                       content_type='multipart/form-data')
+
+
+def wait_ingest(client, response, timeout=60):
+    """Polls the ingest job started by an upload response until its result is claimed."""
+    job_id = response.headers['Location'].rstrip('/').rsplit('/', 1)[1]
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        data = client.get(f'/ingest_jobs/{job_id}').get_json()
+        if data.get('status') == 'failed':
+            raise AssertionError(data.get('error'))
+        if data.get('redirect'):
+            return data
+        time.sleep(0.02)
+    raise TimeoutError(job_id)
+
+
+def load_csv(client, content, filename='data.csv'):
+    """Uploads a CSV and waits for it to become the session's current dataset."""
+    return wait_ingest(client, upload(client, content, filename))
+
+
+def clean(client, operation, **params):
+    response = client.post('/clean_operation', json={'operation': operation, 'params': params})
+    return response.status_code, response.get_json()
+
+
+def current_frame(client):
+    """The session's current dataset version, read back from the dataset store."""
+    with client.session_transaction() as sess:
+        store_id = sess['dataset_handle']['store_id']
+    with open(datawarp.get_dataset_state_path(store_id)) as f:
+        version = json.load(f)['version']
+    datawarp.dataframe_cache.discard_store(store_id)
+    return datawarp.load_dataset_version(store_id, version)
+
+
+def load_frame(client, df):
+    """Writes df as version 1 of a new dataset store and makes it the session's dataset."""
+    store_id = f"test-{uuid.uuid4().hex[:8]}"
+    datawarp.write_dataset_version(store_id, 1, df)
+    state = {'version': 1, 'latest': 1, 'undo': [], 'redo': []}
+    datawarp._write_json_atomic(datawarp.get_dataset_state_path(store_id), state)
+    with client.session_transaction() as sess:
+        sess['dataset_handle'] = {'store_id': store_id}
+    return store_id
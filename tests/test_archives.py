@@ -0,0 +1,55 @@
+import io
+import os
+import zipfile
+
+import pytest
+
+from conftest import current_frame, upload, wait_ingest
+
+
+def zip_bytes(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, content in files.items():
+            archive.writestr(name, content)
+    return buffer.getvalue()
+
+
+ARCHIVE = zip_bytes({'first.csv': 'a,b\n1,2\n', 'second.csv': 'c\n3\n4\n', 'third.tsv': 'd\te\n5\t6\n'})
+
+
+@pytest.fixture
+def saved_folder(app_module, tmp_path, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, 'SAVED_SESSIONS_FOLDER', str(tmp_path))
+    return tmp_path
+
+
+def stage(client, content=ARCHIVE, filename='bundle.zip'):
+    """Uploads an archive and returns the URL of its file picker."""
+    return wait_ingest(client, upload(client, content, filename))['redirect']
+
+
+def test_separate_files_are_not_saved_unless_asked(client, saved_folder):
+    picker = stage(client)
+    response = client.post(picker, data={'files': ['0', '1'], 'mode': 'separate'})
+    assert response.headers['Location'].endswith(picker) # Back to the picker with an error
+    assert 'save the others' in client.get(picker).get_data(as_text=True)
+    assert os.listdir(saved_folder) == []
+
+    wait_ingest(client, client.post(picker, data={'files': ['0'], 'mode': 'separate'}))
+    assert current_frame(client).shape == (1, 2)
+    assert os.listdir(saved_folder) == []
+
+
+def test_separate_files_are_saved_when_asked(client, saved_folder):
+    picker = stage(client)
+    wait_ingest(client, client.post(picker, data={'files': ['0', '1', '2'], 'mode': 'separate', 'save_others': '1'}))
+    assert current_frame(client).shape == (1, 2)
+    assert sorted(os.listdir(saved_folder)) == ['second.parquet', 'third.parquet']
+
+
+def test_combined_files_are_not_saved(client, saved_folder):
+    picker = stage(client)
+    wait_ingest(client, client.post(picker, data={'files': ['0', '1'], 'mode': 'combine'}))
+    assert current_frame(client).shape == (3, 3)
+    assert os.listdir(saved_folder) == []
@@ -0,0 +1,92 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import clean, current_frame, load_frame
+
+TEXT = [' Paris', 'Berlin ', 'rome', np.nan, 'Paris', ' Paris', 'a-b', 'rome', np.nan, 'Oslo']
+
+STEPS = [
+    ('remove_spaces', {'column': 'text'}),
+    ('change_case', {'column': 'text', 'case_type': 'lower'}),
+    ('change_case', {'column': 'text', 'case_type': 'upper'}),
+    ('change_case', {'column': 'text', 'case_type': 'title'}),
+    ('replace_text', {'column': 'text', 'text_to_find': 'a', 'replace_with': 'A'}),
+    ('replace_text', {'column': 'text', 'text_to_find': r'^\s+|\s+$', 'replace_with': '', 'use_regex': True}),
+    ('map_values', {'column': 'text', 'mapping_dict': {' Paris': 'Paris', 'rome': 'Rome'}}),
+    ('map_values', {'column': 'text', 'mapping_dict': {'Oslo': '1', 'nowhere': 'x'}}),
+    ('filter_rows', {'column': 'text', 'condition': '==', 'value': 'rome'}),
+    ('filter_rows', {'column': 'text', 'condition': '!=', 'value': 'rome'}),
+    ('filter_rows', {'column': 'text', 'condition': '>', 'value': 'Oslo'}),
+    ('filter_rows', {'column': 'text', 'condition': '<=', 'value': 'Paris'}),
+    ('filter_rows', {'column': 'text', 'condition': 'contains', 'value': 'a'}),
+    ('filter_rows', {'column': 'text', 'condition': 'startswith', 'value': ' '}),
+    ('filter_rows', {'column': 'text', 'condition': 'endswith', 'value': 'e', 'action': 'remove'}),
+    ('filter_rows', {'column': 'text', 'condition': 'isnull'}),
+    ('filter_rows', {'column': 'text', 'condition': 'notnull'}),
+    ('check_id_format', {'column': 'text', 'pattern': r'[A-Z]\w+'}),
+    ('check_id_uniqueness', {'column': 'text'}),
+    ('split_column', {'column': 'text', 'delimiter': '-'}),
+    ('combine_columns', {'columns_to_combine': ['text', 'n'], 'new_column_name': 'both', 'separator': '|'}),
+    ('fill_missing', {'method': 'value', 'column': 'text', 'value': 'Unknown'}),
+    ('fill_missing', {'method': 'value', 'value': 'Unknown'}),
+    ('fill_missing', {'method': 'ffill', 'column': 'text'}),
+    ('remove_duplicates', {}),
+    ('remove_missing', {'subset': ['text']}),
+    ('sort_values', {'columns_to_sort_by': ['text', 'n'], 'ascending': True}),
+    ('sort_values', {'columns_to_sort_by': ['text'], 'ascending': False}),
+    ('change_dtype', {'column': 'text', 'target_type': 'string'}),
+]
+
+TRANSFORMS = {'remove_spaces', 'change_case', 'replace_text', 'map_values'}
+
+
+def run_step(client, text, operation, params):
+    load_frame(client, pd.DataFrame({'text': text, 'n': range(len(TEXT))}))
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', FutureWarning)
+        status, payload = clean(client, operation, **params)
+    return status, payload.get('message'), payload.get('error'), current_frame(client)
+
+
+def as_object(df):
+    df = df.copy()
+    for position in range(df.shape[1]):
+        if isinstance(df.iloc[:, position].dtype, pd.CategoricalDtype):
+            df.isetitem(position, df.iloc[:, position].astype(object))
+    return df
+
+
+@pytest.mark.parametrize('operation,params', STEPS, ids=lambda value: str(value))
+def test_step_on_category_column_matches_object_column(client, operation, params):
+    *expected, expected_df = run_step(client, pd.Series(TEXT, dtype=object), operation, params)
+    *actual, actual_df = run_step(client, pd.Series(TEXT, dtype='category'), operation, params)
+
+    assert expected[0] == 200, expected
+    assert actual == expected
+    pd.testing.assert_frame_equal(as_object(actual_df), as_object(expected_df), check_dtype=False)
+    if operation in TRANSFORMS: # Worked out per category, so the column keeps its compact dtype
+        assert isinstance(actual_df['text'].dtype, pd.CategoricalDtype)
+
+
+def test_mapping_onto_an_existing_category_merges_them(client):
+    load_frame(client, pd.DataFrame({'text': pd.Categorical(['a', 'b', 'a', None])}))
+    assert clean(client, 'map_values', column='text', mapping_dict={'b': 'a'})[0] == 200
+    column = current_frame(client)['text']
+    assert list(column.cat.categories) == ['a']
+    assert column.isna().tolist() == [False, False, False, True]
+
+
+@pytest.mark.parametrize('dtype', [object, 'category'])
+@pytest.mark.parametrize('condition,value,expected', [
+    ('contains', 'n', [0, 2, 4]), ('contains', 'a', [0]), ('startswith', 'N', [0]), ('endswith', 'one', [4])])
+def test_text_filters_never_match_missing_cells(client, dtype, condition, value, expected):
+    # Missing cells read as 'nan' or 'None' text, which must not count as a match
+    load_frame(client, pd.DataFrame({'text': pd.Series(['Nantes', np.nan, 'Ann', None, 'done'], dtype=dtype), 'n': range(5)}))
+    status, payload = clean(client, 'filter_rows', column='text', condition=condition, value=value)
+    assert status == 200, payload
+    kept = current_frame(client)
+    assert kept['text'].notna().all()
+    assert kept['n'].tolist() == expected
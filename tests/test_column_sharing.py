@@ -0,0 +1,91 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import clean, current_frame, load_frame
+
+
+@pytest.fixture
+def every_version_a_manifest(app_module, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, 'HISTORY_CHECKPOINT_INTERVAL', 1)
+
+
+def make_frame(rows=500):
+    return pd.DataFrame({
+        'name': [f' n{i} ' for i in range(rows)],
+        'city': np.where(np.arange(rows) % 3, 'Paris', 'Rome'),
+        'n': np.arange(rows, dtype=np.int64),
+    })
+
+
+def manifest_files(app_module, store_id, version):
+    manifest = app_module.read_dataset_manifest(store_id, version)
+    return {ref['column'] for ref in manifest['columns']}
+
+
+def store_files(app_module, store_id, kind='columns', cold=False):
+    folder = os.path.dirname(app_module._get_store_file_path(store_id, kind, 'x', cold))
+    return {name[:-len('.arrow')] for name in os.listdir(folder)} if os.path.isdir(folder) else set()
+
+
+def history(client):
+    return [entry['version'] for entry in client.get('/history').get_json()['versions']]
+
+
+def test_versions_share_unchanged_column_files(client, app_module, every_version_a_manifest):
+    store_id = load_frame(client, make_frame())
+    for case_type in ('upper', 'lower', 'title'):
+        assert clean(client, 'change_case', column='city', case_type=case_type)[0] == 200
+    files = [manifest_files(app_module, store_id, version) for version in (1, 2, 3, 4)]
+    assert len(set.intersection(*files)) == 2 # name and n: one file each for all four versions
+    assert len(store_files(app_module, store_id)) == 2 + 4
+
+    written = store_files(app_module, store_id)
+    for version in (1, 3, 4, 2):
+        assert client.post('/jump_to_version', json={'version': version}).status_code == 200
+        assert current_frame(client)['city'].iloc[1] == {1: 'Paris', 2: 'PARIS', 3: 'paris', 4: 'Paris'}[version]
+    assert store_files(app_module, store_id) == written # Moving through history writes nothing
+
+
+def test_pruning_keeps_files_still_shared_with_live_versions(client, app_module, monkeypatch, every_version_a_manifest):
+    monkeypatch.setitem(app_module.app.config, 'HISTORY_MAX_STEPS', 2)
+    store_id = load_frame(client, make_frame())
+    shared = manifest_files(app_module, store_id, 1)
+    for case_type in ('upper', 'lower', 'title'):
+        assert clean(client, 'change_case', column='city', case_type=case_type)[0] == 200
+    assert history(client) == [2, 3, 4]
+    assert app_module.read_dataset_manifest(store_id, 1) is None # Out of history: manifest deleted
+    live = set.union(*(manifest_files(app_module, store_id, version) for version in (2, 3, 4)))
+    assert store_files(app_module, store_id) | store_files(app_module, store_id, cold=True) == live
+    assert len(shared & live) == 2 # Version 1's name and n files outlived it
+
+    assert client.post('/jump_to_version', json={'version': 2}).status_code == 200
+    assert current_frame(client)['name'].tolist() == make_frame()['name'].tolist()
+
+
+def test_dropped_redo_branch_removes_only_its_own_files(client, app_module, every_version_a_manifest):
+    store_id = load_frame(client, make_frame())
+    assert clean(client, 'remove_spaces', column='name')[0] == 200
+    branch_only = manifest_files(app_module, store_id, 2) - manifest_files(app_module, store_id, 1)
+    assert client.post('/undo').status_code == 200
+    assert clean(client, 'change_case', column='city', case_type='upper')[0] == 200 # Clears redo
+    assert history(client) == [1, 3]
+    assert not branch_only & store_files(app_module, store_id)
+    assert manifest_files(app_module, store_id, 1) <= store_files(app_module, store_id)
+
+
+def test_old_history_spills_to_cold_storage_and_comes_back(client, app_module, monkeypatch, every_version_a_manifest):
+    monkeypatch.setitem(app_module.app.config, 'HISTORY_HOT_STEPS', 1)
+    store_id = load_frame(client, make_frame())
+    for case_type in ('upper', 'lower', 'title'):
+        assert clean(client, 'change_case', column='city', case_type=case_type)[0] == 200
+    old_city = manifest_files(app_module, store_id, 1) - manifest_files(app_module, store_id, 2)
+    assert old_city <= store_files(app_module, store_id, cold=True)
+    assert not old_city & store_files(app_module, store_id)
+    assert manifest_files(app_module, store_id, 4) <= store_files(app_module, store_id) # Current stays hot
+
+    assert client.post('/jump_to_version', json={'version': 1}).status_code == 200
+    pd.testing.assert_frame_equal(current_frame(client), make_frame())
+    assert old_city <= store_files(app_module, store_id)
@@ -0,0 +1,85 @@
+import gzip
+import io
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+import pytest
+
+from conftest import current_frame, upload, wait_ingest
+
+FRAME = pd.DataFrame({
+    'id': np.arange(12),
+    'name': [f'n{i}' for i in range(12)],
+    'score': np.linspace(0, 1, 12),
+    'when': pd.date_range('2024-01-01', periods=12, freq='D'),
+})
+
+
+def columnar_bytes(file_ext, rows_per_group=4):
+    """FRAME as a Parquet or Arrow IPC file with 12 / rows_per_group row groups (record batches)."""
+    buffer = io.BytesIO()
+    table = pa.Table.from_pandas(FRAME, preserve_index=False)
+    if file_ext == 'parquet':
+        pq.write_table(table, buffer, row_group_size=rows_per_group)
+    else:
+        feather.write_feather(table, buffer, chunksize=rows_per_group, compression='uncompressed')
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def read_tables(app_module, monkeypatch):
+    """Column names of every Arrow table the app converts to pandas."""
+    seen = []
+    convert = app_module.arrow_table_to_pandas
+    def spy(table, *args, **kwargs):
+        seen.append(table.column_names)
+        return convert(table, *args, **kwargs)
+    monkeypatch.setattr(app_module, 'arrow_table_to_pandas', spy)
+    return seen
+
+
+@pytest.mark.parametrize('file_ext', ['parquet', 'feather', 'arrow'])
+def test_only_picked_columns_and_row_groups_are_read(client, file_ext, read_tables):
+    picker = wait_ingest(client, upload(client, columnar_bytes(file_ext), f'data.{file_ext}'))['redirect']
+    page = client.get(picker).get_data(as_text=True)
+    assert all(name in page for name in FRAME.columns)
+    assert read_tables == [] # Described from metadata only
+
+    wait_ingest(client, client.post(picker, data={'columns': ['2', '0'], 'row_groups': ['0', '2']}))
+    assert read_tables == [['id', 'score']]
+    expected = FRAME.iloc[[0, 1, 2, 3, 8, 9, 10, 11], [0, 2]].reset_index(drop=True)
+    pd.testing.assert_frame_equal(current_frame(client), expected, check_dtype=False) # Ingest downcasts
+
+
+@pytest.mark.parametrize('form', [
+    {'columns': [], 'row_groups': ['0']},
+    {'columns': ['0'], 'row_groups': []},
+    {'columns': ['9', '-1'], 'row_groups': ['0']}, # Out of range picks are ignored, leaving none
+    {'columns': ['0'], 'row_groups': ['3']},
+])
+def test_empty_or_invalid_selection_returns_to_the_picker(client, form, read_tables):
+    picker = wait_ingest(client, upload(client, columnar_bytes('parquet'), 'data.parquet'))['redirect']
+    response = client.post(picker, data=form)
+    assert response.status_code == 302 and response.headers['Location'].endswith(picker)
+    assert 'Pick at least one column and one row group' in client.get(picker).get_data(as_text=True)
+    assert read_tables == []
+
+    wait_ingest(client, client.post(picker, data={'columns': ['1'], 'row_groups': ['1']})) # Still pickable
+    assert current_frame(client)['name'].tolist() == ['n4', 'n5', 'n6', 'n7']
+
+
+def test_picker_is_gone_once_the_selection_loaded(client):
+    picker = wait_ingest(client, upload(client, columnar_bytes('arrow'), 'data.arrow'))['redirect']
+    wait_ingest(client, client.post(picker, data={'columns': ['0'], 'row_groups': ['0']}))
+    response = client.get(picker)
+    assert response.status_code == 302 and not response.headers['Location'].endswith(picker)
+
+
+@pytest.mark.parametrize('filename, compress', [('data.jsonl', False), ('data.ndjson', False), ('data.jsonl.gz', True)])
+def test_json_lines_load_whole(client, filename, compress):
+    content = FRAME.drop(columns='when').to_json(orient='records', lines=True).encode()
+    wait_ingest(client, upload(client, gzip.compress(content) if compress else content, filename))
+    pd.testing.assert_frame_equal(current_frame(client), FRAME.drop(columns='when'), check_dtype=False)
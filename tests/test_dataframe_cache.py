@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+from conftest import clean, load_csv, load_frame
+
+
+def frame(rows):
+    return pd.DataFrame({'n': np.arange(rows, dtype=np.int64)})
+
+
+def cached_versions(app_module, store_id):
+    return sorted(version for (store, version) in app_module.dataframe_cache._entries if store == store_id)
+
+
+def session_store(client):
+    with client.session_transaction() as sess:
+        return sess['dataset_handle']['store_id']
+
+
+def test_least_recently_used_frames_are_evicted_by_bytes(app_module):
+    size = int(frame(100).memory_usage(index=True, deep=True).sum())
+    cache = app_module.DataFrameCache(max_bytes=3 * size)
+    for key in 'abc':
+        cache.put(key, frame(100))
+    assert cache.get('a') is not None # Now the most recently used
+    cache.put('d', frame(100))
+    assert cache.get('b') is None
+    assert all(cache.get(key) is not None for key in 'acd')
+    assert cache.stats()['bytes'] == 3 * size
+
+    cache.put('e', frame(200)) # Two entries' worth: evicts the two least recently used
+    assert [key for key in 'acde' if cache.get(key) is not None] == ['d', 'e']
+    cache.put('huge', frame(400))
+    assert cache.get('huge') is None and cache.get('e') is not None # Over budget: not cached at all
+
+
+def test_cached_frames_are_shared_shallow_copies(app_module):
+    cache = app_module.DataFrameCache(max_bytes=1 << 20)
+    cache.put('a', frame(3))
+    cache.get('a').loc[0, 'n'] = 99 # Copy-on-write: the cached frame is untouched
+    assert cache.get('a')['n'].tolist() == [0, 1, 2]
+
+
+def test_new_versions_are_cached_and_unreachable_ones_dropped(client, app_module):
+    store_id = load_frame(client, pd.DataFrame({'name': [' a', 'b ']}))
+    assert clean(client, 'remove_spaces', column='name')[0] == 200
+    assert 2 in cached_versions(app_module, store_id)
+
+    assert client.post('/undo').status_code == 200
+    assert clean(client, 'change_case', column='name', case_type='upper')[0] == 200
+    # Version 2 was only reachable through redo, which the new step cleared
+    assert 2 not in cached_versions(app_module, store_id)
+    assert 3 in cached_versions(app_module, store_id)
+    assert app_module.dataframe_cache.get((store_id, 3))['name'].tolist() == [' A', 'B ']
+
+
+def test_undo_serves_the_earlier_version(client, app_module):
+    store_id = load_frame(client, pd.DataFrame({'name': [' a', 'b ']}))
+    assert clean(client, 'remove_spaces', column='name')[0] == 200
+    assert client.post('/undo').status_code == 200
+    assert client.get('/grid').get_json()['rows'] == [[' a'], ['b ']]
+    assert client.post('/redo').status_code == 200
+    assert client.get('/grid').get_json()['rows'] == [['a'], ['b']]
+    assert cached_versions(app_module, store_id) == [1, 2]
+
+
+def test_loading_a_new_dataset_discards_the_old_store(client, app_module):
+    load_csv(client, b'name\n a\nb \n')
+    old_store = session_store(client)
+    assert clean(client, 'remove_spaces', column='name')[0] == 200
+    assert cached_versions(app_module, old_store)
+
+    load_csv(client, b'x\n1\n')
+    assert session_store(client) != old_store
+    assert cached_versions(app_module, old_store) == []
@@ -0,0 +1,167 @@
+import os
+import pickle
+import uuid
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import clean, current_frame, load_csv, load_frame
+
+
+@pytest.fixture
+def store_id(app_module):
+    store_id = f"test-{uuid.uuid4().hex[:8]}"
+    yield store_id
+    app_module.delete_dataset_store(store_id)
+
+
+def read_back(app_module, store_id, version):
+    """Reads a version from disk, bypassing the DataFrame cache."""
+    app_module.dataframe_cache.discard_store(store_id)
+    return app_module.load_dataset_version(store_id, version)
+
+
+COLUMNS = {
+    'ordered_category': pd.Categorical(['low', 'high', None, 'mid'], categories=['low', 'mid', 'high'], ordered=True),
+    'category': pd.Categorical(['b', 'a', 'b', None]),
+    'Int64': pd.array([1, None, 3, -4], dtype='Int64'),
+    'Int8': pd.array([1, None, 3, -4], dtype='Int8'),
+    'boolean': pd.array([True, None, False, True], dtype='boolean'),
+    'bool': [True, False, False, True],
+    'float32': np.array([1.5, np.nan, 2.25, 0.0], dtype=np.float32),
+    'int8': np.array([1, 2, 3, -4], dtype=np.int8),
+    'string': pd.array(['x', None, 'z', ''], dtype='string'),
+    'datetime': pd.to_datetime(['2024-01-01 00:00:00', None, '2024-03-01 12:30:00', '2023-12-31 00:00:00']),
+    'datetime_tz': pd.to_datetime(['2024-01-01 00:00:00', None, '2024-03-01 12:30:00', '2023-12-31 00:00:00']).tz_localize('Europe/Paris'),
+    'timedelta': pd.to_timedelta(['1 day', None, '2 hours', '-3 min']),
+    'period': pd.period_range('2024-01', periods=4, freq='M'),
+    'text': ['a', None, 'c', 'd'],
+    'mixed_object': [1, 'two', 3.5, None], # e.g. after filling a numeric column with text
+    'pickled_object': [{'a': 1}, [1, 2], (3, 4), None],
+}
+
+
+@pytest.mark.parametrize('name', list(COLUMNS))
+def test_column_dtype_round_trips(app_module, store_id, name):
+    df = pd.DataFrame({name: COLUMNS[name]})
+    app_module.write_dataset_version(store_id, 1, df)
+    restored = read_back(app_module, store_id, 1)
+    pd.testing.assert_frame_equal(restored, df, check_exact=True)
+    if isinstance(df[name].dtype, pd.CategoricalDtype):
+        assert restored[name].cat.categories.tolist() == df[name].cat.categories.tolist()
+        assert restored[name].cat.ordered == df[name].cat.ordered
+
+
+def test_all_dtypes_in_one_frame_round_trip(app_module, store_id):
+    df = pd.DataFrame(COLUMNS)
+    app_module.write_dataset_version(store_id, 1, df)
+    pd.testing.assert_frame_equal(read_back(app_module, store_id, 1), df, check_exact=True)
+
+
+def test_duplicate_and_non_string_column_names_round_trip(app_module, store_id):
+    df = pd.DataFrame([[1, 'a', 2.5, 'b', True]], columns=[0, ('a', 'b'), 'x', 'x', None])
+    app_module.write_dataset_version(store_id, 1, df)
+    restored = read_back(app_module, store_id, 1)
+    assert restored.columns.tolist() == df.columns.tolist()
+    pd.testing.assert_frame_equal(restored, df, check_exact=True)
+
+
+def test_custom_index_round_trips(app_module, store_id):
+    df = pd.DataFrame({'a': [1, 2, 3]}, index=pd.Index(['x', 'y', 'z'], name='key'))
+    app_module.write_dataset_version(store_id, 1, df)
+    pd.testing.assert_frame_equal(read_back(app_module, store_id, 1), df, check_exact=True)
+
+
+def test_delta_version_with_dropped_rows(app_module, store_id):
+    parent = pd.DataFrame(COLUMNS)
+    app_module.write_dataset_version(store_id, 1, parent)
+
+    child = parent.drop(index=[1, 3]) # Keeps the parent's index labels
+    child['text'] = child['text'].str.upper()
+    child['added'] = [10, 20]
+    app_module.write_dataset_version(store_id, 2, child, parent=1, parent_df=parent)
+
+    manifest = app_module.read_dataset_manifest(store_id, 2)
+    parent_manifest = app_module.read_dataset_manifest(store_id, 1)
+    shared = {ref['column'] for ref in manifest['columns']} & {ref['column'] for ref in parent_manifest['columns']}
+    assert len(shared) == len(COLUMNS) - 1 # Only the changed column was rewritten
+
+    pd.testing.assert_frame_equal(read_back(app_module, store_id, 2), child, check_exact=True)
+    pd.testing.assert_frame_equal(read_back(app_module, store_id, 1), parent, check_exact=True)
+
+
+def test_delta_chain_of_row_selections(app_module, store_id):
+    df = pd.DataFrame({'n': np.arange(10), 'c': pd.Categorical(list('abcabcabca'))})
+    app_module.write_dataset_version(store_id, 1, df)
+    second = df[df['n'] % 2 == 0].reset_index(drop=True)
+    app_module.write_dataset_version(store_id, 2, second, parent=1, parent_df=df)
+    third = second.sort_values('n', ascending=False, ignore_index=True)
+    app_module.write_dataset_version(store_id, 3, third, parent=2, parent_df=second)
+    pd.testing.assert_frame_equal(read_back(app_module, store_id, 3), third, check_exact=True)
+
+
+def test_column_spilled_while_being_opened_is_read_from_cold_storage(app_module, store_id, monkeypatch):
+    df = pd.DataFrame({'a': [1, 2, 3], 'b': ['x', 'y', 'z']})
+    app_module.write_dataset_version(store_id, 1, df)
+    restore = app_module.restore_cold_store_file
+    spilled = []
+    def racing_restore(store_id, kind, file_id):
+        path = restore(store_id, kind, file_id)
+        if not spilled: # A concurrent prune moves the file to cold storage right after the check
+            app_module.spill_store_file(store_id, kind, file_id)
+            spilled.append(file_id)
+        return path
+    monkeypatch.setattr(app_module, 'restore_cold_store_file', racing_restore)
+    pd.testing.assert_frame_equal(read_back(app_module, store_id, 1), df)
+    assert spilled
+
+
+def test_read_error_keeps_the_store(client, app_module, monkeypatch):
+    store_id = load_frame(client, pd.DataFrame({'a': [1, 2]}))
+    def failing_load(store_id, version):
+        raise OSError('disk busy')
+    monkeypatch.setattr(app_module, 'load_dataset_version', failing_load)
+    assert client.get('/grid').status_code == 400
+    with client.session_transaction() as sess:
+        assert sess['dataset_handle']['store_id'] == store_id
+    assert os.path.isdir(app_module.get_dataset_store_dir(store_id))
+    monkeypatch.undo()
+    assert client.get('/grid').get_json()['rows'] == [['1'], ['2']]
+
+
+def test_session_only_holds_a_handle(client, app_module):
+    content = ''.join(['id,name\n'] + [f'{i},name {i}\n' for i in range(5000)]).encode()
+    load_csv(client, content)
+    assert clean(client, 'change_case', column='name', case_type='upper')[0] == 200
+    with client.session_transaction() as sess:
+        store_id = sess['dataset_handle']['store_id']
+        assert sess['dataset_handle'] == {'store_id': store_id}
+        assert not {'current_df_json', 'undo_history', 'redo_history'} & set(sess)
+        assert len(pickle.dumps(dict(sess))) < 2048
+    store_dir = app_module.get_dataset_store_dir(store_id)
+    assert {'state.json', f'1{app_module.DATASET_VERSION_EXT}', 'columns'} <= set(os.listdir(store_dir))
+    assert current_frame(client)['name'].iloc[-1] == 'NAME 4999'
+
+
+def test_legacy_json_session_moves_into_the_store(client, app_module):
+    older = pd.DataFrame({'a': [1, 2], 'b': ['x', None]})
+    current = pd.DataFrame({'a': [1, 2], 'b': ['x', 'y']})
+    with client.session_transaction() as sess:
+        sess['current_df_json'] = current.to_json(orient='split')
+        sess['undo_history'] = [older.to_json(orient='split')]
+    assert client.get('/grid').get_json()['rows'] == [['1', 'x'], ['2', 'y']]
+    with client.session_transaction() as sess:
+        assert not {'current_df_json', 'undo_history'} & set(sess)
+        store_id = sess['dataset_handle']['store_id']
+    assert client.post('/undo').status_code == 200
+    assert client.get('/grid').get_json()['rows'] == [['1', 'x'], ['2', '']]
+    assert os.path.isdir(app_module.get_dataset_store_dir(store_id))
+
+
+def test_logout_deletes_the_store(client, app_module):
+    store_id = load_frame(client, pd.DataFrame({'a': [1]}))
+    client.get('/logout')
+    assert not os.path.exists(app_module.get_dataset_store_dir(store_id))
+    with client.session_transaction() as sess:
+        assert 'dataset_handle' not in sess
@@ -0,0 +1,83 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import clean, current_frame, load_frame
+
+STEPS = [
+    ('remove_spaces', {'column': 'name'}),
+    ('change_case', {'column': 'name', 'case_type': 'upper'}),
+    ('remove_missing', {'subset': ['score']}),
+    ('fill_missing', {'method': 'value', 'column': 'city', 'value': 'none'}),
+    ('drop_columns', {'columns_to_drop': ['extra']}),
+]
+
+
+def make_frame(rows=2000):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        'name': [f' n{i} ' for i in range(rows)],
+        'score': np.where(rng.random(rows) < 0.1, np.nan, rng.random(rows)),
+        'city': rng.choice(['Paris', 'Rome', None], rows),
+        'extra': np.arange(rows),
+        'wide': rng.random(rows),
+    })
+
+
+def store_files(app_module, store_id, kind):
+    folder = os.path.join(app_module.get_dataset_store_dir(store_id), kind)
+    return set(os.listdir(folder)) if os.path.isdir(folder) else set()
+
+
+def manifests(app_module, store_id):
+    ext = app_module.DATASET_VERSION_EXT
+    return sorted(int(name[:-len(ext)]) for name in os.listdir(app_module.get_dataset_store_dir(store_id)) if name.endswith(ext))
+
+
+@pytest.mark.parametrize('interval', [1, 3, 10])
+def test_undo_and_redo_rebuild_every_version(client, app_module, monkeypatch, interval):
+    monkeypatch.setitem(app_module.app.config, 'HISTORY_CHECKPOINT_INTERVAL', interval)
+    frames = [make_frame()]
+    load_frame(client, frames[0])
+    for operation, params in STEPS:
+        assert clean(client, operation, **params)[0] == 200
+        frames.append(current_frame(client))
+
+    for expected in reversed(frames[:-1]):
+        assert client.post('/undo').status_code == 200
+        pd.testing.assert_frame_equal(current_frame(client), expected, check_exact=True)
+    for expected in frames[1:]:
+        assert client.post('/redo').status_code == 200
+        pd.testing.assert_frame_equal(current_frame(client), expected, check_exact=True)
+
+
+def test_logged_steps_write_manifests_only_at_checkpoints(client, app_module, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, 'HISTORY_CHECKPOINT_INTERVAL', 3)
+    store_id = load_frame(client, make_frame())
+    for operation, params in STEPS:
+        assert clean(client, operation, **params)[0] == 200
+    assert manifests(app_module, store_id) == [1, 4] # Versions 2, 3, 5 and 6 live in the log only
+    assert sorted(app_module.read_history_log(store_id)) == [2, 3, 4, 5, 6]
+
+    expected = app_module.dataframe_cache.get((store_id, 6))
+    app_module.dataframe_cache.discard_store(store_id) # Rebuilt by replaying two steps on the version 4 checkpoint
+    pd.testing.assert_frame_equal(current_frame(client), expected, check_exact=True)
+
+
+def test_history_grows_with_the_edit_not_the_dataset(client, app_module, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, 'HISTORY_CHECKPOINT_INTERVAL', 1) # Every version is a manifest
+    store_id = load_frame(client, make_frame())
+    columns = store_files(app_module, store_id, 'columns')
+
+    assert clean(client, 'change_case', column='name', case_type='upper')[0] == 200
+    assert len(store_files(app_module, store_id, 'columns') - columns) == 1 # Only the changed column
+    columns = store_files(app_module, store_id, 'columns')
+
+    assert clean(client, 'remove_missing', subset=['score'])[0] == 200
+    assert store_files(app_module, store_id, 'columns') == columns # Every column shared
+    assert len(store_files(app_module, store_id, 'rows')) == 1 # Plus the kept row positions
+
+    assert clean(client, 'drop_columns', columns_to_drop=['wide'])[0] == 200
+    assert store_files(app_module, store_id, 'columns') == columns
@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from conftest import clean, load_frame
+
+ARROW = 'application/vnd.apache.arrow.stream'
+
+
+def make_frame():
+    rows = 30
+    return pd.DataFrame({
+        'float': [1.5, 2.25, np.nan] * 10,
+        'whole_float': [1.0, 2.0, 3.0] * 10,
+        'int': np.arange(rows),
+        'Int64': pd.array([1, None, 3] * 10, dtype='Int64'),
+        'bool': [True, False, True] * 10,
+        'category': pd.Categorical(['a', None, 'c'] * 10),
+        'text': ['<b>x</b>', None, ' padded '] * 10,
+        'mixed': [1, 'two', None] * 10,
+        'when': pd.date_range('2024-03-30 22:00', periods=rows, freq='h'),
+        'when_tz': pd.date_range('2024-03-30 22:00', periods=rows, freq='h', tz='Europe/Paris'),
+    })
+
+
+def json_page(client, **args):
+    response = client.get('/grid', query_string=args)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def cells(page, row, column):
+    return page['rows'][row][page['columns'].index(column)]
+
+
+def test_grid_pages_are_json_whatever_the_client_accepts(client):
+    load_frame(client, make_frame())
+    response = client.get('/grid', query_string={'limit': 5}, headers={'Accept': ARROW})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/json'
+    assert response.get_json()['rows'] == json_page(client, limit=5)['rows']
+
+
+@pytest.mark.parametrize('args', [{}, {'offset': 7, 'limit': 9}, {'offset': 25, 'limit': 50}])
+def test_out_of_core_pages_show_the_same_text(client, app_module, monkeypatch, args):
+    load_frame(client, make_frame())
+    expected = json_page(client, **args)['rows']
+    monkeypatch.setitem(app_module.app.config, 'LARGE_DATASET_BYTES', 1)
+    load_frame(client, make_frame())
+    assert json_page(client, **args)['rows'] == expected
+
+
+def test_page_cells_keep_float_and_timezone_text(client):
+    load_frame(client, make_frame())
+    page = json_page(client, limit=5)
+    assert cells(page, 0, 'float') == '1.5'
+    assert cells(page, 0, 'whole_float') == '1.0'
+    assert cells(page, 1, 'Int64') == ''
+    assert cells(page, 0, 'when_tz') == '2024-03-30 22:00:00+01:00'
+    assert cells(page, 4, 'when_tz') == '2024-03-31 03:00:00+02:00' # After the DST change
+    assert cells(page, 0, 'text') == '<b>x</b>' # The browser escapes on render
+
+
+def test_page_follows_the_sorted_view(client):
+    load_frame(client, make_frame())
+    response = client.post('/sort_view', json={'columns_to_sort_by': ['float'], 'ascending': False})
+    assert response.status_code == 200
+    assert [row[0] for row in json_page(client, limit=5)['rows']] == ['2.25'] * 5
+
+
+def test_page_after_a_cleaning_step(client):
+    load_frame(client, make_frame())
+    assert clean(client, 'fill_missing', method='value', column='float', value='0')[0] == 200
+    assert json_page(client, limit=3)['rows'][2][0] == '0.0'
+
+
+def test_arrow_export_keeps_column_types(client):
+    df = make_frame()
+    load_frame(client, df)
+    response = client.get('/download/arrow', query_string={'offset': 3, 'limit': 4})
+    assert response.status_code == 200
+    assert response.mimetype == ARROW
+    table = pa.ipc.open_stream(response.data).read_all()
+    assert table.num_rows == 4
+    types = dict(zip(table.column_names, table.schema.types))
+    assert pa.types.is_int64(types['int']) and pa.types.is_float64(types['float'])
+    assert pa.types.is_boolean(types['bool']) and pa.types.is_dictionary(types['category'])
+    assert types['when_tz'] == pa.timestamp('ns', tz='Europe/Paris')
+    assert pa.types.is_string(types['mixed']) # No Arrow type: display strings
+    assert table.column('int').to_pylist() == [3, 4, 5, 6]
+
+
+@pytest.mark.parametrize('large', [False, True], ids=['in_memory', 'out_of_core'])
+@pytest.mark.parametrize('args, offset, rows', [
+    ({}, 0, 10),
+    ({'offset': 5, 'limit': 4}, 5, 4),
+    ({'offset': 28, 'limit': 10}, 28, 2), # Last page is short
+    ({'offset': -5, 'limit': 3}, 0, 3),
+    ({'offset': 30}, 30, 0), # At the end: no rows
+    ({'offset': 99}, 30, 0),
+    ({'limit': 0}, 0, 10), # Unset: the default page size
+    ({'limit': -4}, 0, 1),
+    ({'limit': 500}, 0, 20), # GRID_MAX_PAGE_SIZE
+    ({'offset': 'x', 'limit': 'y'}, 0, 10), # Unparseable: the defaults
+])
+def test_page_bounds_are_clamped(client, app_module, monkeypatch, large, args, offset, rows):
+    monkeypatch.setitem(app_module.app.config, 'GRID_PAGE_SIZE', 10)
+    monkeypatch.setitem(app_module.app.config, 'GRID_MAX_PAGE_SIZE', 20)
+    monkeypatch.setitem(app_module.app.config, 'LARGE_DATASET_BYTES', 1 if large else 1 << 40)
+    df = make_frame()
+    load_frame(client, df)
+    page = json_page(client, **args)
+    assert (page['offset'], len(page['rows'])) == (offset, rows)
+    assert (page['total_rows'], page['total_columns'], page['page_size']) == (30, df.shape[1], 10)
+    assert [row[page['columns'].index('int')] for row in page['rows']] == [str(i) for i in range(offset, offset + rows)]
+
+
+def test_page_of_an_empty_frame(client):
+    load_frame(client, pd.DataFrame({'a': pd.Series([], dtype='int64'), 'b': pd.Series([], dtype='category')}))
+    page = json_page(client, offset=3)
+    assert (page['offset'], page['rows'], page['total_rows'], page['columns']) == (0, [], 0, ['a', 'b'])
+
+
+def test_grid_without_data(client):
+    response = client.get('/grid')
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'No data loaded.'}
@@ -0,0 +1,136 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import load_frame
+
+ROWS = 12
+
+
+def make_frame():
+    return pd.DataFrame({
+        'id': np.arange(ROWS),
+        'name': [' a ', 'b', None, 'd', ' e', 'f', 'g ', None, 'i', 'j', 'k', 'l'],
+        'score': [1.5, np.nan, 3.0, 4.0, np.nan, np.nan, 7.0, 8.0, 9.0, 10.0, 11.0, np.nan],
+        'city': ['x-1', 'y-2', 'z-3'] * 4,
+        'flag': [True, False] * 6,
+        'n': np.arange(ROWS) * 10,
+    })
+
+
+def grid_page(client):
+    response = client.get('/grid', query_string={'limit': ROWS})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def step(client, operation, window=(0, ROWS), **params):
+    response = client.post('/clean_operation', json={'operation': operation, 'params': params, 'grid_window': list(window)})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def apply_patch(page, patch):
+    """
+    Applies a grid patch to a page the way applyGridPatch in cleaning.js
+    updates its row cache; None when the client has to fetch a fresh page.
+    """
+    if patch['base_version'] != page['version']:
+        return None
+    removed = patch['removed_rows']
+    rows = {}
+    for index, cells in enumerate(page['rows'], page['offset']):
+        if any(start <= index < stop for start, stop in removed):
+            continue
+        rows[index - sum(stop - start for start, stop in removed if stop <= index)] = cells
+
+    def remap(cells, names):
+        out = []
+        for part in patch['layout']:
+            if 'keep' in part:
+                out.extend(cells[part['keep'][0]:part['keep'][1]])
+            elif 'rename' in part:
+                out.append(part['rename'][1] if names else cells[part['rename'][0]])
+            else:
+                out.append(part['new'] if names else None)
+        return out
+
+    rows = {index: remap(cells, False) for index, cells in rows.items()}
+    for k, values in enumerate(patch['cells']['rows'], patch['cells']['offset']):
+        if k in rows:
+            for column, value in zip(patch['cells']['columns'], values):
+                rows[k][column] = value
+    return {'version': patch['version'], 'columns': remap(page['columns'], True),
+            'total_rows': patch['total_rows'], 'rows': [rows[index] for index in sorted(rows)]}
+
+
+@pytest.mark.parametrize('operation,params,layout', [
+    ('remove_spaces', {'column': 'name'}, [{'keep': [0, 1]}, {'new': 'name'}, {'keep': [2, 6]}]),
+    ('fill_missing', {'method': 'value', 'column': 'score', 'value': '0'}, [{'keep': [0, 2]}, {'new': 'score'}, {'keep': [3, 6]}]),
+    ('rename_column', {'old_name': 'city', 'new_name': 'town'}, [{'keep': [0, 3]}, {'rename': [3, 'town']}, {'keep': [4, 6]}]),
+    ('drop_columns', {'columns_to_drop': ['name', 'flag']}, [{'keep': [0, 1]}, {'keep': [2, 4]}, {'keep': [5, 6]}]),
+    ('split_column', {'column': 'city', 'delimiter': '-'}, None),
+    ('remove_missing', {'subset': ['score']}, [{'keep': [0, 6]}]),
+    ('remove_duplicates', {'subset': ['city']}, [{'keep': [0, 6]}]),
+])
+def test_patched_page_matches_a_fresh_page(client, operation, params, layout):
+    load_frame(client, make_frame())
+    parent = grid_page(client)
+    update = step(client, operation, **params)
+    patch = update['grid_patch']
+    assert patch['base_version'] == parent['version']
+    if layout is not None:
+        assert patch['layout'] == layout
+    patched = apply_patch(parent, patch)
+    fresh = grid_page(client)
+    assert patched == {key: fresh[key] for key in patched}
+    assert update.get('columns', parent['columns']) == fresh['columns']
+
+
+@pytest.mark.parametrize('operation,params,removed', [
+    ('remove_missing', {'subset': ['score']}, [[1, 2], [4, 6], [11, 12]]),
+    ('remove_missing', {'subset': ['name']}, [[2, 3], [7, 8]]),
+    ('remove_duplicates', {'subset': ['city']}, [[3, 12]]),
+])
+def test_removed_rows_are_sent_as_ranges(client, operation, params, removed):
+    load_frame(client, make_frame())
+    patch = step(client, operation, **params)['grid_patch']
+    assert patch['removed_rows'] == removed
+    assert patch['total_rows'] == ROWS - sum(stop - start for start, stop in removed)
+    assert patch['cells']['columns'] == [] # No cells to send: every column is kept
+
+
+def test_patch_cells_cover_only_the_visible_window(client):
+    load_frame(client, make_frame())
+    patch = step(client, 'remove_spaces', window=(4, 7), column='name')['grid_patch']
+    assert patch['cells'] == {'offset': 4, 'columns': [1], 'rows': [['e'], ['f'], ['g']]}
+
+
+def test_stale_client_falls_back_to_a_fresh_page(client):
+    load_frame(client, make_frame())
+    shown = grid_page(client)
+    step(client, 'remove_spaces', column='name') # e.g. from another tab; this client still shows version 1
+    patch = step(client, 'fill_missing', method='value', column='score', value='0')['grid_patch']
+    assert patch['base_version'] != shown['version']
+    assert apply_patch(shown, patch) is None
+
+
+@pytest.mark.parametrize('operation,params', [
+    ('sort_values', {'columns_to_sort_by': ['n'], 'ascending': False}), # Rows reordered
+    ('filter_rows', {'column': 'n', 'condition': '>=', 'value': '30'}), # Index reset: rows cannot be mapped
+    ('change_case', {'column': 'name', 'case_type': 'upper'}), # Patchable on its own, but a view is active
+])
+def test_unpatchable_changes_send_the_first_page(client, operation, params):
+    load_frame(client, make_frame())
+    if operation == 'change_case':
+        assert client.post('/sort_view', json={'columns_to_sort_by': ['id'], 'ascending': False}).status_code == 200
+    update = step(client, operation, **params)
+    assert 'grid_patch' not in update
+    fresh = grid_page(client)
+    assert update['grid']['rows'][:ROWS] == fresh['rows']
+
+
+def test_rewritten_or_reordered_columns_are_not_patched(app_module):
+    parent = make_frame()
+    assert app_module.build_grid_patch(parent.astype(str), parent) is None # Mostly new columns
+    assert app_module.build_grid_patch(parent[parent.columns[::-1]], parent) is None
@@ -0,0 +1,43 @@
+import pandas as pd
+
+from conftest import clean, current_frame, load_frame
+
+
+def step_and_undo(client):
+    """Runs one cleaning step and undoes it, leaving a redo entry; returns the frame the step produced."""
+    load_frame(client, pd.DataFrame({'name': [' a ', 'b ', None], 'n': [1.0, None, 3.0]}))
+    status, _ = clean(client, 'remove_spaces', column='name')
+    assert status == 200
+    stepped = current_frame(client)
+    response = client.post('/undo')
+    assert response.get_json()['undo_redo_status'] == {'undo_enabled': False, 'redo_enabled': True}
+    return stepped
+
+
+def test_rejected_step_keeps_redo(client):
+    stepped = step_and_undo(client)
+    status, body = clean(client, 'fill_missing', column='n', method='no_such_method')
+    assert status == 400, body
+    response = client.post('/redo')
+    assert response.status_code == 200
+    assert response.get_json()['undo_redo_status']['undo_enabled']
+    pd.testing.assert_frame_equal(current_frame(client), stepped)
+
+
+def test_failed_step_keeps_redo(client, app_module, monkeypatch):
+    stepped = step_and_undo(client)
+    def broken(df, operation, params):
+        raise RuntimeError('boom')
+    monkeypatch.setattr(app_module, 'apply_clean_operation', broken)
+    status, _ = clean(client, 'remove_spaces', column='name')
+    assert status == 500
+    monkeypatch.undo() # Redo replays the logged step
+    assert client.post('/redo').status_code == 200
+    pd.testing.assert_frame_equal(current_frame(client), stepped)
+
+
+def test_applied_step_clears_redo(client):
+    step_and_undo(client)
+    status, body = clean(client, 'remove_missing')
+    assert status == 200
+    assert body['undo_redo_status'] == {'undo_enabled': True, 'redo_enabled': False}
@@ -0,0 +1,96 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from conftest import current_frame, load_csv
+
+
+def csv_bytes(seed, rows=200):
+    return ''.join(['id,name,score\n'] + [f"{i},name{(i * seed) % 17},{i * seed / 7:.3f}\n" for i in range(rows)]).encode()
+
+
+@pytest.fixture
+def cache(app_module, tmp_path, monkeypatch):
+    cache = app_module.IngestCache(str(tmp_path / 'ingest_cache'), 1 << 30)
+    monkeypatch.setattr(app_module, 'ingest_cache', cache)
+    return cache
+
+
+def load(client, app_module, content):
+    """Uploads content; returns (store id, version 1 manifest, current frame)."""
+    load_csv(client, content)
+    with client.session_transaction() as sess:
+        store_id = sess['dataset_handle']['store_id']
+    with open(app_module.get_dataset_version_path(store_id, 1)) as f:
+        return store_id, json.load(f), current_frame(client)
+
+
+def column_files(app_module, store_id, manifest):
+    return [app_module.get_dataset_column_path(store_id, ref['column']) for ref in manifest['columns']]
+
+
+def test_reupload_links_the_cached_columns(client, app_module, cache):
+    content = csv_bytes(3)
+    first_store, first, expected = load(client, app_module, content)
+    assert not first['source']['cached'] and cache.stats()['entries'] == 1
+
+    store_id, manifest, df = load(client, app_module, content)
+    assert store_id != first_store and not os.path.exists(app_module.get_dataset_store_dir(first_store))
+    assert manifest['source']['cached'] and manifest['source']['sha256'] == first['source']['sha256']
+    assert cache.hits == 1
+    pd.testing.assert_frame_equal(df, expected)
+    for path in column_files(app_module, store_id, manifest):
+        assert os.stat(path).st_nlink == 2 # Hard-linked with the cache entry's file, not copied
+
+
+def test_same_leading_bytes_with_other_content_is_parsed(client, app_module, cache, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, 'INGEST_CACHE_PROBE_BYTES', 64)
+    content = csv_bytes(3)
+    first = load(client, app_module, content)[1]
+    _, manifest, df = load(client, app_module, content + b'999,late,1.0\n')
+    assert manifest['source']['probe'] == first['source']['probe'] # Hashed in full, then missed
+    assert manifest['source']['sha256'] != first['source']['sha256']
+    assert not manifest['source']['cached'] and cache.misses == 1
+    assert len(df) == 201 and df['name'].iloc[-1] == 'late'
+    assert cache.stats()['entries'] == 2
+
+
+def test_text_conversion_setting_keeps_entries_apart(client, app_module, cache, monkeypatch):
+    content = csv_bytes(3)
+    load(client, app_module, content)
+    monkeypatch.setitem(app_module.app.config, 'INGEST_CONVERT_TEXT_DTYPES', False)
+    _, manifest, df = load(client, app_module, content)
+    assert not manifest['source']['cached']
+    assert df['name'].dtype == object
+
+
+def test_least_recently_used_entries_are_evicted_by_size(client, app_module, cache):
+    load(client, app_module, csv_bytes(3))
+    entry_bytes = cache.stats()['bytes']
+    cache.max_bytes = int(entry_bytes * 2.5) # Room for two entries of this size
+    load(client, app_module, csv_bytes(5))
+    load(client, app_module, csv_bytes(3)) # Hit: now the most recently used
+    load(client, app_module, csv_bytes(11)) # Evicts the csv_bytes(5) entry
+    assert cache.stats()['entries'] == 2
+    assert cache.stats()['bytes'] <= cache.max_bytes
+
+    hits = cache.hits
+    assert load(client, app_module, csv_bytes(3))[1]['source']['cached']
+    assert load(client, app_module, csv_bytes(11))[1]['source']['cached']
+    assert not load(client, app_module, csv_bytes(5))[1]['source']['cached']
+    assert cache.hits == hits + 2
+
+
+def test_files_are_copied_where_hard_links_fail(client, app_module, cache, monkeypatch):
+    def no_links(src, dst):
+        raise OSError('hard links not supported')
+    monkeypatch.setattr(app_module.os, 'link', no_links)
+    content = csv_bytes(3)
+    _, _, expected = load(client, app_module, content)
+    store_id, manifest, df = load(client, app_module, content)
+    assert manifest['source']['cached']
+    pd.testing.assert_frame_equal(df, expected)
+    for path in column_files(app_module, store_id, manifest):
+        assert os.stat(path).st_nlink == 1
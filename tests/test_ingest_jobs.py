@@ -0,0 +1,200 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from conftest import TEST_USER, current_frame, upload, wait_ingest
+
+
+def poll_in_thread(client, job_id):
+    """Starts one status poll on another thread; returns (thread, dict filled with its JSON)."""
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(client.get(f'/ingest_jobs/{job_id}').get_json()), daemon=True)
+    thread.start()
+    return thread, result
+
+
+def job_id_of(response):
+    return response.headers['Location'].rstrip('/').rsplit('/', 1)[1]
+
+
+def flashes(client):
+    with client.session_transaction() as sess:
+        return sess.pop('_flashes', [])
+
+
+def test_polling_does_not_wait_for_the_dataset_lock(client, app_module, monkeypatch):
+    release = threading.Event()
+    ingest_upload = app_module.ingest_upload
+    def slow_ingest(*args, **kwargs):
+        release.wait(10)
+        return ingest_upload(*args, **kwargs)
+    monkeypatch.setattr(app_module, 'ingest_upload', slow_ingest)
+    response = upload(client, b'a,b\n1,2\n3,4\n')
+    job_id = job_id_of(response)
+
+    busy = threading.Lock() # Stands in for a long cleaning step holding the session's lock
+    busy.acquire()
+    monkeypatch.setattr(app_module, 'get_dataset_lock', lambda: busy)
+    try:
+        poller, result = poll_in_thread(client, job_id)
+        poller.join(5)
+        assert not poller.is_alive()
+        assert result['status'] == 'running'
+
+        release.set()
+        assert app_module.ingest_jobs[job_id].done.wait(10)
+        poller, result = poll_in_thread(client, job_id)
+        poller.join(0.5)
+        assert poller.is_alive() # Making the new dataset current does wait for the lock
+    finally:
+        release.set()
+        busy.release()
+    poller.join(5)
+    assert result['status'] == 'done' and result['redirect']
+    assert current_frame(client).shape == (2, 2)
+
+
+def test_finished_load_is_claimed_once(client, app_module):
+    response = upload(client, b'a,b\n1,2\n')
+    job_id = job_id_of(response)
+    assert app_module.ingest_jobs[job_id].done.wait(10)
+    first = client.get(f'/ingest_jobs/{job_id}').get_json()
+    with client.session_transaction() as sess:
+        handle = sess['dataset_handle']
+    second = client.get(f'/ingest_jobs/{job_id}').get_json()
+    with client.session_transaction() as sess:
+        assert sess['dataset_handle'] == handle # The second poll did not load the store again
+    assert first['redirect'] == second['redirect']
+
+
+def test_streaming_an_upload_does_not_hold_the_dataset_lock(client, app_module, monkeypatch):
+    busy = threading.Lock() # Stands in for a long cleaning step holding the session's lock
+    busy.acquire()
+    monkeypatch.setattr(app_module, 'get_dataset_lock', lambda: busy)
+    result = {}
+    uploader = threading.Thread(target=lambda: result.update(response=upload(client, b'a,b\n1,2\n3,4\n')), daemon=True)
+    try:
+        uploader.start()
+        uploader.join(5)
+        assert not uploader.is_alive() # The body was read and the job started without the lock
+        job_id = job_id_of(result['response'])
+        assert app_module.ingest_jobs[job_id].done.wait(10)
+    finally:
+        busy.release()
+    assert client.get(f'/ingest_jobs/{job_id}').get_json()['redirect']
+    assert current_frame(client).shape == (2, 2)
+
+
+class FakeReader:
+    def __init__(self, bytes_read):
+        self.bytes_read = bytes_read
+
+
+@pytest.mark.parametrize('status, bytes_read, eta', [
+    ('running', 25, 9.0), # 3 s for the first quarter: 9 s for the rest
+    ('running', 0, None), # Nothing read yet: no rate to go by
+    ('running', 100, None), # Body read; parsing has no byte count
+    ('done', 25, None),
+])
+def test_progress_reports_bytes_rows_and_eta(app_module, status, bytes_read, eta):
+    with app_module.app.test_request_context():
+        job = app_module.IngestJob('owner', 'data.csv', '/', bytes_total=100, stream=FakeReader(bytes_read))
+    job.started -= 3
+    job.status, job.rows = status, 7
+    if status == 'done':
+        job.finished = job.started + 3
+    progress = job.progress()
+    assert (progress['bytes_read'], progress['bytes_total'], progress['rows']) == (bytes_read, 100, 7)
+    assert progress['eta_seconds'] == eta
+    assert progress['elapsed_seconds'] == pytest.approx(3, abs=0.2)
+
+
+def test_finished_upload_reports_rows_and_bytes(client, app_module):
+    content = b'a,b\n' + b'1,2\n' * 40
+    response = upload(client, content)
+    assert app_module.ingest_jobs[job_id_of(response)].done.wait(10)
+    status = client.get(f'/ingest_jobs/{job_id_of(response)}').get_json()
+    assert (status['status'], status['rows'], status['bytes_read']) == ('done', 40, len(content))
+    assert status['bytes_total'] >= len(content) # The whole request body, multipart framing included
+    assert status['eta_seconds'] is None and status['error'] is None
+
+
+@pytest.mark.parametrize('content, filename, error', [
+    (b'not a workbook', 'data.xlsx', 'Error processing file'),
+    (b'\x00\x01 not parquet', 'data.parquet', 'Error processing file'),
+])
+def test_failed_upload_reports_its_error_once(client, app_module, content, filename, error):
+    response = upload(client, content, filename)
+    job_id = job_id_of(response)
+    job = app_module.ingest_jobs[job_id]
+    assert job.done.wait(10)
+    flashes(client)
+
+    status = client.get(f'/ingest_jobs/{job_id}').get_json()
+    assert status['status'] == 'failed' and status['error'].startswith(error)
+    assert status['redirect'] == '/' and status['eta_seconds'] is None
+    assert flashes(client) == [('error', status['error'])]
+    assert client.get(f'/ingest_jobs/{job_id}').get_json()['redirect'] == '/'
+    assert flashes(client) == [] # Already reported
+    assert not app_module.os.path.exists(app_module.get_dataset_store_dir(job.store_id))
+    with client.session_transaction() as sess:
+        assert 'dataset_handle' not in sess
+
+
+def test_unknown_or_foreign_jobs_are_not_found(client, app_module):
+    assert client.get('/ingest_jobs/nope').status_code == 404
+    assert client.get('/ingest_jobs/nope').get_json() == {'error': 'Unknown or expired load job.'}
+    response = client.get('/ingest/nope')
+    assert response.status_code == 302 and response.headers['Location'].endswith('/')
+    assert flashes(client) == [('warning', 'That data load is no longer available.')]
+
+    response = upload(client, b'a,b\n1,2\n')
+    other = app_module.app.test_client()
+    with other.session_transaction() as sess:
+        sess['user'] = TEST_USER
+        sess['sb_access_token'] = 'test-token'
+    assert other.get(f'/ingest_jobs/{job_id_of(response)}').status_code == 404 # Another session's load
+    assert wait_ingest(client, response)['status'] == 'done'
+
+
+@pytest.fixture
+def sqlite_path(tmp_path):
+    path = tmp_path / 'data.db'
+    with sqlite3.connect(path) as connection:
+        connection.execute('CREATE TABLE t (a INTEGER, b TEXT)')
+        connection.executemany('INSERT INTO t VALUES (?, ?)', [(i, f'r{i}') for i in range(120)])
+    return str(path)
+
+
+def query(client, path, sql):
+    return client.post('/database_query', data={'db_type': 'sqlite', 'db_name': path, 'query': sql})
+
+
+def test_database_job_reports_rows_without_bytes(client, app_module, monkeypatch, sqlite_path):
+    monkeypatch.setitem(app_module.app.config, 'INGEST_SQL_CHUNK_ROWS', 50)
+    status = wait_ingest(client, query(client, sqlite_path, 'SELECT * FROM t'))
+    assert (status['status'], status['rows'], status['bytes_read']) == ('done', 120, None)
+    assert current_frame(client).shape == (120, 2)
+    assert ('success', 'Query successful.') in flashes(client)
+
+
+def test_failed_database_job_returns_to_the_form(client, sqlite_path):
+    response = query(client, sqlite_path, 'SELECT * FROM missing_table')
+    job_id = job_id_of(response)
+    deadline = time.time() + 10
+    while (status := client.get(f'/ingest_jobs/{job_id}').get_json())['status'] == 'running' and time.time() < deadline:
+        time.sleep(0.02)
+    assert status['status'] == 'failed'
+    assert status['error'].startswith('Database connection or query error')
+    assert status['redirect'] == '/database_form'
+    assert flashes(client) == [('error', status['error'])]
+
+
+def test_unexpected_failure_is_reported_as_such(client, app_module, monkeypatch, sqlite_path):
+    def broken(*args, **kwargs):
+        raise KeyError('boom')
+    monkeypatch.setattr(app_module, 'create_engine', broken)
+    with pytest.raises(AssertionError, match="An unexpected error occurred: 'boom'"):
+        wait_ingest(client, query(client, sqlite_path, 'SELECT * FROM t'))
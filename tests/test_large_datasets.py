@@ -0,0 +1,111 @@
+import pandas as pd
+import pytest
+
+from conftest import TEST_USER, clean, current_frame, load_frame
+
+COLUMNS = ('name', 'grade', 'joined', 'score')
+
+def make_frame():
+    """Object, category, datetime and float columns with missing values, outliers and duplicate rows."""
+    rows = 60
+    names = [None if i % 7 == 0 else (f'  Name {i % 9} ' if i % 2 else f'name {i % 9}') for i in range(rows)]
+    grades = [None if i % 11 == 0 else 'ABC'[i % 3] for i in range(rows)]
+    joined = [None if i % 13 == 0 else f'2024-01-{i % 28 + 1:02d} 0{i % 10}:30:00' for i in range(rows)]
+    scores = [None if i % 5 == 0 else (1000.5 if i == 17 else i * 1.25) for i in range(rows)]
+    df = pd.DataFrame({
+        'name': pd.Series(names, dtype=object),
+        'grade': pd.Categorical(grades),
+        'joined': pd.to_datetime(pd.Series(joined)),
+        'score': pd.Series(scores, dtype='float64'),
+    })
+    return pd.concat([df, df.iloc[1:4]], ignore_index=True) # Exact duplicates
+
+
+STEPS = [
+    ('change_dtype', {'column': 'grade', 'target_type': 'category'}),
+    ('change_dtype', {'column': 'joined', 'target_type': 'datetime'}),
+]
+
+STEPS = [
+    ('remove_missing', {'how': 'any'}),
+    ('remove_missing', {'how': 'all', 'subset': ['grade', 'score']}),
+    ('remove_duplicates', {}),
+    ('remove_duplicates', {'subset': ['grade']}),
+    ('fill_missing', {'method': 'value', 'value': 'B'}),
+    ('fill_missing', {'method': 'mean'}),
+    ('fill_missing', {'method': 'median'}),
+    ('sort_values', {'columns_to_sort_by': ['grade', 'score'], 'ascending': False}),
+    ('sort_values', {'columns_to_sort_by': ['joined']}),
+]
+for column in COLUMNS:
+    STEPS += [
+        ('remove_spaces', {'column': column}),
+        ('change_case', {'column': column, 'case_type': 'upper'}),
+        ('replace_text', {'column': column, 'text_to_find': 'a', 'replace_with': 'x'}),
+        ('map_values', {'column': column, 'mapping_dict': {'A': 'Alpha', 'name 1': 'first'}}),
+        ('fill_missing', {'method': 'value', 'column': column, 'value': '2024-02-01'}),
+        ('fill_missing', {'method': 'median', 'column': column}),
+        ('filter_rows', {'column': column, 'condition': 'isnull'}),
+        ('filter_rows', {'column': column, 'condition': 'contains', 'value': 'a', 'action': 'remove'}),
+        ('sort_values', {'columns_to_sort_by': [column]}),
+        ('remove_outliers_iqr', {'column': column}),
+        ('clip_outliers_iqr', {'column': column, 'factor': 1.0}),
+    ]
+STEPS += [
+    ('filter_rows', {'column': 'score', 'condition': '>', 'value': '20'}),
+    ('filter_rows', {'column': 'joined', 'condition': '<', 'value': '2024-01-10'}),
+]
+
+
+def run_steps(client, app_module, monkeypatch, large_bytes, operation, params):
+    """Runs the step under test and a remove_missing after it on a fresh copy of the frame."""
+    monkeypatch.setitem(app_module.app.config, 'LARGE_DATASET_BYTES', large_bytes)
+    monkeypatch.setitem(app_module.app.config, 'LARGE_DATASET_CHUNK_ROWS', 16) # Several chunks per column
+    load_frame(client, make_frame())
+    status, payload = clean(client, operation, **params)
+    outcome = {'status': status, 'message': payload.get('message'), 'error': payload.get('error')}
+    follow_up = clean(client, 'remove_missing', how='any')
+    return outcome, follow_up[1].get('message'), current_frame(client)
+
+
+@pytest.mark.parametrize('operation,params', STEPS, ids=lambda value: str(value))
+def test_out_of_core_step_matches_in_memory(app_module, monkeypatch, operation, params):
+    client_in_memory = app_module.app.test_client()
+    client_out_of_core = app_module.app.test_client()
+    for test_client in (client_in_memory, client_out_of_core):
+        with test_client.session_transaction() as sess:
+            sess['user'] = TEST_USER
+            sess['sb_access_token'] = 'test-token'
+
+    expected = run_steps(client_in_memory, app_module, monkeypatch, 1 << 40, operation, params)
+    actual = run_steps(client_out_of_core, app_module, monkeypatch, 1, operation, params)
+
+    assert actual[0] == expected[0]
+    assert actual[1] == expected[1] # remove_missing afterwards sees the same missing values
+    pd.testing.assert_frame_equal(actual[2].reset_index(drop=True), expected[2].reset_index(drop=True))
+
+
+def test_first_row_validation_rejects_bad_params(client, app_module, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, 'LARGE_DATASET_BYTES', 1)
+    load_frame(client, make_frame())
+    status, payload = clean(client, 'change_case', column='name', case_type='sideways')
+    assert status == 400
+    assert 'Invalid case type' in payload['error']
+    status, payload = clean(client, 'remove_spaces', column='missing')
+    assert status == 400
+
+
+def test_categorical_text_steps_run_out_of_core(client, app_module, monkeypatch):
+    committed = []
+    commit_large_version = app_module.commit_large_version
+    monkeypatch.setattr(app_module, 'commit_large_version',
+                        lambda store_id, manifest, step: committed.append(step) or commit_large_version(store_id, manifest, step))
+    monkeypatch.setitem(app_module.app.config, 'LARGE_DATASET_BYTES', 1)
+    monkeypatch.setitem(app_module.app.config, 'LARGE_DATASET_CHUNK_ROWS', 16)
+    load_frame(client, make_frame())
+    assert clean(client, 'remove_spaces', column='grade')[0] == 200
+    assert clean(client, 'change_case', column='name', case_type='lower')[0] == 200
+    status, payload = clean(client, 'remove_missing', how='any')
+    assert status == 200
+    assert [step['operation'] for step in committed] == ['remove_spaces', 'change_case', 'remove_missing']
+    assert 'nan' in current_frame(client)['grade'].tolist() # Text steps write missing values as 'nan'
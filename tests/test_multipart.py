@@ -0,0 +1,130 @@
+import hashlib
+import io
+
+import pytest
+
+from conftest import current_frame, wait_ingest
+
+BOUNDARY = b'----datawarp7MA4YWxk'
+
+# Holds a prefix of the delimiter and bare CRLFs, which must come through as data
+CONTENT = b'a,b\r\n1,--x\r\n\r\n------datawarp7MA4\r\n' + b'2,3\n' * 500
+
+
+def part(name, value, filename=None):
+    disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename is not None else '')
+    return b'--' + BOUNDARY + f'\r\nContent-Disposition: {disposition}\r\n\r\n'.encode() + value + b'\r\n'
+
+
+def multipart_body(*parts, close=True):
+    return b''.join(parts) + (b'--' + BOUNDARY + b'--\r\n' if close else b'')
+
+
+BODY = multipart_body(part('expected_version', b'3'), part('other', b'x', filename='skip.txt'),
+                      part('file', CONTENT, filename='data.csv'), part('after', b'ignored'))
+
+
+class TrickleStream(io.RawIOBase):
+    """Returns at most `size` bytes per read, as a slow socket would."""
+
+    def __init__(self, data, size):
+        self._data, self._size = io.BytesIO(data), size
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk = self._data.read(min(len(buffer), self._size))
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+
+def reader(app_module, body=BODY, size=4096, chunk_size=None):
+    with app_module.app.app_context():
+        return app_module.MultipartFileReader(TrickleStream(body, size), BOUNDARY, chunk_size=chunk_size or size)
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 19, 64, 4096])
+def test_file_part_survives_any_read_split(app_module, size):
+    upload = reader(app_module, size=size)
+    assert upload.filename == 'data.csv'
+    assert upload.fields == {'expected_version': '3'} # Fields before the file; other file parts skipped
+    assert upload.read() == CONTENT
+    assert upload.done.is_set()
+    assert upload.finish() == {'filename': 'data.csv', 'bytes': len(CONTENT), 'sha256': hashlib.sha256(CONTENT).hexdigest()}
+
+
+def test_reads_fill_the_buffer_until_the_file_ends(app_module):
+    upload = reader(app_module, size=5)
+    sizes = []
+    while True:
+        chunk = upload.read(100)
+        if not chunk:
+            break
+        sizes.append(len(chunk))
+    assert sizes[:-1] == [100] * (len(sizes) - 1) and sum(sizes) == len(CONTENT)
+
+
+def test_peeked_sample_is_read_again(app_module):
+    upload = reader(app_module, size=3)
+    assert upload.peek_sample(10) == CONTENT[:10]
+    assert upload.peek_sample(40) == CONTENT[:40]
+    assert upload.read() == CONTENT
+    assert upload.finish()['sha256'] == hashlib.sha256(CONTENT).hexdigest()
+
+
+@pytest.mark.parametrize('body, filename', [
+    (multipart_body(part('note', b'hi')), None), # No file part
+    (multipart_body(part('file', b'', filename='')), ''), # Browser sent the form with no file picked
+])
+def test_bodies_without_a_usable_file(app_module, body, filename):
+    assert reader(app_module, body=body).filename == filename
+
+
+@pytest.mark.parametrize('body', [b'', b'not multipart at all', b'--' + BOUNDARY + b'\r\n\r\nno headers\r\n'])
+def test_malformed_body_is_rejected_before_the_file(app_module, body):
+    with pytest.raises(ValueError):
+        reader(app_module, body=body, size=4)
+
+
+def test_truncated_body_fails_while_reading(app_module):
+    upload = reader(app_module, body=multipart_body(part('file', CONTENT, filename='data.csv'), close=False)[:-300])
+    with pytest.raises(ValueError):
+        upload.read()
+
+
+def post(client, body, content_type=f'multipart/form-data; boundary={BOUNDARY.decode()}'):
+    return client.post('/upload', data=body, content_type=content_type)
+
+
+def test_upload_route_streams_the_file(client):
+    cell = b'--' + BOUNDARY + b'--'
+    content = b'a,b\r\n' + b'x,2\r\n' * 250 + b'"' + cell + b'",1\r\n' + b'x,2\r\n' * 250
+    wait_ingest(client, post(client, multipart_body(part('expected_version', b'0'), part('file', content, filename='data.csv'))))
+    df = current_frame(client)
+    assert df.shape == (501, 2)
+    assert df['a'].iloc[250] == cell.decode() # The closing delimiter only counts after a CRLF
+    assert df['b'].sum() == 1001
+
+
+@pytest.mark.parametrize('body, content_type, message', [
+    (b'not multipart', None, 'Error processing file'),
+    (BODY, 'multipart/form-data', 'No file part'), # No boundary
+    (BODY, 'text/plain', 'No file part'),
+    (multipart_body(part('note', b'hi')), None, 'No file part'),
+    (multipart_body(part('file', b'', filename='')), None, 'No selected file'),
+    (multipart_body(part('file', b'x', filename='data.exe')), None, 'Invalid file type'),
+])
+def test_upload_route_rejects_bad_bodies(client, body, content_type, message):
+    response = post(client, body, *([content_type] if content_type else []))
+    assert response.status_code == 302 and response.headers['Location'].endswith('/')
+    with client.session_transaction() as sess:
+        assert any(message in text for _, text in sess.get('_flashes', []))
+
+
+def test_truncated_upload_fails_its_job(client):
+    response = post(client, multipart_body(part('file', CONTENT, filename='data.csv'), close=False))
+    with pytest.raises(AssertionError, match='Error processing file'):
+        wait_ingest(client, response)
+    with client.session_transaction() as sess:
+        assert 'dataset_handle' not in sess
@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import clean, load_frame
+
+
+def to_html_preview(app_module, df, max_rows=999):
+    """The preview as DataFrame.to_html rendered it before the column-wise renderer."""
+    display_df = df.head(max_rows).copy()
+    display_df.insert(0, '#', range(1, len(display_df) + 1), allow_duplicates=True)
+    return display_df.to_html(classes=app_module.PREVIEW_TABLE_CLASSES, index=False, border=0, escape=True, na_rep='')
+
+
+COLUMNS = {
+    'int': [1, -20, 300, 4],
+    'float': [1.5, np.nan, 2.25, 100.0],
+    'float_whole': [1.0, 2.0, np.nan, 4.0],
+    'float_scientific': [1e-9, 2.5, 3e7, np.nan],
+    'float_inf': [np.inf, -np.inf, 1.25, np.nan],
+    'bool': [True, False, True, False],
+    'text': ['<b>', ' padded ', None, 'a & b'],
+    'text_nan': ['x', np.nan, 'y', 'z'],
+    'mixed': [1, 'two', 3.5, None],
+    'category': pd.Categorical(['a<b', None, ' c ', 'a<b']),
+    'ordered_category': pd.Categorical(['lo', 'hi', 'lo', None], categories=['lo', 'hi', 'unused'], ordered=True),
+    'int_category': pd.Categorical([3, 1, None, 3]),
+    'Int64': pd.array([1, None, 3, 4], dtype='Int64'),
+    'datetime': pd.to_datetime(['2024-01-01', None, '2024-02-01', '2024-03-01']),
+    'datetime_time': pd.to_datetime(['2024-01-01 10:30:00', None, '2024-02-01 00:00:00', '2024-03-01 23:59:59']),
+    'datetime_tz': pd.to_datetime(['2024-01-01', None, '2024-02-01', '2024-03-01']).tz_localize('UTC'),
+}
+
+
+@pytest.mark.parametrize('name', list(COLUMNS))
+def test_renderer_matches_to_html(app_module, name):
+    df = pd.DataFrame({name: COLUMNS[name], 'other': [1, 2, 3, 4]})
+    html, rows, columns = app_module.render_table_html(df)
+    assert html == to_html_preview(app_module, df)
+    assert (rows, columns) == (4, 2)
+
+
+def test_renderer_matches_to_html_on_a_long_mixed_frame(app_module):
+    df = pd.concat([pd.DataFrame(COLUMNS)] * 300, ignore_index=True) # More rows than the preview shows
+    html, rows, _ = app_module.render_table_html(df)
+    assert rows == 1200
+    assert html == to_html_preview(app_module, df)
+
+
+def test_renderer_matches_to_html_on_random_floats(app_module):
+    rng = np.random.default_rng(1)
+    df = pd.DataFrame({f'f{i}': np.round(rng.random(50) * 10 ** (i % 7), i % 8) for i in range(40)})
+    html, _, _ = app_module.render_table_html(df)
+    assert html == to_html_preview(app_module, df)
+
+
+@pytest.mark.parametrize('url', ['/clean', '/grid'])
+def test_unchanged_page_is_not_sent_again(client, url):
+    load_frame(client, pd.DataFrame(COLUMNS))
+    first = client.get(url)
+    assert first.status_code == 200 and first.headers['ETag']
+    assert first.headers['Cache-Control'] == 'private, no-cache'
+
+    repeat = client.get(url, headers={'If-None-Match': first.headers['ETag']})
+    assert repeat.status_code == 304
+    assert repeat.data == b''
+    assert repeat.headers['ETag'] == first.headers['ETag']
+
+
+@pytest.mark.parametrize('url', ['/clean', '/grid'])
+def test_cleaning_step_changes_the_etag(client, url):
+    load_frame(client, pd.DataFrame(COLUMNS))
+    etag = client.get(url).headers['ETag']
+    assert clean(client, 'remove_spaces', column='text')[0] == 200
+    after = client.get(url, headers={'If-None-Match': etag})
+    assert after.status_code == 200
+    assert after.headers['ETag'] != etag
+    assert client.post('/undo').status_code == 200
+    assert client.get(url).headers['ETag'] != after.headers['ETag']
+
+
+def test_grid_etag_follows_the_page_and_the_view(client):
+    load_frame(client, pd.DataFrame(COLUMNS))
+    etag = client.get('/grid', query_string={'limit': 2}).headers['ETag']
+    assert client.get('/grid', query_string={'offset': 2, 'limit': 2}).headers['ETag'] != etag
+    response = client.post('/sort_view', json={'columns_to_sort_by': ['int'], 'ascending': True})
+    assert response.status_code == 200
+    assert client.get('/grid', query_string={'limit': 2}, headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_page_with_a_flashed_message_is_not_tagged(client):
+    load_frame(client, pd.DataFrame(COLUMNS))
+    with client.session_transaction() as sess:
+        sess['_flashes'] = [('info', 'Loaded.')]
+    response = client.get('/clean')
+    assert response.status_code == 200 and 'ETag' not in response.headers # Flashes are shown once
@@ -0,0 +1,99 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from conftest import clean, load_frame
+
+NAMES = ['delta', 'alpha', 'echo', 'bravo', 'charlie', 'alpha', 'foxtrot', 'golf']
+
+
+@pytest.fixture
+def store_id(client):
+    return load_frame(client, pd.DataFrame({'name': NAMES, 'n': range(len(NAMES))}))
+
+
+def dataset_state(app_module, store_id):
+    """The version pointer, undo/redo stacks and the files of the store on disk."""
+    with open(app_module.get_dataset_state_path(store_id)) as f:
+        state = json.load(f)
+    return state, sorted(os.listdir(app_module.get_dataset_store_dir(store_id)))
+
+
+def grid_column(client, column=0, **args):
+    return [row[column] for row in client.get('/grid', query_string=args).get_json()['rows']]
+
+
+def sort_view(client, columns, ascending=True):
+    response = client.post('/sort_view', json={'columns_to_sort_by': columns, 'ascending': ascending})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def search(client, column, term):
+    response = client.post('/perform_search', json={'column': column, 'term': term})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def test_sort_view_orders_pages_without_touching_the_data(client, app_module, store_id):
+    before = dataset_state(app_module, store_id)
+    payload = sort_view(client, ['name'])
+    assert payload['grid']['rows'][0] == ['alpha', '1']
+    assert grid_column(client) == sorted(NAMES)
+    assert grid_column(client, offset=3, limit=2) == sorted(NAMES)[3:5]
+    assert grid_column(client, column=1) == ['1', '5', '3', '4', '0', '2', '6', '7'] # Stable for the tie
+    assert dataset_state(app_module, store_id) == before # Same version and undo stack, no new files
+
+    sort_view(client, ['n'], ascending=False)
+    assert grid_column(client, column=1) == [str(n) for n in reversed(range(len(NAMES)))]
+    assert sort_view(client, [])['sort_applied'] is False
+    assert grid_column(client) == NAMES
+
+
+def test_search_view_pages_through_matches_only(client, app_module, store_id):
+    before = dataset_state(app_module, store_id)
+    payload = search(client, 'name', 'A')
+    assert payload['filtered_row_count'] == 5 and payload['original_row_count'] == len(NAMES)
+    assert grid_column(client) == ['delta', 'alpha', 'bravo', 'charlie', 'alpha']
+    assert grid_column(client, offset=3, limit=10) == ['charlie', 'alpha']
+
+    sort_view(client, ['name'], ascending=False) # Search and sort combine
+    assert grid_column(client) == ['delta', 'charlie', 'bravo', 'alpha', 'alpha']
+    assert dataset_state(app_module, store_id) == before
+
+    assert client.post('/clear_search_filter').status_code == 200
+    assert grid_column(client) == sorted(NAMES, reverse=True)
+
+
+def test_invalid_sort_leaves_no_view(client, store_id):
+    response = client.post('/sort_view', json={'columns_to_sort_by': ['missing'], 'ascending': True})
+    assert response.status_code == 400
+    assert client.get('/grid').get_json()['view'] is None
+
+
+def test_view_is_recomputed_for_the_version_a_step_produces(client, store_id):
+    sort_view(client, ['name'])
+    search(client, 'name', 'a')
+    assert clean(client, 'replace_text', column='name', text_to_find='alpha', replace_with='zulu')[0] == 200
+    page = client.get('/grid').get_json()
+    assert page['view'] == {'search': {'column': 'name', 'term_raw': 'a'}, 'sort': {'columns': ['name'], 'ascending': True}}
+    assert [row[0] for row in page['rows']] == ['bravo', 'charlie', 'delta'] # 'zulu' no longer matches
+
+    assert client.post('/undo').status_code == 200
+    assert grid_column(client) == ['alpha', 'alpha', 'bravo', 'charlie', 'delta']
+
+
+def test_view_parts_on_removed_columns_are_reset(client, store_id):
+    search(client, 'name', 'a')
+    sort_view(client, ['n'], ascending=False)
+    assert clean(client, 'rename_column', old_name='name', new_name='label')[0] == 200
+    page = client.get('/grid').get_json()
+    assert page['view'] == {'sort': {'columns': ['n'], 'ascending': False}}
+    assert page['total_rows'] == len(NAMES)
+
+    assert clean(client, 'drop_columns', columns_to_drop=['n'])[0] == 200
+    page = client.get('/grid').get_json()
+    assert page['view'] is None
+    assert [row[0] for row in page['rows']] == NAMES
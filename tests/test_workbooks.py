@@ -0,0 +1,46 @@
+import os
+
+import pandas as pd
+import pytest
+
+from conftest import current_frame, upload, wait_ingest
+
+
+def write_workbook(path, sheets):
+    with pd.ExcelWriter(path, engine='openpyxl') as writer:
+        for name, df in sheets.items():
+            df.to_excel(writer, sheet_name=name, index=False)
+
+
+def test_sheets_are_read_in_spawned_workers(app_module, tmp_path, monkeypatch):
+    sheets = {f'S{i}': pd.DataFrame({'n': range(i, i + 5), 'label': list('abcde')}) for i in range(3)}
+    path = str(tmp_path / 'book.xlsx')
+    write_workbook(path, sheets)
+    monkeypatch.setitem(app_module.app.config, 'XLSX_SHEET_WORKERS', 2)
+    frames = app_module.read_workbook_sheets(path, list(sheets))
+    for frame, expected in zip(frames, sheets.values()):
+        pd.testing.assert_frame_equal(frame, expected)
+
+
+@pytest.fixture
+def workbook_bytes(tmp_path):
+    path = tmp_path / 'book.xlsx'
+    write_workbook(str(path), {'Main': pd.DataFrame({'a': [1, 2]}), 'Extra': pd.DataFrame({'b': [3]})})
+    return path.read_bytes()
+
+
+@pytest.mark.parametrize('save_others, saved', [(False, []), (True, ['book_Extra.parquet'])])
+def test_other_sheets_are_saved_only_when_asked(app_module, client, workbook_bytes, tmp_path, monkeypatch, save_others, saved):
+    folder = tmp_path / 'saved'
+    folder.mkdir()
+    monkeypatch.setitem(app_module.app.config, 'SAVED_SESSIONS_FOLDER', str(folder))
+    picker = wait_ingest(client, upload(client, workbook_bytes, 'book.xlsx'))['redirect']
+    form = {'files': ['0', '1'], 'mode': 'separate', **({'save_others': '1'} if save_others else {})}
+    response = client.post(picker, data=form)
+    if save_others:
+        wait_ingest(client, response)
+        assert current_frame(client).shape == (2, 1)
+    else:
+        assert response.headers['Location'].endswith(picker)
+    assert sorted(os.listdir(folder)) == saved
+